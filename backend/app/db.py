@@ -1,6 +1,102 @@
-from sqlalchemy import create_engine
+"""
+数据库引擎工厂
+
+连接串：SQLALCHEMY_DATABASE_URL（默认 sqlite:///./iot_zt_ai.db，docker-compose 中设置）
+
+SQLite（DB_SQLITE_PROFILE=tuned，默认）在每个新连接上执行 PRAGMA：
+  - journal_mode   SQLITE_JOURNAL_MODE    默认 WAL（读写互不阻塞，写入只追加 WAL）
+  - synchronous    SQLITE_SYNCHRONOUS     默认 NORMAL（WAL 下仅 checkpoint 时 fsync；断电可能丢最近事务，不会损坏库）
+  - busy_timeout   SQLITE_BUSY_TIMEOUT_MS 默认 5000（多线程 / 多进程写入时等待锁而不是立即报 database is locked）
+  - mmap_size      SQLITE_MMAP_SIZE       默认 268435456（256 MiB 内存映射读）
+  - cache_size     SQLITE_CACHE_SIZE      默认 -65536（负数单位 KiB，即 64 MiB 页缓存）
+  - temp_store     SQLITE_TEMP_STORE      默认 MEMORY（GROUP BY / DISTINCT 临时 B-tree 放内存）
+DB_SQLITE_PROFILE=default 时不设置任何 PRAGMA（SQLite 默认：rollback journal + FULL）。
+
+服务端数据库（PostgreSQL 等）连接池：
+  - DB_POOL_SIZE（默认 5）/ DB_MAX_OVERFLOW（默认 10）/ DB_POOL_TIMEOUT（默认 30 秒）
+  - DB_POOL_RECYCLE（默认 1800 秒，-1 关闭）/ DB_POOL_PRE_PING（默认 1）
+
+对比各 profile 的写入与评估吞吐：python scripts/bench_db_profile.py
+"""
+
+import os
+from typing import Any, Dict, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./iot_zt_ai.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+SQLALCHEMY_DATABASE_URL = os.getenv("SQLALCHEMY_DATABASE_URL", "sqlite:///./iot_zt_ai.db")
+SQLITE_PROFILE = os.getenv("DB_SQLITE_PROFILE", "tuned").lower()
+
+SQLITE_PRAGMAS: Dict[str, str] = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"),
+    "mmap_size": os.getenv("SQLITE_MMAP_SIZE", "268435456"),
+    "cache_size": os.getenv("SQLITE_CACHE_SIZE", "-65536"),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+
+def _pool_options() -> Dict[str, Any]:
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") != "0",
+    }
+
+
+def apply_sqlite_pragmas(engine: Engine, pragmas: Dict[str, str]) -> None:
+    """
+    注册 connect 事件：每个新建的 DBAPI 连接执行一遍 PRAGMA。
+    """
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        try:
+            for name, value in pragmas.items():
+                cur.execute(f"PRAGMA {name}={value}")
+        finally:
+            cur.close()
+
+
+def create_db_engine(url: Optional[str] = None, sqlite_profile: Optional[str] = None) -> Engine:
+    """
+    按连接串创建引擎：SQLite 应用 profile 对应的 PRAGMA，其它数据库使用可调连接池。
+    """
+    url = url or SQLALCHEMY_DATABASE_URL
+    profile = (sqlite_profile or SQLITE_PROFILE).lower()
+    if make_url(url).get_backend_name() == "sqlite":
+        engine = create_engine(url, connect_args={"check_same_thread": False})
+        if profile == "tuned":
+            apply_sqlite_pragmas(engine, SQLITE_PRAGMAS)
+        elif profile != "default":
+            raise ValueError(f"unknown DB_SQLITE_PROFILE: {profile}")
+        return engine
+    return create_engine(url, **_pool_options())
+
+
+def runtime_info(engine: Engine) -> Dict[str, Any]:
+    """
+    当前引擎的方言 / 连接池 / 生效的 SQLite PRAGMA（健康检查使用，连接串隐藏密码）。
+    """
+    info: Dict[str, Any] = {
+        "url": engine.url.render_as_string(hide_password=True),
+        "dialect": engine.dialect.name,
+        "pool": engine.pool.status(),
+    }
+    if engine.dialect.name == "sqlite":
+        info["sqlite_profile"] = SQLITE_PROFILE
+        with engine.connect() as conn:
+            info["pragmas"] = {
+                name: conn.exec_driver_sql(f"PRAGMA {name}").scalar() for name in SQLITE_PRAGMAS
+            }
+    return info
+
+
+engine = create_db_engine()
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
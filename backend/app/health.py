@@ -1,8 +1,36 @@
 from fastapi import APIRouter
 
+from .db import engine, runtime_info
+from .services import ingest_queue
+from .services.risk_config import WATCH_SECONDS, risk_config
+
 router = APIRouter()
 
 
 @router.get("/health", tags=["health"])
 def health():
     return {"status": "ok"}
+
+
+@router.get("/health/config", tags=["health"])
+def health_config():
+    """
+    当前 worker 进程正在使用的风险配置版本（多 worker 时按 pid / digest 对比是否已同步）
+    """
+    return {**risk_config.runtime_info(), "watch_seconds": WATCH_SECONDS}
+
+
+@router.get("/health/ingest-queue", tags=["health"])
+def health_ingest_queue():
+    """
+    当前 worker 的事件写入队列深度与刷盘指标
+    """
+    return ingest_queue.status()
+
+
+@router.get("/health/db", tags=["health"])
+def health_db():
+    """
+    数据库方言、连接池状态与当前连接实际生效的 SQLite PRAGMA
+    """
+    return runtime_info(engine)
@@ -1,4 +1,6 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -11,11 +13,39 @@ from .health import router as health_router
 
 # 确保在应用加载时创建所有表（CI/全新环境必需）
 from .models import Base
-from .routers import device, device_events, risk, user
+from .routers import device, device_events, risk, risk_scheduler_admin, user
+from .services import retention, risk_scheduler, scheduler_async
+from .services.event_columns import ensure_backfilled, ensure_columns, widen_columns
+from .services.query_plans import ensure_indexes
+from .services.risk_config import start_watcher
 
 Base.metadata.create_all(bind=engine)
+# 已有库补齐 device_events 热点列，并从 payload 回填历史事件（见 services/event_columns.py）
+widened = widen_columns(engine)
+ensure_backfilled(engine, ensure_columns(engine), rewrite=bool(widened))
+# 已有库补建复合索引（create_all 只在建表时创建索引）
+ensure_indexes(engine)
 
-app = FastAPI(title="IoT Zero Trust AI Platform")
+# 每个 worker 进程监听 risk_config.json，其它 worker 修改配置后在轮询间隔内生效
+start_watcher()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 风险调度器随应用启停：asyncio 调度循环，阻塞的评估工作在专用执行器线程中运行
+    risk_scheduler.attach_async(asyncio.get_running_loop())
+    if scheduler_async.AUTOSTART:
+        await asyncio.to_thread(risk_scheduler.start_scheduler, scheduler_async.DEFAULT_INTERVAL)
+    try:
+        yield
+    finally:
+        # 等待正在执行的一轮评估结束后再退出
+        await asyncio.to_thread(risk_scheduler.stop_scheduler)
+        await asyncio.to_thread(retention.stop_retention)
+        risk_scheduler.detach_async()
+
+
+app = FastAPI(title="IoT Zero Trust AI Platform", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,6 +60,7 @@ app.include_router(user.router)
 app.include_router(device.router)
 app.include_router(device_events.router)
 app.include_router(risk.router)
+app.include_router(risk_scheduler_admin.router)
 app.include_router(health_router)
 
 
@@ -1,9 +1,21 @@
 import os
 from datetime import UTC, datetime
-from typing import TYPE_CHECKING, Any, Optional
+from typing import TYPE_CHECKING, Any, Dict, Optional
 
-from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Integer, String, Text
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Text,
+    UniqueConstraint,
+)
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, validates
 
 # JSON_TYPE 必须加类型注解，否则 mypy 报 Cannot assign multiple types
 try:
@@ -76,25 +88,163 @@ class DeviceLog(Base):
     device_id: Mapped[int] = mapped_column(ForeignKey("devices.id"))
     log_type: Mapped[str] = mapped_column(String(32))
     message: Mapped[str] = mapped_column(Text)
+    # 保留期清理按时间范围取批
     timestamp: Mapped[datetime] = mapped_column(
-        DateTime(timezone=True), nullable=False, default=lambda: datetime.now(UTC)
+        DateTime(timezone=True), nullable=False, index=True, default=lambda: datetime.now(UTC)
     )
     device: Mapped["Device"] = relationship("Device")
 
 
+def _hot_text(v: Any) -> Optional[str]:
+    # 与逐行读取 payload 的原实现一致：只取真值；非字符串标量按 str() 比较，列表 / 字典等不参与
+    if isinstance(v, (str, int, float)) and v:
+        return str(v)
+    return None
+
+
+def extract_hot_columns(payload: Any) -> Dict[str, Any]:
+    """
+    从事件 payload 提取评分常用字段（bytes_out / protocol / cmd），缺失或类型不符时为 None。
+    保留完整值（不截断、浮点流量不取整），评分结果与直接读取 payload 相同。
+    写入路径（ORM 赋值 payload 时自动调用、Core 批量写入的 build_values）与回填共用。
+    """
+    p = payload if isinstance(payload, dict) else {}
+    v = p.get("bytes_out")
+    bytes_out = v if isinstance(v, (int, float)) and not isinstance(v, bool) else None
+    return {
+        "bytes_out": bytes_out,
+        "protocol": _hot_text(p.get("protocol")),
+        "cmd": _hot_text(p.get("cmd")),
+    }
+
+
 class DeviceEvent(Base):
+    """
+    设备事件；payload 保留完整原始数据（展示用），
+    bytes_out / protocol / cmd 为写入时从 payload 提取的类型化列（聚合 / 过滤使用）
+    """
+
     __tablename__ = "device_events"
+    # 按风险引擎访问模式建立复合索引，见 services/query_plans.py；
+    # device_id 单列索引保留：按 id 排序的事件列表与 max(id) 水位查询依赖其隐式 rowid 顺序
+    __table_args__ = (
+        Index("ix_device_events_device_ts", "device_id", "ts"),
+        Index("ix_device_events_device_type_ts", "device_id", "event_type", "ts"),
+        Index("ix_device_events_device_ingested", "device_id", "ingested_at"),
+    )
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     device_id: Mapped[int] = mapped_column(ForeignKey("devices.id"), index=True, nullable=False)
-    event_type: Mapped[str] = mapped_column(String(50), index=True, nullable=False)
+    event_type: Mapped[str] = mapped_column(String(50), nullable=False)
     ts: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), index=True, nullable=False, default=lambda: datetime.now(UTC)
     )
     payload: Mapped[Any] = mapped_column(JSON_TYPE, nullable=True)
+    # 浮点列：payload 中的非整数流量原样保留（整数值在评分时还原为 int）
+    bytes_out: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    protocol: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    cmd: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     ingested_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), nullable=False, default=lambda: datetime.now(UTC)
     )
-    device: Mapped["Device"] = relationship("Device", lazy="joined")
+    # 按需加载：事件查询（列表 / 评分）都不使用 device，避免每行 JOIN devices
+    device: Mapped["Device"] = relationship("Device", lazy="select")
+
+    @validates("payload")
+    def _sync_hot_columns(self, key: str, payload: Any) -> Any:
+        for name, value in extract_hot_columns(payload).items():
+            setattr(self, name, value)
+        return payload
+
+
+class EventIdCounter(Base):
+    """
+    分区事件存储的全局事件 id 分配器（EVENT_PARTITIONS=1 时使用，见 services/event_store.py）
+    next_id 为下一个可分配的 id，按批整段分配
+    """
+
+    __tablename__ = "event_id_counters"
+    name: Mapped[str] = mapped_column(String(32), primary_key=True)
+    next_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+
+class SchedulerNode(Base):
+    """
+    多节点调度的成员表：各节点定期刷新 heartbeat_at，未过期的节点参与分片均分
+    """
+
+    __tablename__ = "scheduler_nodes"
+    node_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    heartbeat_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+
+class SchedulerLease(Base):
+    """
+    调度分片租约：shard 覆盖 device_id % 分片数 == shard 的设备；
+    owner 为持有节点，expires_at 前未续约视为节点失联，其它节点可接管
+    """
+
+    __tablename__ = "scheduler_leases"
+    shard: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    owner: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class JobLease(Base):
+    """
+    单实例后台任务（如保留期清理）的跨进程互斥租约：
+    owner 持有至 expires_at，期间其它进程 / 节点不能执行同名任务，过期未续约后可接管
+    """
+
+    __tablename__ = "job_leases"
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    owner: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
+    expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class DeviceProtocol(Base):
+    """
+    设备已出现过的 net_flow 协议索引（new_protocol 指标使用）
+    first_seen 为该协议在该设备事件中的最早 ts
+    """
+
+    __tablename__ = "device_protocols"
+    __table_args__ = (UniqueConstraint("device_id", "protocol", name="uq_device_protocol"),)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    device_id: Mapped[int] = mapped_column(ForeignKey("devices.id"), index=True, nullable=False)
+    protocol: Mapped[str] = mapped_column(Text, nullable=False)
+    first_seen: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+
+class DeviceFlowRollup(Base):
+    """
+    net_flow 流量小时汇总（flow_spike 24h 基线使用）
+    仅统计 bytes_out > 0 的事件；bucket_start 为 UTC 整点
+    """
+
+    __tablename__ = "device_flow_rollups"
+    __table_args__ = (UniqueConstraint("device_id", "bucket_start", name="uq_device_flow_bucket"),)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    device_id: Mapped[int] = mapped_column(ForeignKey("devices.id"), index=True, nullable=False)
+    bucket_start: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    bytes_sum: Mapped[float] = mapped_column(Float, nullable=False, default=0)
+    flow_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    bytes_max: Mapped[float] = mapped_column(Float, nullable=False, default=0)
+
+
+class DeviceRiskState(Base):
+    """
+    设备最近一次评估时的事件水位（调度器变更驱动评估使用）
+    last_event_id: 评估开始前该设备的最大事件 id
+    window_events: 该次评估窗口内的事件数（>0 表示窗口内容会随时间过期而变化）
+    """
+
+    __tablename__ = "device_risk_states"
+    device_id: Mapped[int] = mapped_column(ForeignKey("devices.id"), primary_key=True)
+    last_event_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    window_events: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    evaluated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, default=lambda: datetime.now(UTC)
+    )
 
 
 class RiskScore(Base):
@@ -116,11 +266,41 @@ class RiskScore(Base):
     device: Mapped["Device"] = relationship("Device", lazy="joined")
 
 
+class RiskScoreHourly(Base):
+    """
+    risk_scores 小时汇总（保留期任务删除过期评分前降采样写入）
+    bucket_start 为 window_end 所在的 UTC 整点；level_counts: {level: 条数}
+    保存 score_sum 而非均值，同一小时分多批汇总时可直接累加。
+    """
+
+    __tablename__ = "risk_score_hourly"
+    __table_args__ = (
+        UniqueConstraint("device_id", "bucket_start", name="uq_risk_score_hourly_bucket"),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True)
+    device_id: Mapped[int] = mapped_column(ForeignKey("devices.id"), index=True, nullable=False)
+    bucket_start: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), index=True, nullable=False
+    )
+    score_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    score_sum: Mapped[float] = mapped_column(Float, nullable=False, default=0)
+    score_min: Mapped[float] = mapped_column(Float, nullable=False)
+    score_max: Mapped[float] = mapped_column(Float, nullable=False)
+    level_counts: Mapped[Any] = mapped_column(JSON_TYPE, nullable=False, default=dict)
+
+    @property
+    def score_avg(self) -> float:
+        return self.score_sum / self.score_count if self.score_count else 0.0
+
+
 class RiskAction(Base):
     __tablename__ = "risk_actions"
+    # 最近隔离 / 恢复动作查询：device_id + action_type 定位后按 id 倒序
+    __table_args__ = (Index("ix_risk_actions_device_action", "device_id", "action_type"),)
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     device_id: Mapped[int] = mapped_column(ForeignKey("devices.id"), index=True, nullable=False)
-    score_id: Mapped[int] = mapped_column(ForeignKey("risk_scores.id"), nullable=True)
+    # 索引：保留期清理按 score_id 判断评分是否仍被引用
+    score_id: Mapped[int] = mapped_column(ForeignKey("risk_scores.id"), index=True, nullable=True)
     action_type: Mapped[str] = mapped_column(String(30), nullable=False)
     executed: Mapped[bool] = mapped_column(Boolean, default=False)
     detail: Mapped[Any] = mapped_column(JSON_TYPE, nullable=True)
@@ -13,6 +13,7 @@ except Exception:
     SessionLocal = None  # type: ignore
 
 from .. import auth
+from ..services.event_ingest import purge_device
 
 router = APIRouter(prefix="/devices", tags=["Devices"])
 
@@ -160,6 +161,7 @@ def delete_device(
     )
     db.query(RiskAction).filter(RiskAction.device_id == device_id).delete(synchronize_session=False)
     db.query(DeviceLog).filter(DeviceLog.device_id == device_id).delete(synchronize_session=False)
+    purge_device(db, device_id)
 
     db.delete(device)
     db.commit()
@@ -6,6 +6,7 @@ from ..auth import get_current_user
 
 # 模型：按你的项目结构常见命名导入，如有差异可参考 device_events.py / risk_actions.py 的导入写法调整
 from ..models import Device, DeviceEvent, RiskAction
+from ..services.event_ingest import purge_device
 
 # 复用已有的 get_db：从同目录的 device 路由导入（你的项目里每个路由都有自己的 get_db）
 from .device import get_db
@@ -48,6 +49,7 @@ def delete_device(
         synchronize_session=False
     )
     db.query(RiskAction).where(RiskAction.device_id == device_id).delete(synchronize_session=False)
+    purge_device(db, device_id)
 
     db.delete(device)
     db.commit()
@@ -1,18 +1,31 @@
+import json
+import os
 from datetime import UTC, datetime
 from typing import Any, Dict, List, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from pydantic import BaseModel, ConfigDict, Field, field_validator
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
 from sqlalchemy.orm import Session
 
 from .. import auth
-from ..models import Device, DeviceEvent, User
+from ..models import Device, User
+from ..services import event_store, ingest_queue
+from ..services.event_ingest import build_values, insert_events
 
 router = APIRouter(prefix="/devices", tags=["Device Events"])
 
 # 统一 DB 依赖
 get_db = auth.get_db
 
+# NDJSON 流式写入：每累积 NDJSON_CHUNK_SIZE 条有效事件写入并提交一次
+NDJSON_CHUNK_SIZE = max(1, int(os.getenv("EVENT_NDJSON_CHUNK_SIZE", "500")))
+# 单行最大字节数（超出按该行错误处理，避免异常行撑爆内存）
+NDJSON_MAX_LINE_BYTES = int(os.getenv("EVENT_NDJSON_MAX_LINE_BYTES", "65536"))
+# 响应中最多返回的逐行错误明细条数（rejected 仍为总数）
+NDJSON_MAX_ERRORS = 100
+NDJSON_CONTENT_TYPES = {"application/x-ndjson", "application/jsonl", "application/json-seq"}
+
 ALLOWED_EVENT_TYPES = {
     "auth_fail",
     "auth_success",
@@ -47,15 +60,40 @@ class DeviceEventOut(BaseModel):
     payload: Dict[str, Any]
 
 
+class EventsIngestSummary(BaseModel):
+    ingested: int
+    first_id: Optional[int] = None
+    last_id: Optional[int] = None
+    # 写入队列开启且未要求 durable 时为 True：事件已入队、尚未落库（此时无 id）
+    queued: bool = False
+    # 等待落库超时时说明事件仍在队列中（客户端不应重试）
+    note: Optional[str] = None
+
+
+def queue_write(db: Session, values: List[Dict[str, Any]], wait: bool):
+    """
+    经写入队列（若开启）写入，队列满映射为 503；等待落库超时向上抛 TimeoutError。
+    """
+    try:
+        return ingest_queue.write(db, values, wait)
+    except ingest_queue.QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+
 @router.post(
     "/{device_id}/events",
     summary="写入单条或多条设备事件",
-    response_model=List[DeviceEventOut],
+    response_model=Union[List[DeviceEventOut], EventsIngestSummary],
     status_code=status.HTTP_201_CREATED,
 )
 def add_events(
     device_id: int,
     body: Union[DeviceEventIn, EventsIn],
+    response: Response,
+    echo: bool = Query(True, description="是否回显写入的事件；false 时仅返回条数与 id 范围"),
+    durable: bool = Query(
+        False, description="启用写入队列时是否等待落库后返回（echo=true 时总是等待）"
+    ),
     db: Session = Depends(get_db),
     current_user: User = Depends(auth.get_current_user),
 ):
@@ -70,28 +108,154 @@ def add_events(
     # 统一成列表
     events_in = [body] if isinstance(body, DeviceEventIn) else body.events
 
-    rows: List[DeviceEvent] = []
     default_now = datetime.now(UTC)
-    for e in events_in:
-        ts = e.ts
-        if ts is None:
-            ts = default_now
-        else:
-            ts = ts.replace(tzinfo=UTC) if ts.tzinfo is None else ts.astimezone(UTC)
+    values = [
+        build_values(device_id, e.event_type, e.payload, e.ts, default_now) for e in events_in
+    ]
+    # 单条 INSERT ... RETURNING 批量写入，回显直接由写入参数 + 返回的 id 组装，不再逐行 refresh；
+    # 写入队列开启时与其它请求合并提交
+    try:
+        records = queue_write(db, values, wait=echo or durable)
+    except TimeoutError:
+        # 事件仍在队列中、稍后提交：按已入队应答，不返回错误码以免客户端重试重复写入
+        response.status_code = status.HTTP_202_ACCEPTED
+        return EventsIngestSummary(
+            ingested=len(values), queued=True, note=ingest_queue.NOT_DURABLE_NOTE
+        )
+    if records is None:
+        response.status_code = status.HTTP_202_ACCEPTED
+        return EventsIngestSummary(ingested=len(values), queued=True)
+    if echo:
+        return records
+    return EventsIngestSummary(
+        ingested=len(records),
+        first_id=records[0].id if records else None,
+        last_id=records[-1].id if records else None,
+    )
+
+
+class NdjsonLineError(BaseModel):
+    line: int
+    error: str
+
+
+class NdjsonIngestSummary(BaseModel):
+    lines: int
+    ingested: int
+    rejected: int
+    chunks: int
+    first_id: Optional[int] = None
+    last_id: Optional[int] = None
+    errors: List[NdjsonLineError] = Field(default_factory=list)
+
+
+def _line_error(exc: Exception) -> str:
+    if isinstance(exc, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(x) for x in err['loc']) or 'body'}: {err['msg']}"
+            for err in exc.errors()
+        )
+    if isinstance(exc, RecursionError):
+        # 深层嵌套（如大量 "["）在行长限制内即可触发解析器递归上限
+        return "line is nested too deeply"
+    return str(exc)
+
 
-        row = DeviceEvent(
-            device_id=device_id,
-            event_type=e.event_type,
-            payload=e.payload,
-            ts=ts,
+@router.post(
+    "/{device_id}/events/ndjson",
+    summary="流式写入设备事件（application/x-ndjson，每行一个事件）",
+    response_model=NdjsonIngestSummary,
+    status_code=status.HTTP_201_CREATED,
+)
+async def add_events_ndjson(
+    device_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(auth.get_current_user),
+):
+    """
+    逐行解析、校验请求体，每 NDJSON_CHUNK_SIZE 条有效事件批量写入并提交一次，
+    内存占用与上传大小无关。非法行（JSON 错误 / 字段校验失败 / 超长）计入 errors，不影响其它行；
+    已提交的块不会因后续行出错而回滚。
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in NDJSON_CONTENT_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Content-Type 需为 application/x-ndjson",
         )
-        db.add(row)
-        rows.append(row)
+    dev = await run_in_threadpool(lambda: db.query(Device).filter(Device.id == device_id).first())
+    if not dev:
+        raise HTTPException(status_code=404, detail="设备不存在")
+
+    summary = NdjsonIngestSummary(lines=0, ingested=0, rejected=0, chunks=0)
+    default_now = datetime.now(UTC)
+    chunk: List[Dict[str, Any]] = []
+
+    async def _flush() -> None:
+        records = await run_in_threadpool(insert_events, db, chunk[:])
+        chunk.clear()
+        if not records:
+            return
+        summary.ingested += len(records)
+        summary.chunks += 1
+        if summary.first_id is None:
+            summary.first_id = records[0].id
+        summary.last_id = records[-1].id
 
-    db.commit()
-    for r in rows:
-        db.refresh(r)
-    return rows
+    def _reject(line_no: int, msg: str) -> None:
+        summary.rejected += 1
+        if len(summary.errors) < NDJSON_MAX_ERRORS:
+            summary.errors.append(NdjsonLineError(line=line_no, error=msg))
+
+    def _parse(line_no: int, raw: bytes) -> None:
+        if not raw.strip():
+            return
+        try:
+            e = DeviceEventIn.model_validate(json.loads(raw))
+        except (ValueError, ValidationError, RecursionError) as exc:
+            _reject(line_no, _line_error(exc))
+            return
+        chunk.append(build_values(device_id, e.event_type, e.payload, e.ts, default_now))
+
+    too_long = f"line exceeds {NDJSON_MAX_LINE_BYTES} bytes"
+    buf = b""
+    line_no = 0
+    oversized = False
+    async for data in request.stream():
+        buf += data
+        # 按偏移扫描本块内的完整行，块末尾一次性截掉已处理部分（避免逐行切片复制剩余缓冲）
+        start = 0
+        while True:
+            nl = buf.find(b"\n", start)
+            if nl < 0:
+                break
+            line_no += 1
+            if oversized:
+                # 超长行的剩余部分已丢弃，只记录一次错误
+                oversized = False
+                _reject(line_no, too_long)
+            elif nl - start > NDJSON_MAX_LINE_BYTES:
+                _reject(line_no, too_long)
+            else:
+                _parse(line_no, buf[start:nl])
+            start = nl + 1
+            if len(chunk) >= NDJSON_CHUNK_SIZE:
+                await _flush()
+        buf = buf[start:]
+        if len(buf) > NDJSON_MAX_LINE_BYTES:
+            oversized = True
+            buf = b""
+    if oversized or buf.strip():
+        line_no += 1
+        if oversized:
+            _reject(line_no, too_long)
+        else:
+            _parse(line_no, buf)
+    if chunk:
+        await _flush()
+    summary.lines = line_no
+    return summary
 
 
 @router.get("/{device_id}/events", summary="列出最近事件", response_model=List[DeviceEventOut])
@@ -104,10 +268,6 @@ def list_events(
     dev = db.query(Device).filter(Device.id == device_id).first()
     if not dev:
         raise HTTPException(status_code=404, detail="设备不存在")
-    q = (
-        db.query(DeviceEvent)
-        .filter(DeviceEvent.device_id == device_id)
-        .order_by(DeviceEvent.id.desc())
-        .limit(limit)
-    )
+    ev = event_store.source(db)
+    q = db.query(ev).filter(ev.c.device_id == device_id).order_by(ev.c.id.desc()).limit(limit)
     return list(reversed(q.all()))  # 升序返回
@@ -1,12 +1,14 @@
 from datetime import UTC, datetime
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from sqlalchemy.orm import Session
 
 from .. import auth
 from ..db import SessionLocal
-from ..models import Device, DeviceEvent, User
+from ..models import Device, User
 from ..schemas_ai import EventIngestBatch
+from ..services import ingest_queue
+from ..services.event_ingest import build_values
 
 router = APIRouter(prefix="/events", tags=["Events"])
 
@@ -22,6 +24,8 @@ def get_db():
 @router.post("/ingest", summary="批量上报设备事件")
 def ingest_events(
     batch: EventIngestBatch,
+    response: Response,
+    durable: bool = Query(False, description="启用写入队列时是否等待落库后返回"),
     db: Session = Depends(get_db),
     current_user: User = Depends(auth.get_current_user),
 ):
@@ -37,21 +41,16 @@ def ingest_events(
             raise HTTPException(status_code=403, detail="One or more devices not owned by user")
 
     now = datetime.now(UTC)
-    rows = []
-    for ev in batch.events:
-        # 统一将 ts 转为 UTC aware
-        if ev.ts is None:
-            ts = now
-        else:
-            ts = ev.ts
-            if ts.tzinfo is None:
-                ts = ts.replace(tzinfo=UTC)
-            else:
-                ts = ts.astimezone(UTC)
-
-        rows.append(
-            DeviceEvent(device_id=ev.device_id, event_type=ev.event_type, ts=ts, payload=ev.payload)
-        )
-    db.add_all(rows)
-    db.commit()
-    return {"ingested": len(rows)}
+    # 统一将 ts 转为 UTC aware
+    rows = [
+        build_values(ev.device_id, ev.event_type, ev.payload, ev.ts, now) for ev in batch.events
+    ]
+    try:
+        written = ingest_queue.write(db, rows, wait=durable)
+    except ingest_queue.QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except TimeoutError:
+        # 事件仍在队列中、稍后提交：按已入队应答，不返回错误码以免客户端重试重复写入
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {"ingested": len(rows), "queued": True, "note": ingest_queue.NOT_DURABLE_NOTE}
+    return {"ingested": len(rows), "queued": written is None}
@@ -5,7 +5,8 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 
 from .. import auth
-from ..models import Device, DeviceEvent, RiskAction, User
+from ..models import Device, RiskAction, User
+from ..services import event_store
 
 router = APIRouter(prefix="/risk", tags=["Risk"])
 
@@ -36,13 +37,13 @@ def evaluate_device_risk_api(
         raise HTTPException(status_code=404, detail="设备不存在")
 
     since = datetime.now(UTC) - timedelta(minutes=window)
-    events: List[DeviceEvent] = (
-        db.query(DeviceEvent)
-        .filter(DeviceEvent.device_id == device_id, DeviceEvent.ts >= since)
-        .all()
-    )
+    ev = event_store.source(db, since)
+    event_types = [
+        t
+        for (t,) in db.query(ev.c.event_type).filter(ev.c.device_id == device_id, ev.c.ts >= since)
+    ]
 
-    auth_fail_count = sum(1 for e in events if (e.event_type or "").lower() == "auth_fail")
+    auth_fail_count = sum(1 for t in event_types if (t or "").lower() == "auth_fail")
     level = "high" if auth_fail_count >= 5 else "low"
 
     # 当 high 时自动记录 isolate 动作，并可标记设备为隔离
@@ -62,7 +63,7 @@ def evaluate_device_risk_api(
         "device_id": device_id,
         "window_minutes": window,
         "level": level,
-        "counts": {"auth_fail": auth_fail_count, "total": len(events)},
+        "counts": {"auth_fail": auth_fail_count, "total": len(event_types)},
     }
 
 
@@ -1,21 +1,56 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel
+from sqlalchemy.orm import Session
 
+from .. import auth
 from ..dependencies import require_admin
 from ..models import User
-from ..services.risk_scheduler import get_status, start_scheduler, stop_scheduler, update_interval
+from ..services import (
+    query_plans,
+    retention,
+    risk_metrics,
+    risk_trigger,
+    risk_window,
+    scheduler_lease,
+)
+from ..services.risk_config import risk_config
+from ..services.risk_engine import check_window_state
+from ..services.risk_scheduler import (
+    get_status,
+    start_scheduler,
+    stop_scheduler,
+    update_interval,
+    update_priority,
+)
 
 router = APIRouter(prefix="/risk/scheduler", tags=["RiskScheduler"])
 
 
 class StartRequest(BaseModel):
     interval_seconds: int = 60
+    # 并行工作线程数；不传沿用 RISK_SCHEDULER_WORKERS
+    workers: Optional[int] = None
+    # 分片进程数（> 1 启用多进程分片）；不传沿用 RISK_SCHEDULER_PROCESSES
+    processes: Optional[int] = None
+    # 自适应优先级调度；不传沿用 RISK_SCHEDULER_PRIORITY
+    priority: Optional[bool] = None
 
 
 class IntervalPatch(BaseModel):
     interval_seconds: int
 
 
+class PriorityPatch(BaseModel):
+    min_seconds: float
+    max_seconds: float
+
+
+class RetentionStartRequest(BaseModel):
+    interval_seconds: int = retention.DEFAULT_INTERVAL
+
+
 @router.get("/status", summary="查看调度器状态（管理员）")
 def scheduler_status(admin: User = Depends(require_admin)):
     return get_status()
@@ -23,7 +58,10 @@ def scheduler_status(admin: User = Depends(require_admin)):
 
 @router.post("/start", summary="启动调度器（管理员）")
 def scheduler_start(body: StartRequest, admin: User = Depends(require_admin)):
-    ok = start_scheduler(body.interval_seconds)
+    try:
+        ok = start_scheduler(body.interval_seconds, body.workers, body.processes, body.priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not ok:
         raise HTTPException(status_code=400, detail="调度器已在运行")
     return {"started": True, "status": get_status()}
@@ -44,3 +82,94 @@ def scheduler_update_interval(body: IntervalPatch, admin: User = Depends(require
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     return {"updated": True, "status": get_status()}
+
+
+@router.patch("/priority", summary="调整自适应优先级调度的最短 / 最长间隔（管理员）")
+def scheduler_update_priority(body: PriorityPatch, admin: User = Depends(require_admin)):
+    try:
+        update_priority(body.min_seconds, body.max_seconds)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"updated": True, "status": get_status()}
+
+
+@router.get("/window-state", summary="内存滑窗状态（管理员）")
+def window_state_status(admin: User = Depends(require_admin)):
+    return risk_window.status()
+
+
+@router.post("/window-state/rebuild", summary="从数据库重建内存滑窗（管理员）")
+def window_state_rebuild(db: Session = Depends(auth.get_db), admin: User = Depends(require_admin)):
+    loaded = risk_window.rebuild(db)
+    return {"rebuilt": True, "events": loaded, "status": risk_window.status()}
+
+
+@router.get("/window-state/check", summary="内存滑窗与 SQL 路径一致性检查（管理员）")
+def window_state_check(
+    window: int = Query(5, ge=1, le=60, description="统计时间窗口（分钟）"),
+    db: Session = Depends(auth.get_db),
+    admin: User = Depends(require_admin),
+):
+    return check_window_state(db, window_minutes=window)
+
+
+@router.get("/metrics", summary="评分计划与各指标 / 查询耗时（管理员）")
+def metric_timings(admin: User = Depends(require_admin)):
+    return {
+        "timing_enabled": risk_metrics.TIMING_ENABLED,
+        "plan": risk_metrics.plan(risk_config.snapshot()).describe(),
+        "timings": risk_metrics.timing_snapshot(),
+    }
+
+
+@router.post("/metrics/reset", summary="清空指标耗时统计（管理员）")
+def metric_timings_reset(admin: User = Depends(require_admin)):
+    risk_metrics.reset_timings()
+    return {"reset": True}
+
+
+@router.get("/trigger", summary="事件触发评估状态（管理员）")
+def trigger_status(admin: User = Depends(require_admin)):
+    return risk_trigger.status()
+
+
+@router.get("/query-plans", summary="热点查询执行计划（管理员）")
+def hot_query_plans(db: Session = Depends(auth.get_db), admin: User = Depends(require_admin)):
+    return query_plans.explain_all(db)
+
+
+@router.get("/retention", summary="保留期策略与清理任务状态（管理员）")
+def retention_status(admin: User = Depends(require_admin)):
+    return retention.get_status()
+
+
+@router.post("/retention/run", summary="立即执行一次保留期清理（管理员）")
+def retention_run(db: Session = Depends(auth.get_db), admin: User = Depends(require_admin)):
+    try:
+        report = retention.run_retention(db)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"ran": True, "report": report}
+
+
+@router.post("/retention/start", summary="启动周期保留期清理（管理员）")
+def retention_start(body: RetentionStartRequest, admin: User = Depends(require_admin)):
+    try:
+        ok = retention.start_retention(body.interval_seconds)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not ok:
+        raise HTTPException(status_code=400, detail="保留期任务已在运行")
+    return {"started": True, "status": retention.get_status()}
+
+
+@router.post("/retention/stop", summary="停止周期保留期清理（管理员）")
+def retention_stop(admin: User = Depends(require_admin)):
+    if not retention.stop_retention():
+        raise HTTPException(status_code=400, detail="保留期任务未在运行")
+    return {"stopped": True, "status": retention.get_status()}
+
+
+@router.get("/leases", summary="多节点分片租约与节点心跳（管理员）")
+def scheduler_leases(db: Session = Depends(auth.get_db), admin: User = Depends(require_admin)):
+    return scheduler_lease.lease_table(db)
@@ -0,0 +1,195 @@
+"""
+device_events 热点列迁移与回填 (bytes_out / protocol / cmd)
+
+新建库由 create_all 直接建出这三列；已有库需要：
+  1. ensure_columns：缺失的列以 ALTER TABLE ADD COLUMN（可空）补齐，启动时自动执行
+  2. backfill：按 id 分批从 payload 提取并写回，仅处理三列均为空且 payload 非空的行，可重复执行
+  3. widen_columns（仅 PostgreSQL）：早期版本建出的 BIGINT / VARCHAR(64|255) 列改为
+     DOUBLE PRECISION / TEXT（此前浮点流量被取整、超长协议 / 命令被截断），改型后后台全量重写一次
+     （backfill(all_rows=True)）。SQLite 列类型不限制取值，已有库可手动执行一次全量重写。
+
+评分只读取这三列，历史事件未回填前 protocol / bytes_out 为空（new_protocol 误报、24h 流量基线缺失），
+因此启动时自动回填（ensure_backfilled）：本次启动刚补齐列时同步回填后再提供服务，
+否则在后台线程中执行一次，补完上次中断的回填。
+
+手动回填（--all 按新规则重写全部事件）：
+    python -m backend.app.services.event_columns [--all]
+"""
+
+from __future__ import annotations
+
+import threading
+import traceback
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import Float, inspect, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session, sessionmaker
+
+from ..models import DeviceEvent, extract_hot_columns
+
+HOT_COLUMNS = ("bytes_out", "protocol", "cmd")
+# PostgreSQL 上需要放宽类型的列：(表, 列, 目标类型)
+_WIDE_COLUMNS = (
+    ("device_events", "bytes_out", "DOUBLE PRECISION"),
+    ("device_events", "protocol", "TEXT"),
+    ("device_events", "cmd", "TEXT"),
+    ("device_protocols", "protocol", "TEXT"),
+)
+BACKFILL_BATCH = 5000
+
+
+# ================== 迁移 ==================
+def ensure_columns(engine: Engine) -> List[str]:
+    """
+    为已有的 device_events 表补齐热点列，返回本进程新增的列名（表不存在或已齐全时为空）。
+    多个 worker 同时启动时逐列单独提交；ADD COLUMN 失败后重新检查，列已由其它 worker 加上则跳过
+    （SQLite 不支持 ADD COLUMN IF NOT EXISTS）。
+    """
+    insp = inspect(engine)
+    if not insp.has_table(DeviceEvent.__tablename__):
+        return []
+    existing = {c["name"] for c in insp.get_columns(DeviceEvent.__tablename__)}
+    missing = [name for name in HOT_COLUMNS if name not in existing]
+    table = DeviceEvent.__table__
+    added: List[str] = []
+    for name in missing:
+        col_type = table.c[name].type.compile(dialect=engine.dialect)
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    text(f"ALTER TABLE {DeviceEvent.__tablename__} ADD COLUMN {name} {col_type}")
+                )
+        except DBAPIError:
+            columns = {c["name"] for c in inspect(engine).get_columns(DeviceEvent.__tablename__)}
+            if name not in columns:
+                raise
+            continue
+        added.append(name)
+    return added
+
+
+def _is_wide(col_type: Any, target: str) -> bool:
+    if target == "TEXT":
+        return getattr(col_type, "length", None) is None
+    return isinstance(col_type, Float)
+
+
+def widen_columns(engine: Engine) -> List[str]:
+    """
+    PostgreSQL 上把旧版本的定长 / 整数热点列改为 TEXT / DOUBLE PRECISION，返回本进程改型的 "表.列"。
+    多个 worker 同时启动时改型失败后重新检查，已由其它 worker 完成则跳过。
+    """
+    if engine.dialect.name != "postgresql":
+        return []
+    insp = inspect(engine)
+    changed: List[str] = []
+    for table, name, target in _WIDE_COLUMNS:
+        if not insp.has_table(table):
+            continue
+        types = {c["name"]: c["type"] for c in insp.get_columns(table)}
+        if name not in types or _is_wide(types[name], target):
+            continue
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {name} TYPE {target}"))
+        except DBAPIError:
+            types = {c["name"]: c["type"] for c in inspect(engine).get_columns(table)}
+            if not _is_wide(types[name], target):
+                raise
+            continue
+        changed.append(f"{table}.{name}")
+    return changed
+
+
+# ================== 回填 ==================
+def backfill(db: Session, batch_size: int = BACKFILL_BATCH, all_rows: bool = False) -> int:
+    """
+    从 payload 回填热点列，每批提交一次，返回更新的行数。
+    all_rows=True 时按当前提取规则重写所有 payload 非空的行（修正旧版本截断 / 丢弃的值）。
+    """
+    updated = 0
+    last_id = 0
+    criteria = [DeviceEvent.payload.is_not(None)]
+    if not all_rows:
+        criteria += [
+            DeviceEvent.bytes_out.is_(None),
+            DeviceEvent.protocol.is_(None),
+            DeviceEvent.cmd.is_(None),
+        ]
+    while True:
+        rows = (
+            db.query(DeviceEvent.id, DeviceEvent.payload)
+            .filter(DeviceEvent.id > last_id, *criteria)
+            .order_by(DeviceEvent.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            return updated
+        last_id = rows[-1][0]
+        params: List[Dict[str, Any]] = []
+        for event_id, payload in rows:
+            cols = extract_hot_columns(payload)
+            if all_rows or any(v is not None for v in cols.values()):
+                params.append({"id": event_id, **cols})
+        if params:
+            db.execute(update(DeviceEvent), params)
+            db.commit()
+            updated += len(params)
+
+
+def _backfill_with(engine: Engine, all_rows: bool = False) -> int:
+    db = sessionmaker(bind=engine, autoflush=False, autocommit=False)()
+    try:
+        n = backfill(db, all_rows=all_rows)
+        if n:
+            print(f"[event_columns] backfilled {n} events")
+        return n
+    except Exception:
+        db.rollback()
+        traceback.print_exc()
+        return 0
+    finally:
+        db.close()
+
+
+def ensure_backfilled(
+    engine: Engine, added: List[str], rewrite: bool = False
+) -> Optional[threading.Thread]:
+    """
+    启动时回填热点列：added 非空（本次刚补齐列）时同步回填；否则启动后台线程回填并返回该线程。
+    rewrite=True（本次刚放宽列类型）时全量重写。
+    """
+    if not inspect(engine).has_table(DeviceEvent.__tablename__):
+        return None
+    if added:
+        _backfill_with(engine, rewrite)
+        return None
+    t = threading.Thread(
+        target=_backfill_with, args=(engine, rewrite), name="EventColumnsBackfill", daemon=True
+    )
+    t.start()
+    return t
+
+
+if __name__ == "__main__":
+    import sys
+
+    from ..db import SessionLocal, engine
+    from ..models import Base
+
+    Base.metadata.create_all(bind=engine)
+    widened = widen_columns(engine)
+    if widened:
+        print(f"[event_columns] widened columns: {', '.join(widened)}")
+    added = ensure_columns(engine)
+    if added:
+        print(f"[event_columns] added columns: {', '.join(added)}")
+    session = SessionLocal()
+    try:
+        n = backfill(session, all_rows=bool(widened) or "--all" in sys.argv[1:])
+        print(f"[event_columns] backfilled {n} events")
+    finally:
+        session.close()
@@ -0,0 +1,191 @@
+"""
+设备事件写入（/devices/{id}/events 与 /events/ingest 共用）
+
+统一负责：
+1. 时间戳标准化为 UTC aware
+2. 写入 device_events（同时填充从 payload 提取的 bytes_out / protocol / cmd 列；
+   EVENT_PARTITIONS=1 时改写入按天分区表，见 event_store）
+3. 维护派生索引（协议历史、流量小时汇总），与事件在同一事务内提交
+4. 提交后累加内存滑动窗口计数（RISK_WINDOW_STATE=1 时）
+5. 提交后标记设备待评估（RISK_EVENT_TRIGGER=1 时，见 risk_trigger）
+
+两种写入方式：
+  - persist_events：ORM 对象写入（调用方需要 ORM 实例时使用）
+  - insert_events：Core 批量 INSERT ... RETURNING id（单条语句 executemany，
+    不构造 ORM 对象、提交后无需逐行 refresh），返回轻量 EventRecord
+"""
+
+from __future__ import annotations
+
+import traceback
+from datetime import UTC, datetime
+from typing import Any, Dict, List, Optional, Sequence, Set
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from ..models import DeviceEvent, extract_hot_columns
+from . import event_store, flow_rollup, protocol_index, risk_state, risk_trigger, risk_window
+
+
+def normalize_ts(ts: Optional[datetime], default: datetime) -> datetime:
+    """
+    None -> default；naive 视为 UTC；aware 转 UTC
+    """
+    if ts is None:
+        return default
+    if ts.tzinfo is None:
+        return ts.replace(tzinfo=UTC)
+    return ts.astimezone(UTC)
+
+
+def build_event(
+    device_id: int,
+    event_type: str,
+    payload: Optional[Dict[str, Any]],
+    ts: Optional[datetime],
+    default_now: datetime,
+) -> DeviceEvent:
+    return DeviceEvent(
+        device_id=device_id,
+        event_type=event_type,
+        payload=payload,
+        ts=normalize_ts(ts, default_now),
+    )
+
+
+class EventRecord:
+    """
+    批量写入路径返回的事件记录（字段与 DeviceEvent 一致，非 ORM 对象）
+    """
+
+    __slots__ = ("id", "device_id", "event_type", "payload", "ts")
+
+    def __init__(
+        self, id: int, device_id: int, event_type: str, payload: Any, ts: datetime
+    ) -> None:
+        self.id = id
+        self.device_id = device_id
+        self.event_type = event_type
+        self.payload = payload
+        self.ts = ts
+
+
+def build_values(
+    device_id: int,
+    event_type: str,
+    payload: Optional[Dict[str, Any]],
+    ts: Optional[datetime],
+    default_now: datetime,
+) -> Dict[str, Any]:
+    """
+    insert_events 使用的行参数（与 build_event 相同的标准化规则与热点列提取）
+    """
+    return {
+        "device_id": device_id,
+        "event_type": event_type,
+        "payload": payload,
+        "ts": normalize_ts(ts, default_now),
+        **extract_hot_columns(payload),
+    }
+
+
+def insert_events(db: Session, values: List[Dict[str, Any]]) -> List[EventRecord]:
+    """
+    Core 批量写入 + 派生索引维护，单次 commit，返回按输入顺序排列的 EventRecord。
+    方言不支持按参数顺序返回 RETURNING 时回退到 ORM 写入。
+    """
+    if not values:
+        return []
+    dialect = db.get_bind().dialect
+    ids: Sequence[int]
+    if event_store.ENABLED:
+        ids = event_store.insert_rows(db, values)
+    elif dialect.insert_executemany_returning_sort_by_parameter_order:
+        stmt = insert(DeviceEvent).returning(DeviceEvent.id, sort_by_parameter_order=True)
+        ids = db.scalars(stmt, values).all()
+    else:
+        rows = [DeviceEvent(**v) for v in values]
+        db.add_all(rows)
+        db.flush()
+        ids = [r.id for r in rows]
+    records = [
+        EventRecord(i, v["device_id"], v["event_type"], v["payload"], v["ts"])
+        for i, v in zip(ids, values)
+    ]
+    protocol_index.record_events(db, records)
+    flow_rollup.record_events(db, records)
+    db.commit()
+    _after_commit(
+        (
+            [(r.id, r.device_id, r.event_type, r.payload, r.ts) for r in records]
+            if risk_window.ENABLED
+            else None
+        ),
+        {r.device_id for r in records},
+    )
+    return records
+
+
+def _after_commit(window_items: Optional[List[Any]], device_ids: Set[int]) -> None:
+    """
+    提交后的进程内通知（内存滑窗 / 事件触发）。事件已落库，这里的异常只记录不抛出，
+    避免调用方（如写入队列的逐请求重试）把已提交的批次再写一遍。
+    """
+    try:
+        if window_items:
+            risk_window.record(window_items)
+        if risk_trigger.ENABLED:
+            risk_trigger.mark_dirty(device_ids)
+    except Exception:
+        print("[EventIngest] post-commit hook failed (events already committed)")
+        traceback.print_exc()
+
+
+def persist_events(db: Session, rows: List[DeviceEvent]) -> List[DeviceEvent]:
+    """
+    写入事件并维护派生索引，单次 commit。
+    """
+    if not rows:
+        return rows
+    if event_store.ENABLED:
+        # 分区存储：按行参数写入分区表，id 回填到（不受会话管理的）对象上
+        values = [
+            {
+                "device_id": r.device_id,
+                "event_type": r.event_type,
+                "payload": r.payload,
+                "ts": r.ts,
+                **extract_hot_columns(r.payload),
+                # 未显式指定时由 insert_rows 取写入时间
+                **({"ingested_at": r.ingested_at} if r.ingested_at is not None else {}),
+            }
+            for r in rows
+        ]
+        for r, event_id in zip(rows, event_store.insert_rows(db, values)):
+            r.id = event_id
+    else:
+        db.add_all(rows)
+    protocol_index.record_events(db, rows)
+    flow_rollup.record_events(db, rows)
+    window_items = None
+    # commit 后对象过期，提前取出设备 id
+    device_ids = {r.device_id for r in rows}
+    if risk_window.ENABLED:
+        # flush 后取 id，commit 后对象会过期，提前取出避免逐行 refresh
+        db.flush()
+        window_items = [(r.id, r.device_id, r.event_type, r.payload, r.ts) for r in rows]
+    db.commit()
+    _after_commit(window_items, device_ids)
+    return rows
+
+
+def purge_device(db: Session, device_id: int) -> None:
+    """
+    删除设备时清理事件派生数据（不提交）。
+    """
+    protocol_index.delete_device(db, device_id)
+    flow_rollup.delete_device(db, device_id)
+    risk_state.delete_device(db, device_id)
+    event_store.delete_device(db, device_id)
+    risk_window.forget(device_id)
@@ -0,0 +1,410 @@
+"""
+按天分区的事件存储 (可选，EVENT_PARTITIONS=1 开启)
+
+事件按 ts 的 UTC 日期写入 device_events_YYYYMMDD 分区表（列与 device_events 相同，
+每个分区自带 (device_id, ts) / (device_id, event_type, ts) / (device_id, ingested_at) / device_id 索引）：
+  - 写入：按日期分组后逐分区 executemany，分区不存在时在同一事务内建表
+  - 事件 id：event_id_counters 整段分配，全局唯一且单调递增（水位 / 排序语义不变）
+  - 读取：source(db, start, end) 返回覆盖 [start, end] 的分区（多个分区为 UNION ALL 子查询，
+    过滤条件由数据库下推到各分区），5 分钟窗口通常只落在 1 个分区，24h 基线最多 2 个
+  - 保留期：drop_before(cutoff) 直接 DROP 早于 cutoff 日期的整个分区，不做大范围 DELETE
+
+关闭时 source() 返回原 device_events 表，所有调用方的 SQL 与原实现一致。
+
+开启前已有的 device_events 数据需迁移一次（按 ts 搬入分区，保留原 id）：
+    python -m backend.app.services.event_store --migrate
+按保留天数删除旧分区：
+    python -m backend.app.services.event_store --retain-days 30
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from datetime import UTC, date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import (
+    Column,
+    Index,
+    MetaData,
+    Table,
+    case,
+    false,
+    func,
+    insert,
+    inspect,
+    select,
+    union_all,
+    update,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import FromClause
+
+from ..models import DeviceEvent, EventIdCounter
+
+ENABLED = os.getenv("EVENT_PARTITIONS", "0") == "1"
+PREFIX = "device_events_"
+_COUNTER = "device_events"
+# 分区列表缓存刷新间隔（其它 worker 删除的分区在该间隔内可见；
+# 查询范围内其它 worker 新建的分区由 _covering_days 即时确认）
+_REFRESH_SECONDS = 5.0
+# 查询范围内缺失的日期超过该数量时直接整体刷新分区列表
+_MAX_PROBES = 8
+
+_metadata = MetaData()
+_tables: Dict[str, Table] = {}
+_lock = threading.Lock()
+_known: Optional[Set[date]] = None
+_checked_at = 0.0
+
+
+def _to_utc_aware(dt: datetime) -> datetime:
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=UTC)
+    return dt.astimezone(UTC)
+
+
+def partition_name(day: date) -> str:
+    return f"{PREFIX}{day:%Y%m%d}"
+
+
+def _parse_name(name: str) -> Optional[date]:
+    suffix = name[len(PREFIX) :]
+    if not name.startswith(PREFIX) or len(suffix) != 8 or not suffix.isdigit():
+        return None
+    try:
+        return datetime.strptime(suffix, "%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+def partition_table(day: date) -> Table:
+    """
+    分区表定义（列同 device_events，id 由分配器写入；不建外键，删除设备时由 delete_device 清理）。
+    """
+    name = partition_name(day)
+    with _lock:
+        table = _tables.get(name)
+        if table is None:
+            cols = [
+                Column(
+                    c.name,
+                    c.type,
+                    primary_key=c.primary_key,
+                    nullable=c.nullable,
+                    autoincrement=False,
+                )
+                for c in DeviceEvent.__table__.columns
+            ]
+            table = Table(
+                name,
+                _metadata,
+                *cols,
+                Index(f"ix_{name}_device_id", "device_id"),
+                Index(f"ix_{name}_device_ts", "device_id", "ts"),
+                Index(f"ix_{name}_device_type_ts", "device_id", "event_type", "ts"),
+                Index(f"ix_{name}_device_ingested", "device_id", "ingested_at"),
+            )
+            _tables[name] = table
+        return table
+
+
+# ================== 分区目录 ==================
+def partition_days(db: Session, refresh: bool = False) -> List[date]:
+    """
+    已存在的分区日期（升序）；进程内缓存，超过刷新间隔或 refresh=True 时重新读取。
+    """
+    global _known, _checked_at
+    now = time.monotonic()
+    if refresh or _known is None or now - _checked_at > _REFRESH_SECONDS:
+        names = inspect(db.connection()).get_table_names()
+        days = {d for d in (_parse_name(n) for n in names) if d is not None}
+        with _lock:
+            _known = days
+            _checked_at = now
+    with _lock:
+        return sorted(_known or ())
+
+
+def _covering_days(db: Session, lo: Optional[date], hi: Optional[date]) -> List[date]:
+    """
+    覆盖 [lo, hi] 时使用的分区列表：范围内有缓存中没有的日期时逐个确认是否已由其它 worker 建表，
+    不等缓存过期（缺失日期过多时整体刷新）。未指定的上界按当天，下界按最早的已知分区。
+    """
+    days = partition_days(db)
+    hi = hi or datetime.now(UTC).date()
+    lo = lo or (days[0] if days else hi)
+    known = set(days)
+    missing: List[date] = []
+    day = lo
+    while day <= hi and len(missing) <= _MAX_PROBES:
+        if day not in known:
+            missing.append(day)
+        day += timedelta(days=1)
+    if not missing:
+        return days
+    if len(missing) > _MAX_PROBES:
+        return partition_days(db, refresh=True)
+    insp = inspect(db.connection())
+    found = {d for d in missing if insp.has_table(partition_name(d))}
+    if not found:
+        return days
+    with _lock:
+        if _known is not None:
+            _known.update(found)
+    return sorted(known | found)
+
+
+def _ensure_partition(db: Session, day: date) -> Table:
+    table = partition_table(day)
+    if day not in set(partition_days(db)):
+        table.create(bind=db.connection(), checkfirst=True)
+        with _lock:
+            if _known is not None:
+                _known.add(day)
+    return table
+
+
+def source(
+    db: Session, start: Optional[datetime] = None, end: Optional[datetime] = None
+) -> FromClause:
+    """
+    覆盖 [start, end] 的事件来源（列名同 device_events，通过 .c.<列名> 访问）：
+      - 未开启分区：device_events 表本身
+      - 单个分区：该分区表
+      - 多个分区：UNION ALL 子查询；无分区：空结果子查询
+    """
+    if not ENABLED:
+        return DeviceEvent.__table__
+    lo = _to_utc_aware(start).date() if start is not None else None
+    hi = _to_utc_aware(end).date() if end is not None else None
+    days = [
+        d for d in _covering_days(db, lo, hi) if (lo is None or d >= lo) and (hi is None or d <= hi)
+    ]
+    if len(days) == 1:
+        return partition_table(days[0])
+    if not days:
+        template = partition_table(date(1970, 1, 1))
+        return select(*template.c).where(false()).subquery("device_events")
+    return union_all(*(select(*partition_table(d).c) for d in days)).subquery("device_events")
+
+
+# ================== 写入 ==================
+def allocate_ids(db: Session, n: int) -> int:
+    """
+    分配 n 个连续事件 id，返回首个 id（与写入同一事务，写锁保证并发 worker 不重叠）。
+    首次使用时从已有 device_events 与分区的最大 id 之后开始。
+    """
+    stmt = (
+        update(EventIdCounter)
+        .where(EventIdCounter.name == _COUNTER)
+        .values(next_id=EventIdCounter.next_id + n)
+    )
+    after: Optional[int]
+    if db.get_bind().dialect.update_returning:
+        after = db.execute(stmt.returning(EventIdCounter.next_id)).scalar()
+    else:
+        db.execute(stmt)
+        after = db.execute(
+            select(EventIdCounter.next_id).where(EventIdCounter.name == _COUNTER)
+        ).scalar()
+    if after is not None:
+        return after - n
+
+    # 初始化计数器（并发 worker 同时初始化时只有一个生效），然后重新分配
+    seed = {"name": _COUNTER, "next_id": _max_existing_id(db) + 1}
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert_fn = sqlite_insert if dialect == "sqlite" else pg_insert
+        ins: Any = insert_fn(EventIdCounter).values(seed)
+        db.execute(ins.on_conflict_do_nothing())
+    else:
+        db.execute(insert(EventIdCounter).values(seed))
+    return allocate_ids(db, n)
+
+
+def _max_existing_id(db: Session) -> int:
+    best = db.query(func.max(DeviceEvent.id)).scalar() or 0
+    for day in partition_days(db, refresh=True):
+        t = partition_table(day)
+        best = max(best, db.execute(select(func.max(t.c.id))).scalar() or 0)
+    return best
+
+
+def insert_rows(db: Session, values: List[Dict[str, Any]]) -> List[int]:
+    """
+    按 ts 日期写入分区（不提交），返回按输入顺序排列的事件 id。
+    """
+    if not values:
+        return []
+    first = allocate_ids(db, len(values))
+    ids = list(range(first, first + len(values)))
+    now = datetime.now(UTC)
+    by_day: Dict[date, List[Dict[str, Any]]] = {}
+    for event_id, v in zip(ids, values):
+        row = {**v, "id": event_id}
+        row.setdefault("ingested_at", now)
+        by_day.setdefault(_to_utc_aware(v["ts"]).date(), []).append(row)
+    for day, rows in by_day.items():
+        db.execute(insert(_ensure_partition(db, day)), rows)
+    return ids
+
+
+# ================== 查询辅助 ==================
+def max_ids(db: Session, device_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    各设备最大事件 id（逐分区 GROUP BY，走各分区 device_id 索引），无事件的设备不出现。
+    """
+    ids = list(device_ids)
+    out: Dict[int, int] = {}
+    if not ids:
+        return out
+    for day in partition_days(db):
+        t = partition_table(day)
+        rows: Any = db.execute(
+            select(t.c.device_id, func.max(t.c.id))
+            .where(t.c.device_id.in_(ids))
+            .group_by(t.c.device_id)
+        )
+        for d, m in rows:
+            if m is not None and m > out.get(d, 0):
+                out[d] = m
+    return out
+
+
+def latest(
+    db: Session, device_ids: Iterable[int], now: datetime
+) -> Dict[int, Tuple[int, Optional[datetime], Optional[datetime]]]:
+    """
+    各设备 (最大事件 id, 最大 ingested_at, 不晚于 now 的最大 ts)，逐分区 GROUP BY 后合并，
+    无事件的设备不出现。
+    """
+    ids = list(device_ids)
+    out: Dict[int, Tuple[int, Optional[datetime], Optional[datetime]]] = {}
+    if not ids:
+        return out
+    for day in partition_days(db):
+        t = partition_table(day)
+        rows: Any = db.execute(
+            select(
+                t.c.device_id,
+                func.max(t.c.id),
+                func.max(t.c.ingested_at),
+                func.max(case((t.c.ts <= now, t.c.ts))),
+            )
+            .where(t.c.device_id.in_(ids))
+            .group_by(t.c.device_id)
+        )
+        for d, m, ing, ts in rows:
+            prev = out.get(d, (0, None, None))
+            out[d] = (
+                max(prev[0], m or 0),
+                _latest(prev[1], _to_utc_aware(ing) if ing is not None else None),
+                _latest(prev[2], _to_utc_aware(ts) if ts is not None else None),
+            )
+    return out
+
+
+def _latest(a: Optional[datetime], b: Optional[datetime]) -> Optional[datetime]:
+    if a is None or b is None:
+        return a or b
+    return max(a, b)
+
+
+def delete_device(db: Session, device_id: int) -> None:
+    """
+    删除设备时清理所有分区中的事件（不提交）。
+    """
+    if not ENABLED:
+        return
+    for day in partition_days(db, refresh=True):
+        t = partition_table(day)
+        db.execute(t.delete().where(t.c.device_id == device_id))
+
+
+# ================== 保留期 / 迁移 ==================
+def drop_before(db: Session, cutoff: date) -> List[str]:
+    """
+    DROP 早于 cutoff（不含）的分区并提交，返回删除的表名。
+    """
+    dropped: List[str] = []
+    for day in partition_days(db, refresh=True):
+        if day >= cutoff:
+            break
+        partition_table(day).drop(bind=db.connection(), checkfirst=True)
+        dropped.append(partition_name(day))
+        with _lock:
+            if _known is not None:
+                _known.discard(day)
+    db.commit()
+    return dropped
+
+
+def migrate_legacy(db: Session, batch_size: int = 5000) -> int:
+    """
+    将 device_events 中的已有事件按 ts 搬入分区（保留 id）并从原表删除，每批提交一次。
+    完成后把 id 分配器推进到已有最大 id 之后。返回搬迁的行数。
+    """
+    table: Any = DeviceEvent.__table__
+    moved = 0
+    while True:
+        rows = [
+            dict(r._mapping)
+            for r in db.execute(select(*table.c).order_by(table.c.id).limit(batch_size))
+        ]
+        if not rows:
+            break
+        by_day: Dict[date, List[Dict[str, Any]]] = {}
+        for r in rows:
+            by_day.setdefault(_to_utc_aware(r["ts"]).date(), []).append(r)
+        for day, part in by_day.items():
+            db.execute(insert(_ensure_partition(db, day)), part)
+        db.execute(table.delete().where(table.c.id <= rows[-1]["id"]))
+        db.commit()
+        moved += len(rows)
+    top = _max_existing_id(db)
+    counter = db.get(EventIdCounter, _COUNTER)
+    if counter is None:
+        db.add(EventIdCounter(name=_COUNTER, next_id=top + 1))
+    elif counter.next_id <= top:
+        counter.next_id = top + 1
+    db.commit()
+    return moved
+
+
+def reset_cache() -> None:
+    """
+    清空分区目录缓存（测试 / 外部删表后使用）。
+    """
+    global _known, _checked_at
+    with _lock:
+        _known = None
+        _checked_at = 0.0
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from ..db import SessionLocal, engine
+    from ..models import Base
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--migrate", action="store_true", help="move device_events into partitions")
+    parser.add_argument("--retain-days", type=int, help="drop partitions older than N days")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        if args.migrate:
+            print(f"[event_store] migrated {migrate_legacy(session)} events")
+        if args.retain_days is not None:
+            cutoff = datetime.now(UTC).date() - timedelta(days=args.retain_days)
+            dropped = drop_before(session, cutoff)
+            print(f"[event_store] dropped {len(dropped)} partitions: {', '.join(dropped)}")
+    finally:
+        session.close()
@@ -0,0 +1,251 @@
+"""
+net_flow 流量小时汇总 (flow_spike 24h 基线)
+
+device_flow_rollups 按 (device_id, UTC 整点) 保存 bytes_out > 0 的
+sum / count / max，写入事件时同步累加。
+
+评分时 [window_end - 24h, window_start) 的均值拆成三段：
+  - 头部不足一小时的部分：原始事件 SUM/COUNT
+  - 中间完整小时：最多 24 条汇总行
+  - 尾部不足一小时的部分：原始事件 SUM/COUNT
+三段合计与逐行计算的 hist_mean 完全一致。
+
+重建（从已有 device_events 重新汇总）：
+    python -m backend.app.services.flow_rollup
+"""
+
+from __future__ import annotations
+
+from datetime import UTC, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from ..models import DeviceFlowRollup, extract_hot_columns
+from . import event_store
+
+BUCKET = timedelta(hours=1)
+
+
+def _to_utc_aware(dt: Optional[datetime]) -> Optional[datetime]:
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=UTC)
+    return dt.astimezone(UTC)
+
+
+def bucket_floor(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def _flow_bytes(event_type: str, payload: Any) -> Optional[float]:
+    """
+    与评分逻辑一致：仅 net_flow 且 bytes_out > 0 的事件计入
+    """
+    if event_type != "net_flow":
+        return None
+    # 与 device_events.bytes_out 列同一提取规则（排除 bool 等非数值），汇总与列聚合结果一致
+    v = extract_hot_columns(payload)["bytes_out"]
+    if v is not None and v > 0:
+        return v
+    return None
+
+
+def _accumulate(
+    acc: Dict[Tuple[int, datetime], List[float]], device_id: int, ts: datetime, v: float
+) -> None:
+    key = (device_id, bucket_floor(ts))
+    cur = acc.get(key)
+    if cur is None:
+        acc[key] = [v, 1, v]
+    else:
+        cur[0] += v
+        cur[1] += 1
+        if v > cur[2]:
+            cur[2] = v
+
+
+# ================== 写入维护 ==================
+def record_events(db: Session, events: Iterable[Any]) -> int:
+    """
+    将新写入事件累加到对应小时桶（不提交，由调用方统一 commit）。
+    返回涉及的桶数量。
+    """
+    acc: Dict[Tuple[int, datetime], List[float]] = {}
+    for e in events:
+        v = _flow_bytes(e.event_type, e.payload)
+        if v is None:
+            continue
+        ts = _to_utc_aware(e.ts) or datetime.now(UTC)
+        _accumulate(acc, e.device_id, ts, v)
+    if not acc:
+        return 0
+
+    values = [
+        {"device_id": d, "bucket_start": b, "bytes_sum": s, "flow_count": c, "bytes_max": m}
+        for (d, b), (s, c, m) in acc.items()
+    ]
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert_fn = sqlite_insert if dialect == "sqlite" else pg_insert
+        stmt: Any = insert_fn(DeviceFlowRollup).values(values)
+        ex = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["device_id", "bucket_start"],
+            set_={
+                "bytes_sum": DeviceFlowRollup.bytes_sum + ex.bytes_sum,
+                "flow_count": DeviceFlowRollup.flow_count + ex.flow_count,
+                "bytes_max": case(
+                    (ex.bytes_max > DeviceFlowRollup.bytes_max, ex.bytes_max),
+                    else_=DeviceFlowRollup.bytes_max,
+                ),
+            },
+        )
+        db.execute(stmt)
+    else:
+        for (d, b), (s, c, m) in acc.items():
+            row = (
+                db.query(DeviceFlowRollup)
+                .filter(DeviceFlowRollup.device_id == d, DeviceFlowRollup.bucket_start == b)
+                .first()
+            )
+            if row is None:
+                db.add(
+                    DeviceFlowRollup(
+                        device_id=d, bucket_start=b, bytes_sum=s, flow_count=c, bytes_max=m
+                    )
+                )
+            else:
+                row.bytes_sum += s
+                row.flow_count += int(c)
+                row.bytes_max = max(row.bytes_max, m)
+    return len(acc)
+
+
+def delete_device(db: Session, device_id: int) -> None:
+    """
+    删除设备时清理汇总（不提交）。
+    """
+    db.query(DeviceFlowRollup).filter(DeviceFlowRollup.device_id == device_id).delete(
+        synchronize_session=False
+    )
+
+
+# ================== 评分查询 ==================
+def _raw_sum_count(
+    db: Session, device_ids: List[int], start: datetime, end: datetime
+) -> Dict[int, Tuple[float, int]]:
+    if start >= end:
+        return {}
+    ev = event_store.source(db, start, end)
+    bytes_col = ev.c.bytes_out
+    rows = (
+        db.query(ev.c.device_id, func.sum(bytes_col), func.count(bytes_col))
+        .filter(
+            ev.c.device_id.in_(device_ids),
+            ev.c.event_type == "net_flow",
+            ev.c.ts >= start,
+            ev.c.ts < end,
+            bytes_col > 0,
+        )
+        .group_by(ev.c.device_id)
+        .all()
+    )
+    return {d: ((s or 0), (c or 0)) for d, s, c in rows}
+
+
+def hist_mean(db: Session, device_id: int, start: datetime, end: datetime) -> float:
+    """
+    [start, end) 内 net_flow bytes_out(>0) 均值；无数据返回 0。
+    """
+    return hist_means(db, [device_id], start, end).get(device_id, 0)
+
+
+def hist_means(
+    db: Session, device_ids: Iterable[int], start: datetime, end: datetime
+) -> Dict[int, float]:
+    """
+    批量版本：返回 {device_id: 均值}，无数据的设备不出现在结果中。
+    """
+    ids = list(device_ids)
+    if not ids:
+        return {}
+    head_end = bucket_floor(start)
+    if head_end < start:
+        head_end += BUCKET
+    tail_start = bucket_floor(end)
+
+    parts: List[Dict[int, Tuple[float, int]]] = []
+    if head_end >= tail_start:
+        parts.append(_raw_sum_count(db, ids, start, end))
+    else:
+        parts.append(_raw_sum_count(db, ids, start, head_end))
+        parts.append(_raw_sum_count(db, ids, tail_start, end))
+        rows = (
+            db.query(
+                DeviceFlowRollup.device_id,
+                func.sum(DeviceFlowRollup.bytes_sum),
+                func.sum(DeviceFlowRollup.flow_count),
+            )
+            .filter(
+                DeviceFlowRollup.device_id.in_(ids),
+                DeviceFlowRollup.bucket_start >= head_end,
+                DeviceFlowRollup.bucket_start < tail_start,
+            )
+            .group_by(DeviceFlowRollup.device_id)
+            .all()
+        )
+        parts.append({d: ((s or 0), (c or 0)) for d, s, c in rows})
+
+    totals: Dict[int, List[float]] = {}
+    for part in parts:
+        for d, (s, c) in part.items():
+            acc = totals.setdefault(d, [0, 0])
+            acc[0] += s
+            acc[1] += c
+    return {d: total / count for d, (total, count) in totals.items() if count}
+
+
+# ================== 重建 ==================
+def rebuild(db: Session, device_ids: Optional[Iterable[int]] = None) -> int:
+    """
+    从 device_events 重新汇总（全部或指定设备）并提交，返回写入的桶数量。
+    """
+    ids = list(device_ids) if device_ids is not None else None
+    ev = event_store.source(db)
+    q = db.query(ev.c.device_id, ev.c.ts, ev.c.bytes_out).filter(
+        ev.c.event_type == "net_flow", ev.c.bytes_out > 0
+    )
+    dq = db.query(DeviceFlowRollup)
+    if ids is not None:
+        q = q.filter(ev.c.device_id.in_(ids))
+        dq = dq.filter(DeviceFlowRollup.device_id.in_(ids))
+
+    acc: Dict[Tuple[int, datetime], List[float]] = {}
+    for device_id, ts, v in q.yield_per(5000):
+        _accumulate(acc, device_id, _to_utc_aware(ts) or ts, float(v or 0))
+
+    dq.delete(synchronize_session=False)
+    db.add_all(
+        DeviceFlowRollup(device_id=d, bucket_start=b, bytes_sum=s, flow_count=c, bytes_max=m)
+        for (d, b), (s, c, m) in acc.items()
+    )
+    db.commit()
+    return len(acc)
+
+
+if __name__ == "__main__":
+    from ..db import SessionLocal, engine
+    from ..models import Base
+
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        n = rebuild(session)
+        print(f"[flow_rollup] rebuilt {n} hourly buckets")
+    finally:
+        session.close()
@@ -0,0 +1,282 @@
+"""
+事件写入队列 (write-behind + group commit，可选，EVENT_INGEST_QUEUE=1 开启)
+
+请求线程只做校验并入队；单个写入线程把多个请求的事件合并为一批，
+一次 insert_events（单条 INSERT ... RETURNING + 一次 commit）落库：
+  - 首个待写请求入队后最多等待 EVENT_QUEUE_MAX_LATENCY_MS 毫秒，
+    或累计达到 EVENT_QUEUE_MAX_BATCH 条事件即刷盘
+  - 队列中事件总数超过 EVENT_QUEUE_MAX_EVENTS 时，入队最多阻塞 EVENT_QUEUE_PUT_TIMEOUT 秒，
+    仍无空间则抛 QueueFull（接口返回 503，客户端退避重试）
+  - 合并批次写入失败时回滚，并逐请求重试，单个异常请求不会拖垮同批其它请求
+
+确认语义：
+  - 默认入队即返回（ack=queued），进程崩溃时尚未刷盘的事件会丢失
+  - durable=True 时等待所在批次提交后返回（ack=durable），可拿到事件 id
+  - 等待超过 EVENT_QUEUE_DURABLE_TIMEOUT 秒时请求仍留在队列中、通常随后提交，
+    接口按已入队（202, queued=true）应答并附 NOT_DURABLE_NOTE，避免客户端重试造成重复写入
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from .event_ingest import EventRecord, insert_events
+
+ENABLED = os.getenv("EVENT_INGEST_QUEUE", "0") == "1"
+MAX_EVENTS = int(os.getenv("EVENT_QUEUE_MAX_EVENTS", "50000"))
+MAX_BATCH = max(1, int(os.getenv("EVENT_QUEUE_MAX_BATCH", "2000")))
+MAX_LATENCY_MS = float(os.getenv("EVENT_QUEUE_MAX_LATENCY_MS", "50"))
+PUT_TIMEOUT = float(os.getenv("EVENT_QUEUE_PUT_TIMEOUT", "1"))
+DURABLE_TIMEOUT = float(os.getenv("EVENT_QUEUE_DURABLE_TIMEOUT", "30"))
+
+NOT_DURABLE_NOTE = (
+    "durable wait timed out: events are still queued and will be committed, " "do not resend them"
+)
+
+
+class QueueFull(Exception):
+    """
+    队列已满（背压），调用方应稍后重试
+    """
+
+
+class Ticket:
+    """
+    单个请求的入队凭据；durable 等待时通过 wait() 取得写入结果。
+    """
+
+    __slots__ = ("values", "enqueued_at", "done", "records", "error")
+
+    def __init__(self, values: List[Dict[str, Any]]) -> None:
+        self.values = values
+        self.enqueued_at = time.monotonic()
+        self.done = threading.Event()
+        self.records: List[EventRecord] = []
+        self.error: Optional[BaseException] = None
+
+    def wait(self, timeout: Optional[float] = None) -> List[EventRecord]:
+        if not self.done.wait(timeout):
+            raise TimeoutError("ingest queue flush timed out")
+        if self.error is not None:
+            raise self.error
+        return self.records
+
+
+class IngestQueue:
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        max_events: int = MAX_EVENTS,
+        max_batch: int = MAX_BATCH,
+        max_latency_ms: float = MAX_LATENCY_MS,
+    ) -> None:
+        self.session_factory = session_factory
+        self.max_events = max_events
+        self.max_batch = max_batch
+        self.max_latency = max_latency_ms / 1000.0
+        self._cond = threading.Condition()
+        self._pending: Deque[Ticket] = deque()
+        self._depth = 0
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+        # 指标
+        self.enqueued = 0
+        self.rejected = 0
+        self.flushed_events = 0
+        self.flushes = 0
+        self.failed_events = 0
+        self.last_flush_ms: Optional[float] = None
+        self.max_flush_ms = 0.0
+        self.last_batch_size = 0
+
+    # ---------------- 入队 ----------------
+    def submit(self, values: List[Dict[str, Any]], timeout: float = PUT_TIMEOUT) -> Ticket:
+        ticket = Ticket(values)
+        if not values:
+            ticket.done.set()
+            return ticket
+        n = len(values)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if self._stop:
+                raise RuntimeError("ingest queue is stopped")
+            self._ensure_started()
+            # 单个超大请求在队列为空时允许进入，避免永远无法入队
+            while self._depth and self._depth + n > self.max_events:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.rejected += n
+                    raise QueueFull(f"ingest queue full ({self._depth}/{self.max_events} events)")
+                self._cond.wait(remaining)
+            self._pending.append(ticket)
+            self._depth += n
+            self.enqueued += n
+            self._cond.notify_all()
+        return ticket
+
+    # ---------------- 写入线程 ----------------
+    def _ensure_started(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="EventIngestWriter", daemon=True)
+            self._thread.start()
+
+    def _take_batch(self) -> List[Ticket]:
+        """
+        等待到达刷盘条件后取出一批请求（按整请求取，不拆分）。
+        """
+        with self._cond:
+            while not self._pending and not self._stop:
+                self._cond.wait()
+            if not self._pending:
+                return []
+            flush_at = self._pending[0].enqueued_at + self.max_latency
+            while not self._stop and self._depth < self.max_batch:
+                remaining = flush_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch: List[Ticket] = []
+            size = 0
+            while self._pending:
+                n = len(self._pending[0].values)
+                if batch and size + n > self.max_batch:
+                    break
+                batch.append(self._pending.popleft())
+                size += n
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            self._write(batch)
+
+    def _write(self, batch: List[Ticket]) -> None:
+        t0 = time.perf_counter()
+        size = sum(len(t.values) for t in batch)
+        db = self.session_factory()
+        try:
+            try:
+                records = insert_events(db, [v for t in batch for v in t.values])
+                i = 0
+                for t in batch:
+                    t.records = records[i : i + len(t.values)]
+                    i += len(t.values)
+            except Exception:
+                db.rollback()
+                # 合并批次失败：逐请求重试，定位并隔离异常请求
+                for t in batch:
+                    try:
+                        t.records = insert_events(db, t.values)
+                    except Exception as e:
+                        db.rollback()
+                        t.error = e
+                        self.failed_events += len(t.values)
+                        print(f"[IngestQueue] request dropped ({len(t.values)} events): {e}")
+        finally:
+            db.close()
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+            with self._cond:
+                self._depth -= size
+                self.flushes += 1
+                self.flushed_events += size - sum(len(t.values) for t in batch if t.error)
+                self.last_flush_ms = round(elapsed_ms, 3)
+                self.max_flush_ms = max(self.max_flush_ms, round(elapsed_ms, 3))
+                self.last_batch_size = size
+                self._cond.notify_all()
+            for t in batch:
+                t.done.set()
+
+    # ---------------- 管理 ----------------
+    def flush(self, timeout: float = DURABLE_TIMEOUT) -> bool:
+        """
+        等待当前已入队的事件全部刷盘，返回是否在超时前完成。
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._depth:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stop(self, timeout: float = DURABLE_TIMEOUT) -> None:
+        """
+        停止写入线程；已入队的事件先刷盘。
+        """
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def status(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "enabled": ENABLED,
+                "depth_events": self._depth,
+                "depth_requests": len(self._pending),
+                "max_events": self.max_events,
+                "max_batch": self.max_batch,
+                "max_latency_ms": self.max_latency * 1000,
+                "enqueued": self.enqueued,
+                "rejected": self.rejected,
+                "flushes": self.flushes,
+                "flushed_events": self.flushed_events,
+                "failed_events": self.failed_events,
+                "avg_batch_size": (
+                    round(self.flushed_events / self.flushes, 1) if self.flushes else None
+                ),
+                "last_batch_size": self.last_batch_size,
+                "last_flush_ms": self.last_flush_ms,
+                "max_flush_ms": self.max_flush_ms,
+                "writer_alive": bool(self._thread and self._thread.is_alive()),
+            }
+
+
+_queue: Optional[IngestQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> IngestQueue:
+    """
+    进程内单例（首次使用时创建，进程退出时刷盘）。
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            from ..db import SessionLocal
+
+            _queue = IngestQueue(SessionLocal)
+            atexit.register(_queue.stop)
+        return _queue
+
+
+def status() -> Dict[str, Any]:
+    if _queue is None:
+        return {"enabled": ENABLED, "started": False}
+    return {**_queue.status(), "started": True}
+
+
+def write(db: Session, values: List[Dict[str, Any]], wait: bool) -> Optional[List[EventRecord]]:
+    """
+    路由统一写入入口：
+      - 队列关闭：直接 insert_events 同步写入
+      - 队列开启：入队；wait=True 时等待所在批次提交并返回记录，否则返回 None（仅入队）
+    等待超时抛 TimeoutError，此时事件仍在队列中，调用方应按已入队处理而不是报错。
+    """
+    if not ENABLED:
+        return insert_events(db, values)
+    ticket = get_queue().submit(values)
+    if not wait:
+        return None
+    return ticket.wait(DURABLE_TIMEOUT)
@@ -0,0 +1,218 @@
+"""
+设备协议历史索引 (new_protocol 指标)
+
+device_protocols 表为每个 (device_id, protocol) 记录最早出现时间 first_seen，
+写入事件时同步维护；评分时“窗口开始前是否出现过该协议”变为一次集合查找：
+
+    first_seen < window_start  <=>  原实现中 ts < window_start 的 net_flow 含该协议
+
+进程内缓存只存放从表中读到的 first_seen。first_seen 只会变小（更早的事件补录），
+因此缓存中 first_seen < window_start 的判定永远成立，可直接信任；
+其它候选协议再回表确认，多 worker 下缓存过期也不会误判。
+
+一次性回填（从已有 device_events 重建索引）：
+    python -m backend.app.services.protocol_index
+"""
+
+from __future__ import annotations
+
+import threading
+from datetime import UTC, datetime
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import case, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from ..models import DeviceProtocol, extract_hot_columns
+from . import event_store
+
+_cache_lock = threading.Lock()
+# device_id -> {protocol: first_seen}
+_cache: Dict[int, Dict[str, datetime]] = {}
+
+
+def _to_utc_aware(dt: Optional[datetime]) -> Optional[datetime]:
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=UTC)
+    return dt.astimezone(UTC)
+
+
+def _event_protocol(event_type: str, payload: Any) -> Optional[str]:
+    # 与 device_events.protocol 列同一提取规则（仅非空字符串，截断到列长），索引与评分比较的值一致
+    if event_type != "net_flow":
+        return None
+    return extract_hot_columns(payload)["protocol"]
+
+
+# ================== 写入维护 ==================
+def record_events(db: Session, events: Iterable[Any]) -> int:
+    """
+    根据新写入的事件更新索引（不提交，由调用方统一 commit）。
+    events 只需具备 device_id / event_type / payload / ts 属性。
+    返回涉及的 (device_id, protocol) 数量。
+    """
+    earliest: Dict[Tuple[int, str], datetime] = {}
+    for e in events:
+        proto = _event_protocol(e.event_type, e.payload)
+        if proto is None:
+            continue
+        ts = _to_utc_aware(e.ts) or datetime.now(UTC)
+        key = (e.device_id, proto)
+        if key not in earliest or ts < earliest[key]:
+            earliest[key] = ts
+    if not earliest:
+        return 0
+
+    device_ids = {d for d, _ in earliest}
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        # 原子 upsert：并发写入同一新协议时不会因唯一约束失败
+        insert_fn = sqlite_insert if dialect == "sqlite" else pg_insert
+        stmt: Any = insert_fn(DeviceProtocol).values(
+            [{"device_id": d, "protocol": p, "first_seen": ts} for (d, p), ts in earliest.items()]
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["device_id", "protocol"],
+            set_={
+                "first_seen": case(
+                    (
+                        stmt.excluded.first_seen < DeviceProtocol.first_seen,
+                        stmt.excluded.first_seen,
+                    ),
+                    else_=DeviceProtocol.first_seen,
+                )
+            },
+        )
+        db.execute(stmt)
+    else:
+        existing = {
+            (r.device_id, r.protocol): r
+            for r in db.query(DeviceProtocol).filter(
+                DeviceProtocol.device_id.in_(device_ids),
+                DeviceProtocol.protocol.in_({p for _, p in earliest}),
+            )
+        }
+        for (device_id, proto), ts in earliest.items():
+            row = existing.get((device_id, proto))
+            if row is None:
+                db.add(DeviceProtocol(device_id=device_id, protocol=proto, first_seen=ts))
+            else:
+                cur = _to_utc_aware(row.first_seen)
+                if cur is None or ts < cur:
+                    row.first_seen = ts
+
+    # 缓存只在读路径填充；这里仅使受影响设备失效，避免未提交的数据进入缓存
+    invalidate(device_ids)
+    return len(earliest)
+
+
+def invalidate(device_ids: Optional[Iterable[int]] = None) -> None:
+    """
+    使缓存失效；device_ids 为 None 时清空全部。
+    """
+    with _cache_lock:
+        if device_ids is None:
+            _cache.clear()
+            return
+        for d in device_ids:
+            _cache.pop(d, None)
+
+
+def delete_device(db: Session, device_id: int) -> None:
+    """
+    删除设备时清理索引（不提交）。
+    """
+    db.query(DeviceProtocol).filter(DeviceProtocol.device_id == device_id).delete(
+        synchronize_session=False
+    )
+    invalidate([device_id])
+
+
+# ================== 评分查询 ==================
+def new_protocols(db: Session, device_id: int, protocols: Set[Any], before: datetime) -> Set[Any]:
+    """
+    返回 protocols 中在 before 之前从未出现过的协议。
+    """
+    return new_protocols_many(db, {device_id: protocols}, before).get(device_id, set())
+
+
+def new_protocols_many(
+    db: Session, protocols_by_device: Dict[int, Set[Any]], before: datetime
+) -> Dict[int, Set[Any]]:
+    """
+    批量版本：{device_id: 窗口协议集合} -> {device_id: 新协议集合}（仅含非空结果）。
+    缓存未能确认的候选统一一次回表。
+    """
+    before = _to_utc_aware(before) or before
+    candidates: Dict[int, Set[Any]] = {}
+    with _cache_lock:
+        for device_id, protocols in protocols_by_device.items():
+            known = _cache.get(device_id, {})
+            c = {p for p in protocols if not (p in known and known[p] < before)}
+            if c:
+                candidates[device_id] = c
+    if not candidates:
+        return {}
+
+    all_protos = set().union(*candidates.values())
+    rows = (
+        db.query(DeviceProtocol.device_id, DeviceProtocol.protocol, DeviceProtocol.first_seen)
+        .filter(
+            DeviceProtocol.device_id.in_(candidates.keys()),
+            DeviceProtocol.protocol.in_(all_protos),
+        )
+        .all()
+    )
+    fresh: Dict[int, Dict[str, datetime]] = {}
+    for device_id, proto, ts in rows:
+        fresh.setdefault(device_id, {})[proto] = _to_utc_aware(ts) or ts
+    with _cache_lock:
+        for device_id, seen in fresh.items():
+            _cache.setdefault(device_id, {}).update(seen)
+
+    out: Dict[int, Set[Any]] = {}
+    for device_id, c in candidates.items():
+        seen = fresh.get(device_id, {})
+        new = {p for p in c if not (p in seen and seen[p] < before)}
+        if new:
+            out[device_id] = new
+    return out
+
+
+# ================== 回填 ==================
+def rebuild(db: Session) -> int:
+    """
+    从 device_events 全量重建索引并提交，返回写入的行数。
+    """
+    ev = event_store.source(db)
+    proto_col = ev.c.protocol
+    rows = (
+        db.query(ev.c.device_id, proto_col, func.min(ev.c.ts))
+        .filter(ev.c.event_type == "net_flow", proto_col.is_not(None))
+        .group_by(ev.c.device_id, proto_col)
+        .all()
+    )
+    db.query(DeviceProtocol).delete(synchronize_session=False)
+    db.add_all(
+        DeviceProtocol(device_id=d, protocol=p, first_seen=_to_utc_aware(ts)) for d, p, ts in rows
+    )
+    db.commit()
+    invalidate()
+    return len(rows)
+
+
+if __name__ == "__main__":
+    from ..db import SessionLocal, engine
+    from ..models import Base
+
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        n = rebuild(session)
+        print(f"[protocol_index] rebuilt {n} (device_id, protocol) entries")
+    finally:
+        session.close()
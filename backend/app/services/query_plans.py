@@ -0,0 +1,336 @@
+"""
+热点查询执行计划诊断 + 复合索引维护
+
+HOT_QUERIES 收录风险引擎 / 动作服务 / 事件列表的热点查询（过滤条件与原查询一致，参数为占位值），
+explain_all 对每条执行 EXPLAIN QUERY PLAN（SQLite）或 EXPLAIN（PostgreSQL），
+并标记对热点表的全表扫描（SQLite 的 "SCAN <表>"，含 COVERING INDEX 的全索引扫描；
+PostgreSQL 的 "Seq Scan on <表>"）。
+
+对应的复合索引定义在 models 中（__table_args__）：
+  - device_events (device_id, ts)              窗口计数
+  - device_events (device_id, event_type, ts)  协议 / 命令 / 24h 流量基线 / 协议历史
+  - device_events (device_id, ingested_at)     评估水位的迟到提交检查（risk_state）
+  - risk_actions  (device_id, action_type)     最近隔离动作 / 批量隔离状态
+device_id 单列索引保留给按 id 排序的事件列表、max(id) 水位与多动作类型的最近动作查询。
+保留期清理（services/retention.py）按 risk_scores.window_end / device_logs.timestamp 范围取批，
+评分是否仍被处置动作引用经 risk_actions.score_id 索引判断。
+已有库中缺失的索引由 ensure_indexes 在启动时补建，被取代的 event_type 单列索引同时删除。
+
+查看：GET /risk/scheduler/query-plans；回归测试：tests/test_query_plans.py
+"""
+
+from __future__ import annotations
+
+from datetime import UTC, datetime, timedelta
+from typing import Any, Callable, Dict, List, Tuple
+
+from sqlalchemy import case, exists, func, inspect, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.sql import Select
+
+from ..models import Base, Device, DeviceEvent, DeviceLog, RiskAction, RiskScore
+
+# 不允许出现全表扫描的表
+HOT_TABLES = ("device_events", "risk_actions", "risk_scores", "device_logs")
+
+
+def _ids() -> List[int]:
+    return [1, 2, 3]
+
+
+def _window():
+    end = datetime.now(UTC)
+    return end - timedelta(minutes=5), end
+
+
+# ================== 热点查询目录 ==================
+def _window_counts() -> Select:
+    start, end = _window()
+    bytes_col = DeviceEvent.bytes_out
+    return (
+        select(
+            DeviceEvent.device_id,
+            DeviceEvent.event_type,
+            func.count(DeviceEvent.id),
+            func.max(case((bytes_col > 0, bytes_col))),
+        )
+        .where(
+            DeviceEvent.device_id.in_(_ids()),
+            DeviceEvent.ts >= start,
+            DeviceEvent.ts < end,
+        )
+        .group_by(DeviceEvent.device_id, DeviceEvent.event_type)
+    )
+
+
+def _window_protocols() -> Select:
+    start, end = _window()
+    return (
+        select(DeviceEvent.device_id, DeviceEvent.protocol)
+        .where(
+            DeviceEvent.device_id.in_(_ids()),
+            DeviceEvent.ts >= start,
+            DeviceEvent.ts < end,
+            DeviceEvent.event_type == "net_flow",
+            DeviceEvent.protocol.is_not(None),
+        )
+        .distinct()
+    )
+
+
+def _window_commands() -> Select:
+    start, end = _window()
+    return (
+        select(DeviceEvent.device_id, DeviceEvent.cmd)
+        .where(
+            DeviceEvent.device_id.in_(_ids()),
+            DeviceEvent.ts >= start,
+            DeviceEvent.ts < end,
+            DeviceEvent.event_type == "command",
+            DeviceEvent.cmd.is_not(None),
+        )
+        .order_by(DeviceEvent.id)
+    )
+
+
+def _flow_history_raw() -> Select:
+    start, _ = _window()
+    return (
+        select(
+            DeviceEvent.device_id,
+            func.sum(DeviceEvent.bytes_out),
+            func.count(DeviceEvent.bytes_out),
+        )
+        .where(
+            DeviceEvent.device_id.in_(_ids()),
+            DeviceEvent.event_type == "net_flow",
+            DeviceEvent.ts >= start - timedelta(hours=24),
+            DeviceEvent.ts < start,
+            DeviceEvent.bytes_out > 0,
+        )
+        .group_by(DeviceEvent.device_id)
+    )
+
+
+def _protocol_history_raw() -> Select:
+    start, _ = _window()
+    return (
+        select(DeviceEvent.device_id, DeviceEvent.protocol)
+        .where(
+            DeviceEvent.device_id.in_(_ids()),
+            DeviceEvent.event_type == "net_flow",
+            DeviceEvent.ts < start,
+            DeviceEvent.protocol.in_(["mqtt", "coap"]),
+        )
+        .distinct()
+    )
+
+
+def _event_watermarks() -> Select:
+    max_id = (
+        select(func.max(DeviceEvent.id))
+        .where(DeviceEvent.device_id == Device.id)
+        .correlate(Device)
+        .scalar_subquery()
+    )
+    return select(Device.id, max_id).where(Device.id.in_(_ids()))
+
+
+def _latest_ingested() -> Select:
+    max_ingested = (
+        select(func.max(DeviceEvent.ingested_at))
+        .where(DeviceEvent.device_id == Device.id)
+        .correlate(Device)
+        .scalar_subquery()
+    )
+    return select(Device.id, max_ingested).where(Device.id.in_(_ids()))
+
+
+def _latest_ts() -> Select:
+    max_ts = (
+        select(func.max(DeviceEvent.ts))
+        .where(DeviceEvent.device_id == Device.id, DeviceEvent.ts <= datetime.now(UTC))
+        .correlate(Device)
+        .scalar_subquery()
+    )
+    return select(Device.id, max_ts).where(Device.id.in_(_ids()))
+
+
+def _list_events() -> Select:
+    return (
+        select(DeviceEvent)
+        .where(DeviceEvent.device_id == 1)
+        .order_by(DeviceEvent.id.desc())
+        .limit(50)
+    )
+
+
+def _last_isolation() -> Select:
+    return (
+        select(RiskAction.created_at)
+        .where(RiskAction.device_id == 1, RiskAction.action_type == "isolate")
+        .order_by(RiskAction.id.desc())
+        .limit(1)
+    )
+
+
+def _latest_isolate_or_restore() -> Select:
+    return (
+        select(RiskAction.action_type)
+        .where(RiskAction.device_id == 1, RiskAction.action_type.in_(["isolate", "restore"]))
+        .order_by(RiskAction.id.desc())
+        .limit(1)
+    )
+
+
+def _isolation_state_many() -> Select:
+    return (
+        select(RiskAction.device_id, func.max(RiskAction.id))
+        .where(
+            RiskAction.device_id.in_(_ids()),
+            RiskAction.action_type.in_(["isolate", "restore"]),
+        )
+        .group_by(RiskAction.device_id)
+    )
+
+
+def _recent_levels() -> Select:
+    return (
+        select(RiskScore.level)
+        .where(RiskScore.device_id == 1)
+        .order_by(RiskScore.id.desc())
+        .limit(5)
+    )
+
+
+def _expired_scores() -> Select:
+    cutoff = datetime.now(UTC) - timedelta(days=7)
+    return (
+        select(RiskScore.id, RiskScore.device_id, RiskScore.window_end, RiskScore.score)
+        .where(
+            RiskScore.window_end < cutoff,
+            ~exists().where(RiskAction.score_id == RiskScore.id),
+        )
+        .limit(1000)
+    )
+
+
+def _expired_eval_logs() -> Select:
+    cutoff = datetime.now(UTC) - timedelta(days=7)
+    return (
+        select(DeviceLog.id)
+        .where(DeviceLog.log_type == "risk_eval", DeviceLog.timestamp < cutoff)
+        .limit(1000)
+    )
+
+
+# 名称 -> (查询构造函数, 期望使用的索引)
+HOT_QUERIES: Dict[str, Tuple[Callable[[], Select], str]] = {
+    "events.window_counts": (_window_counts, "ix_device_events_device_ts"),
+    "events.window_protocols": (_window_protocols, "ix_device_events_device_type_ts"),
+    "events.window_commands": (_window_commands, "ix_device_events_device_type_ts"),
+    "events.flow_history_raw": (_flow_history_raw, "ix_device_events_device_type_ts"),
+    "events.protocol_history_raw": (_protocol_history_raw, "ix_device_events_device_type_ts"),
+    "events.watermarks": (_event_watermarks, "ix_device_events_device_id"),
+    "events.latest_ingested": (_latest_ingested, "ix_device_events_device_ingested"),
+    "events.latest_ts": (_latest_ts, "ix_device_events_device_ts"),
+    "events.list_recent": (_list_events, "ix_device_events_device_id"),
+    "actions.last_isolation": (_last_isolation, "ix_risk_actions_device_action"),
+    "actions.latest_isolate_or_restore": (_latest_isolate_or_restore, "ix_risk_actions_device_id"),
+    "actions.isolation_state_many": (_isolation_state_many, "ix_risk_actions_device_action"),
+    "scores.recent_levels": (_recent_levels, "ix_risk_scores_device_id"),
+    "retention.expired_scores": (_expired_scores, "ix_risk_scores_window_end"),
+    "retention.expired_eval_logs": (_expired_eval_logs, "ix_device_logs_timestamp"),
+}
+
+# 已被复合索引取代、补建时顺带删除的旧索引
+OBSOLETE_INDEXES: Dict[str, List[str]] = {
+    "device_events": ["ix_device_events_event_type"],
+}
+
+
+# ================== 执行计划 ==================
+def _is_scan(dialect: str, detail: str) -> bool:
+    if dialect == "sqlite":
+        words = detail.split()
+        return len(words) >= 2 and words[0] == "SCAN" and words[1] in HOT_TABLES
+    return any(f"Seq Scan on {t}" in detail for t in HOT_TABLES)
+
+
+def explain(db: Session, name: str) -> Dict[str, Any]:
+    """
+    返回单条热点查询的执行计划：
+    {name, sql, plan: [行], scans: [全表扫描行], expected_index, uses_expected_index}
+    uses_expected_index 仅对 SQLite 判定（PostgreSQL 的索引选择依赖统计信息，为 None）。
+    """
+    bind = db.get_bind()
+    dialect = bind.dialect.name
+    build, expected = HOT_QUERIES[name]
+    stmt = build()
+    compiled = stmt.compile(dialect=bind.dialect, compile_kwargs={"literal_binds": True})
+    sql = str(compiled)
+    conn = db.connection()
+    if dialect == "sqlite":
+        plan = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+    elif dialect == "postgresql":
+        plan = [row[0] for row in conn.exec_driver_sql(f"EXPLAIN {sql}")]
+    else:
+        plan = []
+    return {
+        "name": name,
+        "sql": sql,
+        "plan": plan,
+        "scans": [line for line in plan if _is_scan(dialect, line)],
+        "expected_index": expected,
+        "uses_expected_index": (
+            any(f"INDEX {expected} " in line for line in plan) if dialect == "sqlite" else None
+        ),
+    }
+
+
+def explain_all(db: Session) -> Dict[str, Any]:
+    """
+    对全部热点查询执行 explain，ok 为 False 表示存在全表扫描或未使用期望索引。
+    """
+    results = [explain(db, name) for name in HOT_QUERIES]
+    return {
+        "dialect": db.get_bind().dialect.name,
+        "ok": not any(r["scans"] or r["uses_expected_index"] is False for r in results),
+        "queries": results,
+    }
+
+
+# ================== 索引维护 ==================
+def ensure_indexes(engine: Engine) -> List[str]:
+    """
+    为已有表补建 models 中声明但库中缺失的索引并删除 OBSOLETE_INDEXES，返回变更的索引名。
+    （create_all 只在建表时创建索引）
+    多个 worker 同时启动时可能并发补建：建 / 删索引使用 IF [NOT] EXISTS，
+    仍因竞争失败（如 PostgreSQL 并发建同名索引）时重新检查，索引已由其它 worker 建好则跳过。
+    """
+    insp = inspect(engine)
+    changed: List[str] = []
+    for table in Base.metadata.sorted_tables:
+        if not insp.has_table(table.name):
+            continue
+        existing = {ix["name"] for ix in insp.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name and index.name not in existing:
+                try:
+                    with engine.begin() as conn:
+                        conn.execute(CreateIndex(index, if_not_exists=True))
+                except DBAPIError:
+                    names = {ix["name"] for ix in inspect(engine).get_indexes(table.name)}
+                    if index.name not in names:
+                        raise
+                    continue
+                changed.append(index.name)
+        for name in OBSOLETE_INDEXES.get(table.name, []):
+            if name in existing:
+                with engine.begin() as conn:
+                    conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+                changed.append(name)
+    return changed
@@ -0,0 +1,412 @@
+"""
+评分 / 日志保留期与降采样
+
+调度器每轮为每台设备写入一条 RiskScore 与一条 risk_eval DeviceLog，两张表此前只增不减。
+保留期任务按表的 TTL（天，0 表示永久保留）分批清理：
+  - risk_scores        RETENTION_RISK_SCORES_DAYS   默认 7；删除前按 (device_id, window_end 所在 UTC 小时)
+                       汇总进 risk_score_hourly（count / sum / min / max / 各等级条数）；
+                       被 risk_actions.score_id 引用的评分不删除
+  - risk_score_hourly  RETENTION_SCORE_HOURLY_DAYS  默认 365
+  - device_logs        RETENTION_EVAL_LOGS_DAYS     默认 7（log_type=risk_eval）
+                       RETENTION_DEVICE_LOGS_DAYS   默认 90（其它类型：告警 / 恢复等）
+  - 事件分区           RETENTION_EVENT_DAYS         默认 0；仅 EVENT_PARTITIONS=1 时整表 DROP 过期分区
+
+同一时刻只有一个进程执行清理：执行前认领 job_leases 中的 retention 租约
+（RETENTION_LOCK_TTL_SECONDS，默认 300，每批提交后续约），其它 worker / 副本认领失败即放弃本次执行，
+避免重复读取同一批过期评分、把小时汇总计入两次。
+
+每批最多 RETENTION_BATCH_SIZE 行（默认 1000），一批一个事务，批间暂停 RETENTION_BATCH_PAUSE_MS
+（默认 20）让出写锁，避免长时间阻塞调度器与事件写入。取批走时间列索引的范围扫描
+（risk_scores.window_end / device_logs.timestamp / risk_score_hourly.bucket_start），不排序。
+
+risk_scores 的 TTL 应大于自动恢复判定所需的最近评分跨度（restore_consecutive 个调度周期）。
+
+调度：/risk/scheduler/retention（状态 / 立即执行 / 启停周期任务）
+单次执行：python -m backend.app.services.retention
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+import traceback
+import uuid
+from datetime import UTC, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import exists
+from sqlalchemy.orm import Session
+
+from ..db import SessionLocal
+from ..models import DeviceLog, RiskAction, RiskScore, RiskScoreHourly
+from . import event_store
+from .scheduler_lease import NODE_ID, claim_job, release_job
+
+RISK_SCORES_DAYS = int(os.getenv("RETENTION_RISK_SCORES_DAYS", "7"))
+SCORE_HOURLY_DAYS = int(os.getenv("RETENTION_SCORE_HOURLY_DAYS", "365"))
+EVAL_LOGS_DAYS = int(os.getenv("RETENTION_EVAL_LOGS_DAYS", "7"))
+DEVICE_LOGS_DAYS = int(os.getenv("RETENTION_DEVICE_LOGS_DAYS", "90"))
+EVENT_DAYS = int(os.getenv("RETENTION_EVENT_DAYS", "0"))
+BATCH_SIZE = max(1, int(os.getenv("RETENTION_BATCH_SIZE", "1000")))
+BATCH_PAUSE_MS = float(os.getenv("RETENTION_BATCH_PAUSE_MS", "20"))
+# 周期任务默认间隔（秒）
+DEFAULT_INTERVAL = int(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+MIN_INTERVAL = 60
+
+EVAL_LOG_TYPE = "risk_eval"
+
+# 跨进程 / 节点互斥租约（job_leases）的名称与有效期；每批提交后续约
+LOCK_NAME = "retention"
+LOCK_TTL_SECONDS = float(os.getenv("RETENTION_LOCK_TTL_SECONDS", "300"))
+
+# 同一进程内同时只允许一次清理（手动触发与周期任务互斥，避免重复汇总）；
+# 多个 worker / 副本之间由 job_leases 租约互斥
+_run_lock = threading.Lock()
+
+
+def _to_utc_aware(dt: datetime) -> datetime:
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=UTC)
+    return dt.astimezone(UTC)
+
+
+def _cutoff(now: datetime, days: int) -> Optional[datetime]:
+    return now - timedelta(days=days) if days > 0 else None
+
+
+def policy() -> Dict[str, Any]:
+    return {
+        "risk_scores_days": RISK_SCORES_DAYS,
+        "score_hourly_days": SCORE_HOURLY_DAYS,
+        "eval_logs_days": EVAL_LOGS_DAYS,
+        "device_logs_days": DEVICE_LOGS_DAYS,
+        "event_days": EVENT_DAYS if event_store.ENABLED else None,
+        "batch_size": BATCH_SIZE,
+        "batch_pause_ms": BATCH_PAUSE_MS,
+    }
+
+
+# ================== 降采样 ==================
+class _Agg:
+    __slots__ = ("count", "total", "low", "high", "levels")
+
+    def __init__(self, score: float) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.low = score
+        self.high = score
+        self.levels: Dict[str, int] = {}
+
+    def add(self, score: float, level: Optional[str]) -> None:
+        self.count += 1
+        self.total += score
+        self.low = min(self.low, score)
+        self.high = max(self.high, score)
+        key = level or "unknown"
+        self.levels[key] = self.levels.get(key, 0) + 1
+
+
+def _merge_hourly(db: Session, rows: List[Any]) -> int:
+    """
+    将一批评分行 (id, device_id, window_end, score, level) 合并进小时汇总（不提交），返回涉及的桶数。
+    """
+    acc: Dict[Tuple[int, datetime], _Agg] = {}
+    for _, device_id, window_end, score, level in rows:
+        bucket = _to_utc_aware(window_end).replace(minute=0, second=0, microsecond=0)
+        agg = acc.get((device_id, bucket))
+        if agg is None:
+            agg = acc[(device_id, bucket)] = _Agg(score)
+        agg.add(score, level)
+
+    buckets = [b for _, b in acc]
+    existing = {
+        (r.device_id, _to_utc_aware(r.bucket_start)): r
+        for r in db.query(RiskScoreHourly).filter(
+            RiskScoreHourly.device_id.in_({d for d, _ in acc}),
+            RiskScoreHourly.bucket_start >= min(buckets),
+            RiskScoreHourly.bucket_start <= max(buckets),
+        )
+    }
+    for (device_id, bucket), agg in acc.items():
+        row = existing.get((device_id, bucket))
+        if row is None:
+            db.add(
+                RiskScoreHourly(
+                    device_id=device_id,
+                    bucket_start=bucket,
+                    score_count=agg.count,
+                    score_sum=agg.total,
+                    score_min=agg.low,
+                    score_max=agg.high,
+                    level_counts=agg.levels,
+                )
+            )
+            continue
+        levels = dict(row.level_counts or {})
+        for level, n in agg.levels.items():
+            levels[level] = levels.get(level, 0) + n
+        row.score_count += agg.count
+        row.score_sum += agg.total
+        row.score_min = min(row.score_min, agg.low)
+        row.score_max = max(row.score_max, agg.high)
+        row.level_counts = levels
+    return len(acc)
+
+
+# ================== 分批清理 ==================
+class _Batcher:
+    """
+    分批执行参数：每批行数、批间暂停、停止检查（周期任务停止时在批间退出）。
+    """
+
+    def __init__(
+        self,
+        batch_size: int = BATCH_SIZE,
+        pause_ms: float = BATCH_PAUSE_MS,
+        should_stop: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        self.batch_size = batch_size
+        self.pause = pause_ms / 1000.0
+        self.should_stop = should_stop or (lambda: False)
+        self.batches = 0
+
+    def next_round(self, last_size: int) -> bool:
+        """
+        上一批处理完后调用：未取满一批（已清空）或被要求停止时返回 False。
+        """
+        self.batches += 1
+        if last_size < self.batch_size or self.should_stop():
+            return False
+        if self.pause > 0:
+            time.sleep(self.pause)
+        return True
+
+
+def _referenced():
+    # 仍被处置动作引用的评分（risk_actions.score_id 外键）保留原始行，审计可追溯到触发评分
+    return exists().where(RiskAction.score_id == RiskScore.id)
+
+
+def downsample_scores(db: Session, cutoff: datetime, batcher: _Batcher) -> int:
+    """
+    汇总并删除 window_end < cutoff 且未被 RiskAction 引用的评分，返回删除行数。
+    """
+    deleted = 0
+    while True:
+        rows = (
+            db.query(
+                RiskScore.id,
+                RiskScore.device_id,
+                RiskScore.window_end,
+                RiskScore.score,
+                RiskScore.level,
+            )
+            .filter(RiskScore.window_end < cutoff, ~_referenced())
+            .limit(batcher.batch_size)
+            .all()
+        )
+        if not rows:
+            return deleted
+        _merge_hourly(db, rows)
+        db.query(RiskScore).filter(RiskScore.id.in_([r[0] for r in rows])).delete(
+            synchronize_session=False
+        )
+        db.commit()
+        deleted += len(rows)
+        if not batcher.next_round(len(rows)):
+            return deleted
+
+
+def _delete_batches(db: Session, model: Any, criteria: List[Any], batcher: _Batcher) -> int:
+    deleted = 0
+    while True:
+        ids = [i for (i,) in db.query(model.id).filter(*criteria).limit(batcher.batch_size)]
+        if not ids:
+            return deleted
+        db.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        deleted += len(ids)
+        if not batcher.next_round(len(ids)):
+            return deleted
+
+
+def run_retention(
+    db: Session,
+    now: Optional[datetime] = None,
+    batch_size: int = BATCH_SIZE,
+    pause_ms: float = BATCH_PAUSE_MS,
+    should_stop: Optional[Callable[[], bool]] = None,
+) -> Dict[str, Any]:
+    """
+    按策略执行一次清理，返回各表删除行数与耗时。
+    本进程或其它进程已有清理在执行时抛出 RuntimeError；执行中租约被接管时在当前批次后停止。
+    """
+    if not _run_lock.acquire(blocking=False):
+        raise RuntimeError("保留期任务正在执行")
+    owner = f"{NODE_ID}:{uuid.uuid4().hex[:8]}"
+    claimed = lost = False
+    try:
+        if not claim_job(db, LOCK_NAME, owner, LOCK_TTL_SECONDS):
+            raise RuntimeError("保留期任务正在其它进程执行")
+        claimed = True
+
+        def _stop() -> bool:
+            nonlocal lost
+            if should_stop is not None and should_stop():
+                return True
+            lost = lost or not claim_job(db, LOCK_NAME, owner, LOCK_TTL_SECONDS)
+            return lost
+
+        now = now or datetime.now(UTC)
+        batcher = _Batcher(batch_size, pause_ms, _stop)
+        t0 = time.perf_counter()
+        report: Dict[str, Any] = {
+            "risk_scores": 0,
+            "risk_score_hourly": 0,
+            "eval_logs": 0,
+            "device_logs": 0,
+            "event_partitions": [],
+        }
+
+        cutoff = _cutoff(now, RISK_SCORES_DAYS)
+        if cutoff is not None:
+            report["risk_scores"] = downsample_scores(db, cutoff, batcher)
+        cutoff = _cutoff(now, SCORE_HOURLY_DAYS)
+        if cutoff is not None:
+            report["risk_score_hourly"] = _delete_batches(
+                db, RiskScoreHourly, [RiskScoreHourly.bucket_start < cutoff], batcher
+            )
+        cutoff = _cutoff(now, EVAL_LOGS_DAYS)
+        if cutoff is not None:
+            report["eval_logs"] = _delete_batches(
+                db,
+                DeviceLog,
+                [DeviceLog.log_type == EVAL_LOG_TYPE, DeviceLog.timestamp < cutoff],
+                batcher,
+            )
+        cutoff = _cutoff(now, DEVICE_LOGS_DAYS)
+        if cutoff is not None:
+            report["device_logs"] = _delete_batches(
+                db,
+                DeviceLog,
+                [DeviceLog.log_type != EVAL_LOG_TYPE, DeviceLog.timestamp < cutoff],
+                batcher,
+            )
+        cutoff = _cutoff(now, EVENT_DAYS)
+        if cutoff is not None and event_store.ENABLED:
+            report["event_partitions"] = event_store.drop_before(db, cutoff.date())
+
+        report["batches"] = batcher.batches
+        report["duration"] = round(time.perf_counter() - t0, 4)
+        report["lease_lost"] = lost
+        return report
+    finally:
+        if claimed and not lost:
+            # 失败时先丢弃未提交的批次，再释放租约（否则其它进程需等待 TTL）
+            try:
+                db.rollback()
+                release_job(db, LOCK_NAME, owner)
+            except Exception:
+                traceback.print_exc()
+        _run_lock.release()
+
+
+# ================== 周期任务 ==================
+class RetentionState:
+    """
+    周期清理线程状态，通过 /risk/scheduler/retention 查询。
+    """
+
+    def __init__(self):
+        self.thread: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+        self.interval_seconds: int = DEFAULT_INTERVAL
+        self.running: bool = False
+        self.last_run_start: Optional[float] = None
+        self.last_run_duration: Optional[float] = None
+        self.last_run_error: Optional[str] = None
+        self.last_report: Optional[Dict[str, Any]] = None
+        self.total_runs: int = 0
+
+
+retention_state = RetentionState()
+
+
+def start_retention(interval_seconds: int = DEFAULT_INTERVAL) -> bool:
+    """
+    启动周期清理线程。若已在运行返回 False。
+    """
+    if interval_seconds < MIN_INTERVAL:
+        raise ValueError(f"interval_seconds 不能少于 {MIN_INTERVAL} 秒")
+    st = retention_state
+    if st.running:
+        return False
+    st.interval_seconds = interval_seconds
+    st.stop_event.clear()
+    t = threading.Thread(target=_runner, name="RetentionThread", daemon=True)
+    st.thread = t
+    st.running = True
+    t.start()
+    return True
+
+
+def stop_retention() -> bool:
+    """
+    停止周期清理线程（进行中的清理在当前批次提交后退出）。若未运行返回 False。
+    """
+    st = retention_state
+    if not st.running:
+        return False
+    st.stop_event.set()
+    if st.thread and st.thread.is_alive():
+        st.thread.join(timeout=5)
+    st.running = False
+    return True
+
+
+def get_status() -> Dict[str, Any]:
+    st = retention_state
+    return {
+        "running": st.running,
+        "interval_seconds": st.interval_seconds,
+        "policy": policy(),
+        "last_run_start": st.last_run_start,
+        "last_run_duration": st.last_run_duration,
+        "last_run_error": st.last_run_error,
+        "last_report": st.last_report,
+        "total_runs": st.total_runs,
+    }
+
+
+def _runner() -> None:
+    st = retention_state
+    while not st.stop_event.is_set():
+        st.last_run_start = time.time()
+        db = SessionLocal()
+        try:
+            st.last_report = run_retention(db, should_stop=st.stop_event.is_set)
+            st.last_run_error = None
+        except Exception as e:
+            db.rollback()
+            st.last_run_error = f"{e.__class__.__name__}: {e}"
+            traceback.print_exc()
+        finally:
+            db.close()
+        st.last_run_duration = round(time.time() - st.last_run_start, 4)
+        st.total_runs += 1
+        # 可中断的等待
+        st.stop_event.wait(st.interval_seconds)
+    st.running = False
+
+
+if __name__ == "__main__":
+    from ..db import engine
+    from ..models import Base
+
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        print(f"[retention] {run_retention(session)}")
+    finally:
+        session.close()
@@ -22,7 +22,7 @@
 from __future__ import annotations
 
 from datetime import UTC, datetime, timedelta
-from typing import Optional, Union
+from typing import Mapping, Optional, Union
 
 from sqlalchemy import text
 from sqlalchemy.orm import Session
@@ -61,7 +61,7 @@ def maybe_apply_auto_actions(db: Session, score: RiskScore) -> Optional[str]:
     兼容旧版本的入口函数。外部调用保持不变。
     满足条件则执行自动隔离。
     """
-    cfg = risk_config.get() or {}
+    cfg = risk_config.snapshot()
     auto_cfg = cfg.get("auto_response", {})
 
     if not auto_cfg.get("enable_isolation"):
@@ -77,7 +77,7 @@ def maybe_apply_auto_actions(db: Session, score: RiskScore) -> Optional[str]:
 # ---------------------------------------------------------------------------
 # 自动隔离核心逻辑
 # ---------------------------------------------------------------------------
-def auto_isolation_process(db: Session, score: RiskScore, config: dict) -> Optional[str]:
+def auto_isolation_process(db: Session, score: RiskScore, config: Mapping) -> Optional[str]:
     """
     幂等自动隔离逻辑：
       1. 升级未执行的旧 auto_isolate
@@ -196,7 +196,7 @@ def maybe_auto_restore(db: Session, score: RiskScore) -> Optional[str]:
         - 冷却期内不重复
         - 1 分钟内已有新 restore 记录不重复
     """
-    cfg = risk_config.get() or {}
+    cfg = risk_config.snapshot()
     ar = cfg.get("auto_response", {})
     if not ar.get("enable_restore"):
         return None
@@ -1,8 +1,11 @@
 import copy
+import hashlib
 import json
 import os
 import threading
-from typing import Any, Dict
+import time
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, Mapping, Optional, Tuple
 
 """
 risk_config.py
@@ -32,6 +35,11 @@ risk_config.py
        }
    在 load() 时会自动检测旧结构并迁移。
 4. 线程安全 get / merge / replace
+5. 只读版本快照 snapshot()：每次 load / merge / replace 发布一个新的冻结快照（version 递增），
+   读取方拿到引用即可，无拷贝、无锁；需要可修改的副本时仍使用 get()
+6. 多 worker 配置传播：后台线程按 RISK_CONFIG_WATCH_SECONDS 轮询 risk_config.json 的
+   (mtime, size, inode)，变化时重新加载并发布新快照；评估热路径不做任何文件读取。
+   写入使用临时文件 + os.replace，轮询方不会读到半写入的文件
 """
 
 # ========== 新版默认配置 ==========
@@ -76,6 +84,58 @@ _DEFAULT_CONFIG: Dict[str, Any] = {
 }
 
 
+def _freeze(value: Any) -> Any:
+    if isinstance(value, Mapping):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _thaw(value: Any) -> Any:
+    if isinstance(value, Mapping):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(v) for v in value]
+    return value
+
+
+class ConfigSnapshot(Mapping):
+    """
+    冻结的配置快照：嵌套 dict 为只读映射，list 为 tuple，任何修改都会抛 TypeError。
+    version 为本进程内发布序号（每次 load / merge / replace 加一）。
+    """
+
+    __slots__ = ("_data", "version", "digest", "published_at")
+
+    def __init__(self, data: Mapping[str, Any], version: int = 0):
+        self._data: Mapping[str, Any] = _freeze(data)
+        self.version = version
+        # 内容摘要：version 只在本进程内递增，跨 worker 比较配置是否一致用 digest
+        self.digest = hashlib.sha1(
+            json.dumps(_thaw(self._data), sort_keys=True, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()[:12]
+        self.published_at = time.time()
+
+    def __getitem__(self, key: str) -> Any:
+        return self._data[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        可修改的普通 dict 副本（list 还原为 list）
+        """
+        return _thaw(self._data)
+
+    def __repr__(self) -> str:
+        return f"ConfigSnapshot(version={self.version})"
+
+
 class RiskConfig:
     """
     - 初次不存在: 写入默认
@@ -88,19 +148,38 @@ class RiskConfig:
         self.path = path
         self._lock = threading.RLock()
         self._data: Dict[str, Any] = {}
+        self._version = 0
+        self._snapshot = ConfigSnapshot({}, 0)
+        # 最近一次读/写文件时的 (mtime_ns, size, inode)，用于检测其它进程的修改
+        self._file_sig: Optional[Tuple[int, int, int]] = None
+        self._reloads = 0
         self.load()
 
     # ---------------- Public API ----------------
     def get(self) -> Dict[str, Any]:
-        with self._lock:
-            return copy.deepcopy(self._data)
+        """
+        可修改的深拷贝（配置编辑用）；只读场景请用 snapshot()
+        """
+        return self._snapshot.to_dict()
+
+    def snapshot(self) -> ConfigSnapshot:
+        """
+        当前发布的只读快照。引用赋值是原子的，读取无需加锁。
+        """
+        return self._snapshot
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
 
     def load(self):
         with self._lock:
             if os.path.isfile(self.path):
                 try:
+                    sig = self._stat_sig()
                     with open(self.path, "r", encoding="utf-8") as f:
                         self._data = json.load(f)
+                    self._file_sig = sig
                 except Exception:
                     self._data = copy.deepcopy(_DEFAULT_CONFIG)
             else:
@@ -114,10 +193,48 @@ class RiskConfig:
             # 旧结构向后兼容转换
             if self._maybe_migrate_legacy_auto_response(self._data):
                 self._save_unlocked()
+            self._publish_unlocked()
 
     def reload(self):
         self.load()
 
+    def reload_if_changed(self) -> bool:
+        """
+        文件签名变化时重新加载（由配置监听线程调用），返回是否发布了新快照。
+        文件暂时无法解析（例如被外部编辑到一半）时保留当前快照，下次轮询重试。
+        """
+        sig = self._stat_sig()
+        if sig is None or sig == self._file_sig:
+            return False
+        with self._lock:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except Exception:
+                return False
+            if not isinstance(data, dict):
+                return False
+            self._file_sig = sig
+            self._upgrade_schema(data, _DEFAULT_CONFIG)
+            self._maybe_migrate_legacy_auto_response(data)
+            if ConfigSnapshot(data).digest == self._snapshot.digest:
+                return False
+            self._data = data
+            self._publish_unlocked()
+            self._reloads += 1
+            return True
+
+    def runtime_info(self) -> Dict[str, Any]:
+        snap = self._snapshot
+        return {
+            "pid": os.getpid(),
+            "version": snap.version,
+            "digest": snap.digest,
+            "published_at": snap.published_at,
+            "reloads": self._reloads,
+            "path": self.path,
+        }
+
     def merge(self, patch: Dict[str, Any]) -> Dict[str, Any]:
         """
         递归 merge 后持久化，返回新的深拷贝
@@ -137,7 +254,8 @@ class RiskConfig:
                 # 若用户通过 patch 又打回旧结构，强制迁回新结构
                 pass
             self._save_unlocked()
-            return copy.deepcopy(self._data)
+            self._publish_unlocked()
+            return self._snapshot.to_dict()
 
     def replace_and_persist(self, new_cfg: Dict[str, Any]) -> Dict[str, Any]:
         with self._lock:
@@ -148,13 +266,30 @@ class RiskConfig:
             if changed_schema or changed_migrate:
                 pass
             self._save_unlocked()
-            return copy.deepcopy(self._data)
+            self._publish_unlocked()
+            return self._snapshot.to_dict()
 
     # ---------------- Internal helpers ----------------
+    def _publish_unlocked(self):
+        # 先构造完整快照再整体替换引用，读取方不会看到半更新的配置
+        self._version += 1
+        self._snapshot = ConfigSnapshot(self._data, self._version)
+
+    def _stat_sig(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
     def _save_unlocked(self):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
         try:
-            with open(self.path, "w", encoding="utf-8") as f:
+            with open(tmp, "w", encoding="utf-8") as f:
                 json.dump(self._data, f, indent=2, ensure_ascii=False)
+            os.replace(tmp, self.path)
+            # 记录自己写入后的签名，避免监听线程把本进程的写入当作外部修改
+            self._file_sig = self._stat_sig()
         except Exception:
             # 静默：可按需改为日志
             pass
@@ -274,3 +409,50 @@ PROJECT_ROOT = os.path.abspath(
 CONFIG_PATH = os.getenv("RISK_CONFIG_PATH", os.path.join(PROJECT_ROOT, "risk_config.json"))
 
 risk_config = RiskConfig(CONFIG_PATH)
+
+
+# ---------------- 配置监听（多 worker 传播） ----------------
+# 轮询间隔（秒）；0 表示不启动监听线程
+WATCH_SECONDS = float(os.getenv("RISK_CONFIG_WATCH_SECONDS", "2"))
+
+_watch_stop = threading.Event()
+_watch_thread: Optional[threading.Thread] = None
+
+
+def _watch_loop(interval: float) -> None:
+    while not _watch_stop.wait(interval):
+        try:
+            if risk_config.reload_if_changed():
+                info = risk_config.runtime_info()
+                print(
+                    f"[RiskConfig] reloaded pid={info['pid']} "
+                    f"version={info['version']} digest={info['digest']}"
+                )
+        except Exception as e:
+            print(f"[RiskConfig] watch error: {e}")
+
+
+def start_watcher(interval: Optional[float] = None) -> bool:
+    """
+    启动配置监听线程（每个 worker 进程各一个）。已在运行或间隔为 0 时返回 False。
+    """
+    global _watch_thread
+    interval = WATCH_SECONDS if interval is None else interval
+    if interval <= 0 or (_watch_thread is not None and _watch_thread.is_alive()):
+        return False
+    _watch_stop.clear()
+    _watch_thread = threading.Thread(
+        target=_watch_loop, args=(interval,), name="RiskConfigWatcher", daemon=True
+    )
+    _watch_thread.start()
+    return True
+
+
+def stop_watcher() -> bool:
+    global _watch_thread
+    if _watch_thread is None:
+        return False
+    _watch_stop.set()
+    _watch_thread.join(timeout=5)
+    _watch_thread = None
+    return True
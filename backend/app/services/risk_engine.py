@@ -4,15 +4,39 @@
 
 from __future__ import annotations
 
+import os
 from datetime import UTC, datetime, timedelta
-from typing import Any, Dict, List, Optional, Set
+from typing import Any, ContextManager, Dict, FrozenSet, List, Mapping, Optional, Set, Tuple
 
+from sqlalchemy import case, func, null
 from sqlalchemy.orm import Session
 
-from ..models import DeviceEvent, DeviceLog, RiskAction, RiskScore
+from ..models import Device, DeviceLog, RiskAction, RiskScore
+from . import event_store, flow_rollup, protocol_index, risk_metrics, risk_state, risk_window
 
 # 使用你已有的动态配置加载器
 from .risk_config import risk_config
+from .risk_metrics import (
+    ALL_NEEDS,
+    COMMANDS,
+    FLOW_HISTORY,
+    FLOW_PEAK,
+    PROTOCOLS,
+    Metric,
+    WindowStats,
+    timed,
+)
+
+# 窗口统计默认走聚合路径；设 RISK_ENGINE_AGGREGATE=0 回退到逐行加载
+RISK_ENGINE_AGGREGATE = os.getenv("RISK_ENGINE_AGGREGATE", "1") != "0"
+# 聚合路径的新协议判定走 device_protocols 索引；设 RISK_PROTOCOL_INDEX=0 改为扫描历史事件
+RISK_PROTOCOL_INDEX = os.getenv("RISK_PROTOCOL_INDEX", "1") != "0"
+# 聚合路径的 24h 流量基线走 device_flow_rollups 小时汇总；设 RISK_FLOW_ROLLUP=0 改为扫描原始事件
+RISK_FLOW_ROLLUP = os.getenv("RISK_FLOW_ROLLUP", "1") != "0"
+# 聚合路径的窗口计数读内存滑窗（需单进程内写入+评估）；默认关闭
+RISK_WINDOW_STATE = risk_window.ENABLED
+# 单事务评估：评分、日志、自动隔离/恢复一次 commit；设 RISK_SINGLE_TRANSACTION=0 回退为逐步 commit
+RISK_SINGLE_TRANSACTION = os.getenv("RISK_SINGLE_TRANSACTION", "1") != "0"
 
 
 def _to_utc_aware(dt: Optional[datetime]) -> Optional[datetime]:
@@ -40,57 +64,67 @@ def run_ml_anomaly(features: dict) -> Optional[dict]:
 
 
 # ================== 内部状态/动作辅助函数 ==================
-def _latest_isolation_or_restore(db: Session, device_id: int) -> Optional[RiskAction]:
+# 只读判定均为列投影查询：不加载 ORM 实体（也就不连带 joined 关系），不进入会话 identity map
+def _latest_isolation_or_restore(db: Session, device_id: int) -> Optional[str]:
+    """
+    返回最近一条 isolate / restore 动作的类型，无动作返回 None。
+    """
     return (
-        db.query(RiskAction)
+        db.query(RiskAction.action_type)
         .filter(
             RiskAction.device_id == device_id, RiskAction.action_type.in_(["isolate", "restore"])
         )
         .order_by(RiskAction.id.desc())
-        .first()
+        .limit(1)
+        .scalar()
     )
 
 
 def _is_device_isolated(db: Session, device_id: int) -> bool:
-    act = _latest_isolation_or_restore(db, device_id)
-    return bool(act and act.action_type == "isolate")
+    return _latest_isolation_or_restore(db, device_id) == "isolate"
 
 
 def _last_isolation_time(db: Session, device_id: int) -> Optional[datetime]:
-    act = (
-        db.query(RiskAction)
+    return (
+        db.query(RiskAction.created_at)
         .filter(RiskAction.device_id == device_id, RiskAction.action_type == "isolate")
         .order_by(RiskAction.id.desc())
-        .first()
+        .limit(1)
+        .scalar()
     )
-    # 修正：只返回 created_at 字段实际值（类型为 Optional[datetime]），而不是 Column
-    return act.created_at if act else None
 
 
-def _recent_scores(db: Session, device_id: int, limit: int) -> List[RiskScore]:
-    return (
-        db.query(RiskScore)
+def _recent_levels(db: Session, device_id: int, limit: int) -> List[str]:
+    """
+    最近 limit 条评分等级（按 id 倒序）。
+    """
+    return [
+        level
+        for (level,) in db.query(RiskScore.level)
         .filter(RiskScore.device_id == device_id)
         .order_by(RiskScore.id.desc())
         .limit(limit)
-        .all()
-    )
+    ]
 
 
 # ================== 自动隔离 ==================
 def maybe_auto_isolate(
     db: Session,
     risk_score: RiskScore,
-    cfg: Dict[str, Any],
+    cfg: Mapping[str, Any],
+    commit: bool = True,
 ):
     """
     触发条件:
       - 当前评分等级为 high
       - 配置 auto_response.isolate.high = True
       - 当前尚未处于隔离状态
+
+    commit=False 时只写入会话并 flush，由调用方统一提交：会话为 autoflush=False，
+    不 flush 时同一事务内后续的隔离状态查询（自动恢复 / 再次评估）看不到本次隔离，可能重复隔离。
     """
     auto_cfg = cfg.get("auto_response", {})
-    iso_cfg = auto_cfg.get("isolate", {}) if isinstance(auto_cfg, dict) else {}
+    iso_cfg = auto_cfg.get("isolate", {}) if isinstance(auto_cfg, Mapping) else {}
 
     if risk_score.level != "high":
         return
@@ -120,14 +154,18 @@ def maybe_auto_isolate(
             message=f"Auto isolation applied score={risk_score.score} level={risk_score.level}",
         )
     )
-    db.commit()
+    if commit:
+        db.commit()
+    else:
+        db.flush()
 
 
 # ================== 自动恢复 ==================
 def maybe_auto_restore(
     db: Session,
-    cfg: Dict[str, Any],
+    cfg: Mapping[str, Any],
     risk_score: RiskScore,
+    commit: bool = True,
 ):
     """
     触发条件:
@@ -136,9 +174,12 @@ def maybe_auto_restore(
       - 距离最新隔离动作 >= cooldown_seconds
       - 最近 lookback_scores 条评分中，最新连续 min_consecutive_non_high 条都属于 allow_levels
         (并且这些条目为最新的倒序序列)
+
+    commit=False 时只写入会话并 flush，由调用方统一提交（会话为 autoflush=False，
+    flush 后同一事务内的隔离状态查询才能看到本次恢复）。
     """
     auto_cfg = cfg.get("auto_response", {})
-    restore_cfg = auto_cfg.get("restore", {}) if isinstance(auto_cfg, dict) else {}
+    restore_cfg = auto_cfg.get("restore", {}) if isinstance(auto_cfg, Mapping) else {}
     if not restore_cfg.get("enabled"):
         return
 
@@ -158,12 +199,12 @@ def maybe_auto_restore(
     if datetime.now(UTC) - last_iso < timedelta(seconds=cooldown_seconds):
         return
 
-    scores = _recent_scores(db, device_id, lookback)
-    if len(scores) < min_consecutive:
+    levels = _recent_levels(db, device_id, lookback)
+    if len(levels) < min_consecutive:
         return
 
-    latest_needed = scores[:min_consecutive]  # 已按 id desc
-    if all(s.level in allow_levels for s in latest_needed):
+    latest_needed = levels[:min_consecutive]  # 已按 id desc
+    if all(level in allow_levels for level in latest_needed):
         # 双检：防并发重复恢复
         if not _is_device_isolated(db, device_id):
             return
@@ -186,167 +227,418 @@ def maybe_auto_restore(
                 message=f"Auto restore triggered after {min_consecutive} non-high scores",
             )
         )
-        db.commit()
+        if commit:
+            db.commit()
+        else:
+            db.flush()
 
 
-# ================== 评分核心 (保留你原来的逻辑, 仅内联改造) ==================
-def compute_risk_for_device(db: Session, device_id: int, window_minutes: int = 5) -> RiskScore:
+# ================== 窗口统计采集 ==================
+def _collect_stats_rows(
+    db: Session, device_id: int, window_start: datetime, window_end: datetime
+) -> WindowStats:
     """
-    按指定窗口计算风险，写入 RiskScore，并执行自动隔离/恢复判定。
+    行加载路径：逐行读取窗口内事件后在 Python 中计数。
+    只投影评分用到的列（Row 为具名元组），不构造 DeviceEvent 实体、不进入 identity map，
+    也不会连带加载 Device 关系。
     """
-    cfg = risk_config.get()
-    W = cfg["weights"]
-    T = cfg["thresholds"]
-    level_cfg = cfg["score_levels"]
-
-    window_end = datetime.now(UTC)
-    window_start = window_end - timedelta(minutes=window_minutes)
-
+    stats = WindowStats()
+    ev = event_store.source(db, window_start, window_end)
     events = (
-        db.query(DeviceEvent)
+        db.query(ev.c.event_type, ev.c.bytes_out, ev.c.protocol, ev.c.cmd)
         .filter(
-            DeviceEvent.device_id == device_id,
-            DeviceEvent.ts >= window_start,
-            DeviceEvent.ts < window_end,
+            ev.c.device_id == device_id,
+            ev.c.ts >= window_start,
+            ev.c.ts < window_end,
         )
+        .order_by(ev.c.id)
         .all()
     )
+    if not events:
+        return stats
+
+    stats.event_count = len(events)
+    stats.auth_fail = sum(1 for e in events if e.event_type == "auth_fail")
+    stats.auth_ok = sum(1 for e in events if e.event_type == "auth_success")
+    stats.policy_viol = sum(1 for e in events if e.event_type == "policy_violation")
+    net_flows = [e for e in events if e.event_type == "net_flow"]
+
+    cur_vals = [e.bytes_out for e in net_flows if (e.bytes_out or 0) > 0]
+    if cur_vals:
+        stats.flow_peak = _as_number(max(cur_vals))
+
+    day_ago = window_end - timedelta(hours=24)
+    hist = event_store.source(db, day_ago, window_start)
+    hist_vals = [
+        b
+        for (b,) in db.query(hist.c.bytes_out).filter(
+            hist.c.device_id == device_id,
+            hist.c.event_type == "net_flow",
+            hist.c.ts >= day_ago,
+            hist.c.ts < window_start,
+        )
+        if b is not None and b > 0
+    ]
+    stats.hist_mean = (sum(hist_vals) / len(hist_vals)) if hist_vals else 0
+
+    past = event_store.source(db, None, window_start)
+    hist_protocols = {
+        p
+        for (p,) in db.query(past.c.protocol)
+        .filter(
+            past.c.device_id == device_id,
+            past.c.event_type == "net_flow",
+            past.c.ts < window_start,
+            past.c.protocol.is_not(None),
+        )
+        .distinct()
+    }
+    stats.new_protocols = set(
+        e.protocol for e in net_flows if e.protocol and e.protocol not in hist_protocols
+    )
 
-    reasons: List[Dict[str, Any]] = []
-    score = 0.0
-
-    if events:
-        auth_fail = sum(1 for e in events if e.event_type == "auth_fail")
-        auth_ok = sum(1 for e in events if e.event_type == "auth_success")
-        policy_viol = sum(1 for e in events if e.event_type == "policy_violation")
-        net_flows = [e for e in events if e.event_type == "net_flow"]
-        cmd_events = [e for e in events if e.event_type == "command"]
-
-        # 1. 认证失败率
-        total_auth = auth_fail + auth_ok
-        if total_auth >= T["auth_fail_min_total"] and auth_fail >= T["auth_fail_min_fail"]:
-            fail_rate = auth_fail / total_auth if total_auth > 0 else 0
-            if fail_rate >= T["auth_fail_rate_min"]:
-                w = W["auth_fail_rate"]
-                score += w
-                reasons.append(
-                    {
-                        "metric": "auth_fail_rate",
-                        "auth_fail": auth_fail,
-                        "total_auth": total_auth,
-                        "fail_rate": round(fail_rate, 3),
-                        "weight": w,
-                    }
-                )
+    stats.cmds = [e.cmd for e in events if e.event_type == "command" and e.cmd]
+    return stats
 
-        # 2. 策略违规 (叠加步进， capped)
-        if policy_viol > 0:
-            w = min(W["policy_violation_base"] + policy_viol * W["policy_violation_step"], 30)
-            score += w
-            reasons.append({"metric": "policy_violation", "count": policy_viol, "weight": w})
 
-        # 3. 流量突增 (对比最近24h历史)
-        def _bytes(e):
-            return (e.payload or {}).get("bytes_out", 0)
+def _as_number(v: Any) -> Any:
+    """
+    bytes_out 为浮点列；整数值还原为 int，
+    使 reasons 中的 peak 与 payload 中的整数流量一致（30000 而非 30000.0）。
+    """
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    return v
 
-        cur_vals = [_bytes(e) for e in net_flows if _bytes(e) > 0]
 
-        day_ago = window_end - timedelta(hours=24)
-        hist_flows = (
-            db.query(DeviceEvent)
+def _collect_stats_aggregate(
+    db: Session,
+    device_id: int,
+    window_start: datetime,
+    window_end: datetime,
+    needs: FrozenSet[str] = ALL_NEEDS,
+) -> WindowStats:
+    """
+    聚合路径（单设备）：见 _collect_stats_many。
+    """
+    return _collect_stats_many(db, [device_id], window_start, window_end, needs)[device_id]
+
+
+def _collect_stats_many(
+    db: Session,
+    device_ids: List[int],
+    window_start: datetime,
+    window_end: datetime,
+    needs: FrozenSet[str] = ALL_NEEDS,
+) -> Dict[int, WindowStats]:
+    """
+    聚合路径：
+      1. 窗口部分（计数 / 流量峰值 / 协议 / 命令）：
+         - 默认由 SQL 聚合得到（见 _fill_window_sql）
+         - RISK_WINDOW_STATE=1 时直接读内存滑窗计数，不访问 device_events（首次使用时冷启动重建）
+      2. 历史部分（24h 流量基线 / 新协议）：仅对有相应事件的设备整批查询
+    needs 为评分计划（risk_metrics.plan）需要的数据，未列出的部分不查询。
+    """
+    out: Dict[int, WindowStats] = {d: WindowStats() for d in device_ids}
+    if not device_ids:
+        return out
+    if RISK_WINDOW_STATE:
+        risk_window.ensure_ready(db)
+        with timed("query:window_memory"):
+            win_protos = _fill_window_memory(out, window_start, window_end)
+    else:
+        win_protos = _fill_window_sql(db, out, window_start, window_end, needs)
+    _fill_history(db, out, win_protos, window_start, window_end, needs)
+    return out
+
+
+def _fill_window_sql(
+    db: Session,
+    out: Dict[int, WindowStats],
+    window_start: datetime,
+    window_end: datetime,
+    needs: FrozenSet[str] = ALL_NEEDS,
+) -> Dict[int, Set[Any]]:
+    """
+    窗口计数与流量峰值由一条 GROUP BY (device_id, event_type) 查询返回，不再物化 ORM 对象；
+    协议 / 命令仅在计划需要时、对存在对应事件的设备整批查询。返回 {device_id: 窗口协议集合}。
+    """
+    device_ids = list(out)
+    ev = event_store.source(db, window_start, window_end)
+    bytes_col = ev.c.bytes_out
+    proto_col = ev.c.protocol
+    cmd_col = ev.c.cmd
+
+    # 不需要流量峰值时不计算峰值列
+    peak_col = func.max(case((bytes_col > 0, bytes_col))) if FLOW_PEAK in needs else null()
+    with timed("query:window_counts"):
+        grouped = (
+            db.query(ev.c.device_id, ev.c.event_type, func.count(ev.c.id), peak_col)
             .filter(
-                DeviceEvent.device_id == device_id,
-                DeviceEvent.event_type == "net_flow",
-                DeviceEvent.ts >= day_ago,
-                DeviceEvent.ts < window_start,
+                ev.c.device_id.in_(device_ids),
+                ev.c.ts >= window_start,
+                ev.c.ts < window_end,
             )
+            .group_by(ev.c.device_id, ev.c.event_type)
             .all()
         )
-        hist_vals = [_bytes(e) for e in hist_flows if _bytes(e) > 0]
-
-        if cur_vals:
-            cur_peak = max(cur_vals)
-            hist_mean = (sum(hist_vals) / len(hist_vals)) if hist_vals else 0
-            if (
-                hist_mean > 0
-                and cur_peak / hist_mean > T["flow_spike_ratio"]
-                and cur_peak > T["flow_spike_min_bytes"]
+
+    flow_devices: Set[int] = set()
+    cmd_devices: Set[int] = set()
+    for device_id, event_type, cnt, peak in grouped:
+        stats = out[device_id]
+        stats.event_count += cnt
+        if event_type == "auth_fail":
+            stats.auth_fail = cnt
+        elif event_type == "auth_success":
+            stats.auth_ok = cnt
+        elif event_type == "policy_violation":
+            stats.policy_viol = cnt
+        elif event_type == "net_flow":
+            flow_devices.add(device_id)
+            if peak is not None:
+                stats.flow_peak = _as_number(peak)
+        elif event_type == "command":
+            cmd_devices.add(device_id)
+
+    win_protos: Dict[int, Set[Any]] = {}
+    if flow_devices and PROTOCOLS in needs:
+        with timed("query:protocols"):
+            for device_id, p in (
+                db.query(ev.c.device_id, proto_col)
+                .filter(
+                    ev.c.device_id.in_(flow_devices),
+                    ev.c.ts >= window_start,
+                    ev.c.ts < window_end,
+                    ev.c.event_type == "net_flow",
+                    proto_col.is_not(None),
+                )
+                .distinct()
             ):
-                w = W["flow_spike"]
-                score += w
-                reasons.append(
-                    {"metric": "flow_spike", "peak": cur_peak, "hist_mean": hist_mean, "weight": w}
+                win_protos.setdefault(device_id, set()).add(p)
+
+    if cmd_devices and COMMANDS in needs:
+        with timed("query:commands"):
+            for device_id, c in (
+                db.query(ev.c.device_id, cmd_col)
+                .filter(
+                    ev.c.device_id.in_(cmd_devices),
+                    ev.c.ts >= window_start,
+                    ev.c.ts < window_end,
+                    ev.c.event_type == "command",
+                    cmd_col.is_not(None),
                 )
-            elif hist_mean == 0 and cur_peak > T["flow_spike_first_min_bytes"]:
-                w = W["flow_spike_first"]
-                score += w
-                reasons.append({"metric": "flow_spike_first", "peak": cur_peak, "weight": w})
-
-        # 4. 新协议
-        hist_protocols = set(
-            (e.payload or {}).get("protocol")
-            for e in db.query(DeviceEvent).filter(
-                DeviceEvent.device_id == device_id,
-                DeviceEvent.event_type == "net_flow",
-                DeviceEvent.ts < window_start,
-            )
-            if (e.payload or {}).get("protocol")
-        )
-        new_protos = set(
-            (e.payload or {}).get("protocol")
-            for e in net_flows
-            if (e.payload or {}).get("protocol")
-            and (e.payload or {}).get("protocol") not in hist_protocols
-        )
-        if new_protos:
-            w = W["new_protocol"]
-            score += w
-            reasons.append({"metric": "new_protocol", "protocols": list(new_protos), "weight": w})
-
-        # 5. 命令异常
-        # baseline 定义为常规命令集
-        baseline_cmds = {"ls", "status"}
-        anomal_cmds = [
-            (e.payload or {}).get("cmd")
-            for e in cmd_events
-            if (e.payload or {}).get("cmd") and (e.payload or {}).get("cmd") not in baseline_cmds
-        ]
-        if anomal_cmds:
-            w = min(
-                W["command_anomaly_base"] + len(anomal_cmds) * W["command_anomaly_step"],
-                W["command_anomaly_max"],
-            )
-            score += w
-            reasons.append(
-                {
-                    "metric": "command_anomaly",
-                    "count": len(anomal_cmds),
-                    "cmds": anomal_cmds,
-                    "weight": w,
-                }
-            )
+                .order_by(ev.c.id)
+            ):
+                out[device_id].cmds.append(c)
+    return win_protos
+
 
-        # 6. ML (可选占位)
-        ml_res = run_ml_anomaly({"device_id": device_id, "event_count": len(events)})
-        if ml_res:
-            ml_weight = 15 * ml_res.get("score", 0)
-            score += ml_weight
-            reasons.append(
-                {
-                    "metric": "ml_anomaly",
-                    "model": ml_res.get("model"),
-                    "raw_score": ml_res.get("score"),
-                    "weight": ml_weight,
+def _fill_window_memory(
+    out: Dict[int, WindowStats], window_start: datetime, window_end: datetime
+) -> Dict[int, Set[Any]]:
+    """
+    从内存滑窗（risk_window）读取窗口计数，O(桶数)，不访问数据库。
+    """
+    win_protos: Dict[int, Set[Any]] = {}
+    for device_id, snap in risk_window.snapshot(list(out), window_start, window_end).items():
+        stats = out[device_id]
+        stats.event_count = snap["event_count"]
+        stats.auth_fail = snap["auth_fail"]
+        stats.auth_ok = snap["auth_success"]
+        stats.policy_viol = snap["policy_violation"]
+        stats.flow_peak = snap["flow_peak"]
+        stats.cmds = snap["cmds"]
+        if snap["protocols"]:
+            win_protos[device_id] = snap["protocols"]
+    return win_protos
+
+
+def _fill_history(
+    db: Session,
+    out: Dict[int, WindowStats],
+    win_protos: Dict[int, Set[Any]],
+    window_start: datetime,
+    window_end: datetime,
+    needs: FrozenSet[str] = ALL_NEEDS,
+) -> None:
+    """
+    24h 流量基线（仅有峰值的设备）与新协议判定（仅窗口内有协议的设备），均按计划需要才查询。
+    """
+    peak_devices = [d for d, s in out.items() if s.flow_peak is not None]
+    if peak_devices and FLOW_HISTORY in needs:
+        day_ago = window_end - timedelta(hours=24)
+        with timed("query:flow_history"):
+            if RISK_FLOW_ROLLUP:
+                means = flow_rollup.hist_means(db, peak_devices, day_ago, window_start)
+            else:
+                hist = event_store.source(db, day_ago, window_start)
+                bytes_col = hist.c.bytes_out
+                means = {
+                    d: (s or 0) / c
+                    for d, s, c in db.query(
+                        hist.c.device_id, func.sum(bytes_col), func.count(bytes_col)
+                    )
+                    .filter(
+                        hist.c.device_id.in_(peak_devices),
+                        hist.c.event_type == "net_flow",
+                        hist.c.ts >= day_ago,
+                        hist.c.ts < window_start,
+                        bytes_col > 0,
+                    )
+                    .group_by(hist.c.device_id)
+                    if c
                 }
-            )
+        for d, mean in means.items():
+            out[d].hist_mean = mean
+
+    if not win_protos or PROTOCOLS not in needs:
+        return
+    with timed("query:protocol_history"):
+        if RISK_PROTOCOL_INDEX:
+            new_map = protocol_index.new_protocols_many(db, win_protos, window_start)
+        else:
+            seen: Dict[int, Set[Any]] = {}
+            past = event_store.source(db, None, window_start)
+            proto_col = past.c.protocol
+            for device_id, p in (
+                db.query(past.c.device_id, proto_col)
+                .filter(
+                    past.c.device_id.in_(win_protos.keys()),
+                    past.c.event_type == "net_flow",
+                    past.c.ts < window_start,
+                    proto_col.in_(set().union(*win_protos.values())),
+                )
+                .distinct()
+            ):
+                seen.setdefault(device_id, set()).add(p)
+            new_map = {d: ps - seen.get(d, set()) for d, ps in win_protos.items()}
+    for d, ps in new_map.items():
+        out[d].new_protocols = ps
+
+
+def check_window_state(
+    db: Session, device_ids: Optional[List[int]] = None, window_minutes: int = 5
+) -> Dict[str, Any]:
+    """
+    一致性检查：对比内存滑窗与 SQL 聚合得到的窗口统计，返回不一致的设备明细。
+    （cmds / 协议按集合比较；窗口首尾按事件时间精确筛选，正常运行时应无差异）
+    """
+    ids = device_ids or [d for (d,) in db.query(Device.id).order_by(Device.id).all()]
+    window_end = datetime.now(UTC)
+    window_start = window_end - timedelta(minutes=window_minutes)
+
+    sql_stats = {d: WindowStats() for d in ids}
+    sql_protos = _fill_window_sql(db, sql_stats, window_start, window_end)
+    mem_stats = {d: WindowStats() for d in ids}
+    mem_protos = _fill_window_memory(mem_stats, window_start, window_end)
+
+    def _key(stats: WindowStats, protos: Set[Any]) -> Dict[str, Any]:
+        return {
+            "event_count": stats.event_count,
+            "auth_fail": stats.auth_fail,
+            "auth_success": stats.auth_ok,
+            "policy_violation": stats.policy_viol,
+            "flow_peak": stats.flow_peak,
+            "protocols": sorted(map(str, protos)),
+            "cmds": sorted(map(str, stats.cmds)),
+        }
+
+    mismatches = []
+    for d in ids:
+        a = _key(sql_stats[d], sql_protos.get(d, set()))
+        b = _key(mem_stats[d], mem_protos.get(d, set()))
+        if a != b:
+            mismatches.append({"device_id": d, "sql": a, "memory": b})
+    return {
+        "ready": risk_window.is_ready(),
+        "window_minutes": window_minutes,
+        "checked": len(ids),
+        "mismatches": mismatches,
+    }
+
+
+# ================== 评分核心 (保留你原来的逻辑, 仅内联改造) ==================
+def _ml_anomaly(stats: WindowStats, W, T, device_id: int) -> Optional[Dict[str, Any]]:
+    ml_res = run_ml_anomaly({"device_id": device_id, "event_count": stats.event_count})
+    if not ml_res:
+        return None
+    return {
+        "metric": "ml_anomaly",
+        "model": ml_res.get("model"),
+        "raw_score": ml_res.get("score"),
+        "weight": 15 * ml_res.get("score", 0),
+    }
+
+
+# ML (可选占位)：无配置权重，始终启用；排在内置指标之后
+risk_metrics.register(Metric("ml_anomaly", [], _ml_anomaly))
+
+
+def _score_from_stats(
+    stats: WindowStats,
+    cfg: Mapping[str, Any],
+    device_id: int,
+    plan: Optional[risk_metrics.Plan] = None,
+) -> Tuple[float, List[Dict[str, Any]]]:
+    """
+    按配置将窗口统计折算为 (score, reasons)，指标定义见 risk_metrics。
+    """
+    return risk_metrics.score(stats, cfg, device_id, plan)
+
+
+def _level_for(score: float, level_cfg: Mapping[str, Any]) -> str:
+    if score >= level_cfg["high"]:
+        return "high"
+    if score >= level_cfg["medium"]:
+        return "medium"
+    return "low"
+
+
+def compute_risk_for_device(
+    db: Session,
+    device_id: int,
+    window_minutes: int = 5,
+    aggregate: Optional[bool] = None,
+    commit: bool = True,
+    cfg: Optional[Mapping[str, Any]] = None,
+) -> RiskScore:
+    """
+    按指定窗口计算风险，写入 RiskScore，并执行自动隔离/恢复判定。
+
+    aggregate:
+      - True  -> 聚合路径（GROUP BY 计数，不加载事件行）
+      - False -> 行加载路径（原实现，作为回退）
+      - None  -> 取环境变量 RISK_ENGINE_AGGREGATE（默认开启）
+
+    commit:
+      - True  -> 本函数提交；RISK_SINGLE_TRANSACTION 开启时评分/日志/自动动作只 commit 一次，
+                 关闭时按原实现逐步 commit
+      - False -> 调用方管理事务：只 flush 取得评分 id，不 commit，也不在出错时回滚
+
+    cfg: 指定配置快照（调度器每轮固定一个版本）；None 时取当前发布的快照
+    """
+    if cfg is None:
+        cfg = risk_config.snapshot()
+    level_cfg = cfg["score_levels"]
+
+    window_end = datetime.now(UTC)
+    window_start = window_end - timedelta(minutes=window_minutes)
+
+    if aggregate is None:
+        aggregate = RISK_ENGINE_AGGREGATE
+    plan = risk_metrics.plan(cfg)
+    # 先取事件水位再统计：统计期间写入的事件 id 必然大于水位，下一轮会被视为变更
+    watermark = risk_state.event_watermarks(db, [device_id]).get(device_id, 0)
+    if aggregate:
+        stats = _collect_stats_aggregate(db, device_id, window_start, window_end, plan.needs)
+    else:
+        stats = _collect_stats_rows(db, device_id, window_start, window_end)
+    score, reasons = _score_from_stats(stats, cfg, device_id, plan)
 
     # 归一 & level 判定
     score = min(score, 100.0)
-    level = "low"
-    if score >= level_cfg["high"]:
-        level = "high"
-    elif score >= level_cfg["medium"]:
-        level = "medium"
+    level = _level_for(score, level_cfg)
 
     # 写 RiskScore
     rs = RiskScore(
@@ -366,36 +658,307 @@ def compute_risk_for_device(db: Session, device_id: int, window_minutes: int = 5
             message=f"Risk evaluated: score={score} level={level}",
         )
     )
-    db.commit()
-    db.refresh(rs)
+    risk_state.save(db, {device_id: (watermark, stats.event_count)}, window_end)
+    # 逐步提交（原实现）：评分、隔离、恢复各自 commit
+    step_commit = commit and not RISK_SINGLE_TRANSACTION
+    if step_commit:
+        db.commit()
+        db.refresh(rs)
+    else:
+        # 只 flush 取得 rs.id 供 RiskAction.score_id 使用
+        db.flush()
 
     # 自动隔离 / 恢复
     try:
-        maybe_auto_isolate(db, rs, cfg)
+        maybe_auto_isolate(db, rs, cfg, commit=step_commit)
     except Exception as e:
         db.add(
             DeviceLog(
                 device_id=device_id, log_type="risk_eval", message=f"Auto isolation error: {e}"
             )
         )
-        db.commit()
+        if step_commit:
+            db.commit()
 
     try:
-        maybe_auto_restore(db, cfg, rs)
+        maybe_auto_restore(db, cfg, rs, commit=step_commit)
     except Exception as e:
         db.add(
             DeviceLog(device_id=device_id, log_type="risk_eval", message=f"Auto restore error: {e}")
         )
-        db.commit()
+        if step_commit:
+            db.commit()
 
+    if commit and not step_commit:
+        db.commit()
     return rs
 
 
 # ================== 对外统一入口 ==================
-def evaluate_device_risk(db: Session, device_id: int, window_minutes: int = 5) -> RiskScore:
+def evaluate_device_risk(
+    db: Session,
+    device_id: int,
+    window_minutes: int = 5,
+    aggregate: Optional[bool] = None,
+    commit: bool = True,
+    cfg: Optional[Mapping[str, Any]] = None,
+) -> RiskScore:
     """
     统一对外调用入口：
-    - 调用 compute_risk_for_device
+    - 调用 compute_risk_for_device（commit=False 时由调用方管理事务）
     - 若后续需要加缓存 / APM / 指标，可在这里封装
     """
-    return compute_risk_for_device(db, device_id, window_minutes=window_minutes)
+    return compute_risk_for_device(
+        db, device_id, window_minutes=window_minutes, aggregate=aggregate, commit=commit, cfg=cfg
+    )
+
+
+# ================== 批量评估 ==================
+def _isolation_state_many(db: Session, device_ids: List[int]) -> Dict[int, Optional[datetime]]:
+    """
+    批量读取隔离状态：返回 {device_id: 最近 isolate 时间}，仅包含当前处于隔离的设备。
+    （最新 isolate/restore 动作为 isolate 即视为隔离，与 _is_device_isolated 一致）
+    """
+    latest = (
+        db.query(RiskAction.device_id, func.max(RiskAction.id).label("max_id"))
+        .filter(
+            RiskAction.device_id.in_(device_ids),
+            RiskAction.action_type.in_(["isolate", "restore"]),
+        )
+        .group_by(RiskAction.device_id)
+        .subquery()
+    )
+    rows = (
+        db.query(RiskAction.device_id, RiskAction.action_type, RiskAction.created_at)
+        .join(latest, RiskAction.id == latest.c.max_id)
+        .all()
+    )
+    return {d: _to_utc_aware(ts) for d, action_type, ts in rows if action_type == "isolate"}
+
+
+def restore_due(
+    db: Session, device_ids: List[int], cfg: Optional[Mapping[str, Any]] = None
+) -> Set[int]:
+    """
+    返回需要做自动恢复判定的设备：已隔离且冷却期已过（restore.enabled 关闭时为空）。
+    变更驱动调度时即使设备无新事件也要评估它们，以累积恢复所需的连续非 high 评分。
+    """
+    if cfg is None:
+        cfg = risk_config.snapshot()
+    auto_cfg = cfg.get("auto_response", {})
+    restore_cfg = auto_cfg.get("restore", {}) if isinstance(auto_cfg, Mapping) else {}
+    if not restore_cfg.get("enabled") or not device_ids:
+        return set()
+    cooldown = timedelta(seconds=restore_cfg.get("cooldown_seconds", 60))
+    now = datetime.now(UTC)
+    return {
+        d
+        for d, last_iso in _isolation_state_many(db, device_ids).items()
+        if last_iso is not None and now - last_iso >= cooldown
+    }
+
+
+def _recent_levels_many(db: Session, device_ids: List[int], limit: int) -> Dict[int, List[str]]:
+    """
+    批量读取每台设备最近 limit 条评分等级（按 id 倒序）。
+    """
+    if not device_ids or limit <= 0:
+        return {}
+    rn = (
+        func.row_number()
+        .over(partition_by=RiskScore.device_id, order_by=RiskScore.id.desc())
+        .label("rn")
+    )
+    sub = (
+        db.query(RiskScore.device_id, RiskScore.level, rn)
+        .filter(RiskScore.device_id.in_(device_ids))
+        .subquery()
+    )
+    out: Dict[int, List[str]] = {}
+    for d, level in (
+        db.query(sub.c.device_id, sub.c.level)
+        .filter(sub.c.rn <= limit)
+        .order_by(sub.c.device_id, sub.c.rn)
+    ):
+        out.setdefault(d, []).append(level)
+    return out
+
+
+def evaluate_devices_batch(
+    db: Session,
+    device_ids: List[int],
+    window_minutes: int = 5,
+    commit: bool = True,
+    cfg: Optional[Mapping[str, Any]] = None,
+    write_lock: Optional[ContextManager[Any]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    批量评估一组设备（调度器按块调用，调用方负责分块）：
+      - 窗口统计 / 24h 基线 / 协议 / 命令 / 隔离状态 / 恢复所需历史评分均为整批集合查询
+      - 内存中评分并判定自动隔离 / 恢复（语义同 maybe_auto_isolate / maybe_auto_restore）
+      - RiskScore / DeviceLog / RiskAction 全部在一个事务内写入，仅一次 flush + 一次 commit
+        （commit=False 时不提交，由调用方管理事务）
+      - 传入 write_lock 时（并行调度 + SQLite），读取与评分在锁外完成，仅写入阶段持锁；
+        加锁前会提交（结束）读事务，因此必须与 commit=True 一起使用
+    返回每台设备的结果摘要 {device_id, score_id, score, level, actions}。
+    """
+    ids = list(dict.fromkeys(device_ids))
+    if not ids:
+        return []
+    if write_lock is not None and not commit:
+        raise ValueError("write_lock requires commit=True")
+
+    if cfg is None:
+        cfg = risk_config.snapshot()
+    level_cfg = cfg["score_levels"]
+    auto_cfg = cfg.get("auto_response", {})
+    iso_cfg = auto_cfg.get("isolate", {}) if isinstance(auto_cfg, Mapping) else {}
+    restore_cfg = auto_cfg.get("restore", {}) if isinstance(auto_cfg, Mapping) else {}
+
+    window_end = datetime.now(UTC)
+    window_start = window_end - timedelta(minutes=window_minutes)
+
+    watermarks = risk_state.event_watermarks(db, ids)
+    plan = risk_metrics.plan(cfg)
+    stats_map = _collect_stats_many(db, ids, window_start, window_end, plan.needs)
+    isolated = _isolation_state_many(db, ids)
+
+    scored: List[Tuple[int, float, str, Any]] = []
+    for device_id in ids:
+        score, reasons = _score_from_stats(stats_map[device_id], cfg, device_id, plan)
+        score = min(score, 100.0)
+        scored.append((device_id, score, _level_for(score, level_cfg), reasons))
+    marks = {d: (watermarks.get(d, 0), stats_map[d].event_count) for d in ids}
+
+    if write_lock is None:
+        return _write_batch(
+            db, scored, marks, isolated, window_start, window_end, iso_cfg, restore_cfg, commit
+        )
+    # 先结束读事务再加锁：SQLite WAL 下读快照之后若有其它写入提交，该事务无法再升级为写事务
+    db.commit()
+    with write_lock:
+        return _write_batch(
+            db, scored, marks, isolated, window_start, window_end, iso_cfg, restore_cfg, commit
+        )
+
+
+def _write_batch(
+    db: Session,
+    scored: List[Tuple[int, float, str, Any]],
+    marks: Dict[int, Tuple[int, int]],
+    isolated: Dict[int, Optional[datetime]],
+    window_start: datetime,
+    window_end: datetime,
+    iso_cfg: Mapping[str, Any],
+    restore_cfg: Mapping[str, Any],
+    commit: bool,
+) -> List[Dict[str, Any]]:
+    """
+    evaluate_devices_batch 的写入阶段：评分 / 日志 / 水位 / 自动隔离与恢复，一次 flush + 一次 commit。
+    scored 为 [(device_id, score, level, reasons)]。
+    """
+    results: List[Dict[str, Any]] = []
+    score_rows: List[RiskScore] = []
+    for device_id, score, level, reasons in scored:
+        rs = RiskScore(
+            device_id=device_id,
+            window_start=window_start,
+            window_end=window_end,
+            score=score,
+            level=level,
+            reasons=reasons,
+        )
+        db.add(rs)
+        db.add(
+            DeviceLog(
+                device_id=device_id,
+                log_type="risk_eval",
+                message=f"Risk evaluated: score={score} level={level}",
+            )
+        )
+        score_rows.append(rs)
+        results.append({"device_id": device_id, "score": score, "level": level, "actions": []})
+
+    risk_state.save(db, marks, window_end)
+    # 一次 flush 拿到全部 score id
+    db.flush()
+
+    # 自动隔离（当前等级 high 且尚未隔离）
+    if iso_cfg.get("high"):
+        for rs, res in zip(score_rows, results):
+            if rs.level != "high" or rs.device_id in isolated:
+                continue
+            db.add(
+                RiskAction(
+                    device_id=rs.device_id,
+                    score_id=rs.id,
+                    action_type="isolate",
+                    executed=True,
+                    detail={
+                        "mode": "auto",
+                        "score": rs.score,
+                        "level": rs.level,
+                        "reasons": rs.reasons,
+                        "at": datetime.now(UTC).isoformat(),
+                    },
+                )
+            )
+            db.add(
+                DeviceLog(
+                    device_id=rs.device_id,
+                    log_type="risk_alert",
+                    message=f"Auto isolation applied score={rs.score} level={rs.level}",
+                )
+            )
+            isolated[rs.device_id] = window_end
+            res["actions"].append("isolate")
+
+    # 自动恢复（已隔离 + 冷却期已过 + 最近连续评分均在 allow_levels）
+    if restore_cfg.get("enabled") and isolated:
+        allow_levels = set(restore_cfg.get("allow_levels", ["low", "medium"]))
+        min_consecutive = restore_cfg.get("min_consecutive_non_high", 2)
+        lookback = restore_cfg.get("lookback_scores", 5)
+        cooldown = timedelta(seconds=restore_cfg.get("cooldown_seconds", 60))
+
+        due: List[RiskScore] = []
+        for rs in score_rows:
+            last_iso = isolated.get(rs.device_id)
+            if last_iso is not None and window_end - last_iso >= cooldown:
+                due.append(rs)
+        # 新评分已 flush，查询结果首条即为当前评分（与单设备路径 commit 后再查一致）
+        need = min(lookback, min_consecutive)
+        recent_levels = _recent_levels_many(db, [rs.device_id for rs in due], need)
+        by_device = {res["device_id"]: res for res in results}
+        for rs in due:
+            levels = recent_levels.get(rs.device_id, [])
+            if len(levels) < min_consecutive:
+                continue
+            if not all(lv in allow_levels for lv in levels[:min_consecutive]):
+                continue
+            db.add(
+                RiskAction(
+                    device_id=rs.device_id,
+                    score_id=rs.id,
+                    action_type="restore",
+                    executed=True,
+                    detail={
+                        "mode": "auto",
+                        "reason": f"{min_consecutive} consecutive non-high scores",
+                        "at": datetime.now(UTC).isoformat(),
+                    },
+                )
+            )
+            db.add(
+                DeviceLog(
+                    device_id=rs.device_id,
+                    log_type="risk_restore",
+                    message=f"Auto restore triggered after {min_consecutive} non-high scores",
+                )
+            )
+            by_device[rs.device_id]["actions"].append("restore")
+
+    for rs, res in zip(score_rows, results):
+        res["score_id"] = rs.id
+    if commit:
+        db.commit()
+    return results
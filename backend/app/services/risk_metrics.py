@@ -0,0 +1,352 @@
+"""
+风险指标注册表 + 查询规划
+
+每个指标声明：
+  - needs：依赖的数据（窗口计数 / 流量历史 / 协议集合 / 命令列表）
+  - active(weights)：按当前配置是否可能产生非零权重
+  - evaluate(stats, weights, thresholds, device_id)：命中返回 reason（含 weight），否则 None
+
+plan(cfg) 将当前配置编译为“启用的指标 + 需要的数据集合”，采集阶段只执行被需要的查询：
+权重为 0 的指标不参与评分，其专属数据（如协议历史、命令列表）也不会被查询。
+
+计时：
+  - query:<数据名>   采集阶段各查询耗时（多个指标共享）
+  - metric:<指标名>  各指标评分耗时
+通过 timing_snapshot() / GET /risk/scheduler/metrics 查看。
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+)
+
+# 数据需求
+WINDOW_COUNTS = "window_counts"
+FLOW_PEAK = "flow_peak"
+FLOW_HISTORY = "flow_history"
+PROTOCOLS = "protocols"
+COMMANDS = "commands"
+ALL_NEEDS: FrozenSet[str] = frozenset({WINDOW_COUNTS, FLOW_PEAK, FLOW_HISTORY, PROTOCOLS, COMMANDS})
+
+# 指标 / 查询计时；设 RISK_METRIC_TIMING=0 关闭
+TIMING_ENABLED = os.getenv("RISK_METRIC_TIMING", "1") != "0"
+
+# 常规命令集（命令异常指标的 baseline）
+BASELINE_CMDS = {"ls", "status"}
+
+
+# ================== 窗口统计结构 ==================
+class WindowStats:
+    """
+    评分所需的窗口统计结果。
+    行加载路径与聚合路径都产出该结构，评分逻辑只依赖它，保证两条路径语义一致。
+    """
+
+    __slots__ = (
+        "event_count",
+        "auth_fail",
+        "auth_ok",
+        "policy_viol",
+        "flow_peak",
+        "hist_mean",
+        "new_protocols",
+        "cmds",
+    )
+
+    def __init__(self) -> None:
+        self.event_count: int = 0
+        self.auth_fail: int = 0
+        self.auth_ok: int = 0
+        self.policy_viol: int = 0
+        # 窗口内 net_flow bytes_out(>0) 峰值；无有效流量为 None
+        self.flow_peak: Any = None
+        # 前 24h（窗口开始之前）net_flow bytes_out(>0) 均值；无历史为 0
+        self.hist_mean: float = 0
+        # 窗口内出现、但窗口开始前从未出现过的协议
+        self.new_protocols: Set[Any] = set()
+        # 窗口内 command 事件的 cmd（非空，按写入顺序）
+        self.cmds: List[Any] = []
+
+
+# ================== 注册表 ==================
+Evaluator = Callable[
+    [WindowStats, Mapping[str, Any], Mapping[str, Any], int], Optional[Dict[str, Any]]
+]
+
+
+class Metric:
+    def __init__(
+        self,
+        name: str,
+        needs: Iterable[str],
+        evaluate: Evaluator,
+        active: Optional[Callable[[Mapping[str, Any]], bool]] = None,
+    ) -> None:
+        self.name = name
+        self.needs: FrozenSet[str] = frozenset(needs) | {WINDOW_COUNTS}
+        self.evaluate = evaluate
+        self._active = active
+
+    def is_active(self, weights: Mapping[str, Any]) -> bool:
+        return self._active is None or bool(self._active(weights))
+
+
+# 按注册顺序评分，reasons 顺序与注册顺序一致
+REGISTRY: List[Metric] = []
+
+
+def register(metric: Metric) -> Metric:
+    """
+    注册（或按名称替换）指标。
+    """
+    for i, m in enumerate(REGISTRY):
+        if m.name == metric.name:
+            REGISTRY[i] = metric
+            return metric
+    REGISTRY.append(metric)
+    return metric
+
+
+class Plan:
+    """
+    配置编译结果：启用的指标（保持注册顺序）与需要采集的数据。
+    """
+
+    __slots__ = ("metrics", "needs", "skipped")
+
+    def __init__(self, metrics: List[Metric], skipped: List[str]) -> None:
+        self.metrics = metrics
+        self.skipped = skipped
+        needs: Set[str] = {WINDOW_COUNTS}
+        for m in metrics:
+            needs |= m.needs
+        self.needs: FrozenSet[str] = frozenset(needs)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "metrics": [m.name for m in self.metrics],
+            "skipped": self.skipped,
+            "needs": sorted(self.needs),
+        }
+
+
+def plan(cfg: Mapping[str, Any]) -> Plan:
+    """
+    按当前权重编译评分计划；权重为 0 的指标跳过（不评分，也不采集其专属数据）。
+    """
+    W = cfg["weights"]
+    metrics: List[Metric] = []
+    skipped: List[str] = []
+    for m in REGISTRY:
+        if m.is_active(W):
+            metrics.append(m)
+        else:
+            skipped.append(m.name)
+    return Plan(metrics, skipped)
+
+
+def score(
+    stats: WindowStats, cfg: Mapping[str, Any], device_id: int, p: Optional[Plan] = None
+) -> Tuple[float, List[Dict[str, Any]]]:
+    """
+    按计划中的指标将窗口统计折算为 (score, reasons)。
+    """
+    reasons: List[Dict[str, Any]] = []
+    total = 0.0
+    if not stats.event_count:
+        return total, reasons
+    p = p or plan(cfg)
+    W = cfg["weights"]
+    T = cfg["thresholds"]
+    for m in p.metrics:
+        with timed("metric:" + m.name):
+            reason = m.evaluate(stats, W, T, device_id)
+        if reason is not None:
+            total += reason["weight"]
+            reasons.append(reason)
+    return total, reasons
+
+
+# ================== 计时 ==================
+_timing_lock = threading.Lock()
+# name -> [calls, total_seconds, max_seconds]
+_timings: Dict[str, List[float]] = {}
+
+
+def record_timing(name: str, seconds: float) -> None:
+    with _timing_lock:
+        t = _timings.get(name)
+        if t is None:
+            _timings[name] = [1, seconds, seconds]
+        else:
+            t[0] += 1
+            t[1] += seconds
+            if seconds > t[2]:
+                t[2] = seconds
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    if not TIMING_ENABLED:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(name, time.perf_counter() - t0)
+
+
+def timing_snapshot() -> Dict[str, Dict[str, float]]:
+    """
+    返回 {名称: {calls, total_ms, avg_ms, max_ms}}，按累计耗时降序。
+    """
+    with _timing_lock:
+        items = sorted(_timings.items(), key=lambda kv: kv[1][1], reverse=True)
+        return {
+            name: {
+                "calls": int(calls),
+                "total_ms": round(total * 1000, 3),
+                "avg_ms": round(total * 1000 / calls, 3) if calls else 0,
+                "max_ms": round(mx * 1000, 3),
+            }
+            for name, (calls, total, mx) in items
+        }
+
+
+def reset_timings() -> None:
+    with _timing_lock:
+        _timings.clear()
+
+
+# ================== 内置指标 ==================
+def _auth_fail_rate(stats: WindowStats, W, T, device_id: int) -> Optional[Dict[str, Any]]:
+    auth_fail = stats.auth_fail
+    total_auth = auth_fail + stats.auth_ok
+    if total_auth < T["auth_fail_min_total"] or auth_fail < T["auth_fail_min_fail"]:
+        return None
+    fail_rate = auth_fail / total_auth if total_auth > 0 else 0
+    if fail_rate < T["auth_fail_rate_min"]:
+        return None
+    return {
+        "metric": "auth_fail_rate",
+        "auth_fail": auth_fail,
+        "total_auth": total_auth,
+        "fail_rate": round(fail_rate, 3),
+        "weight": W["auth_fail_rate"],
+    }
+
+
+def _policy_violation(stats: WindowStats, W, T, device_id: int) -> Optional[Dict[str, Any]]:
+    # 叠加步进，capped
+    if stats.policy_viol <= 0:
+        return None
+    w = min(W["policy_violation_base"] + stats.policy_viol * W["policy_violation_step"], 30)
+    return {"metric": "policy_violation", "count": stats.policy_viol, "weight": w}
+
+
+def _flow_spike(stats: WindowStats, W, T, device_id: int) -> Optional[Dict[str, Any]]:
+    # 对比最近 24h 历史；无历史时按首次大流量判定
+    if stats.flow_peak is None:
+        return None
+    cur_peak = stats.flow_peak
+    hist_mean = stats.hist_mean
+    if (
+        hist_mean > 0
+        and cur_peak / hist_mean > T["flow_spike_ratio"]
+        and cur_peak > T["flow_spike_min_bytes"]
+    ):
+        return {
+            "metric": "flow_spike",
+            "peak": cur_peak,
+            "hist_mean": hist_mean,
+            "weight": W["flow_spike"],
+        }
+    if hist_mean == 0 and cur_peak > T["flow_spike_first_min_bytes"]:
+        return {"metric": "flow_spike_first", "peak": cur_peak, "weight": W["flow_spike_first"]}
+    return None
+
+
+def _new_protocol(stats: WindowStats, W, T, device_id: int) -> Optional[Dict[str, Any]]:
+    if not stats.new_protocols:
+        return None
+    return {
+        "metric": "new_protocol",
+        "protocols": list(stats.new_protocols),
+        "weight": W["new_protocol"],
+    }
+
+
+def _command_anomaly(stats: WindowStats, W, T, device_id: int) -> Optional[Dict[str, Any]]:
+    anomal_cmds = [c for c in stats.cmds if c not in BASELINE_CMDS]
+    if not anomal_cmds:
+        return None
+    w = min(
+        W["command_anomaly_base"] + len(anomal_cmds) * W["command_anomaly_step"],
+        W["command_anomaly_max"],
+    )
+    return {
+        "metric": "command_anomaly",
+        "count": len(anomal_cmds),
+        "cmds": anomal_cmds,
+        "weight": w,
+    }
+
+
+register(
+    Metric(
+        "auth_fail_rate",
+        [WINDOW_COUNTS],
+        _auth_fail_rate,
+        active=lambda W: W.get("auth_fail_rate", 0) != 0,
+    )
+)
+register(
+    Metric(
+        "policy_violation",
+        [WINDOW_COUNTS],
+        _policy_violation,
+        active=lambda W: (W.get("policy_violation_base", 0), W.get("policy_violation_step", 0))
+        != (0, 0),
+    )
+)
+register(
+    Metric(
+        "flow_spike",
+        [FLOW_PEAK, FLOW_HISTORY],
+        _flow_spike,
+        active=lambda W: W.get("flow_spike", 0) != 0 or W.get("flow_spike_first", 0) != 0,
+    )
+)
+register(
+    Metric(
+        "new_protocol",
+        [PROTOCOLS],
+        _new_protocol,
+        active=lambda W: W.get("new_protocol", 0) != 0,
+    )
+)
+register(
+    Metric(
+        "command_anomaly",
+        [COMMANDS],
+        _command_anomaly,
+        active=lambda W: W.get("command_anomaly_max", 0) != 0
+        and (W.get("command_anomaly_base", 0), W.get("command_anomaly_step", 0)) != (0, 0),
+    )
+)
@@ -1,7 +1,9 @@
+import asyncio
+import os
 import threading
 import time
 import traceback
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Mapping, Optional
 
 from sqlalchemy.orm import Session
 
@@ -10,7 +12,29 @@ from ..models import Device
 
 # 使用我们在 risk_engine.py 中新增的统一入口（若你没有添加 evaluate_device_risk 包装，
 # 可以改为: from .risk_engine import compute_risk_for_device as evaluate_device_risk）
-from .risk_engine import evaluate_device_risk
+from . import (
+    risk_state,
+    scheduler_async,
+    scheduler_lease,
+    scheduler_pool,
+    scheduler_priority,
+    scheduler_shards,
+)
+from .risk_config import risk_config
+from .risk_engine import evaluate_device_risk, evaluate_devices_batch, restore_due
+
+# 每个批量评估块的设备数（一块一个事务）；设为 0 回退到逐设备评估
+DEFAULT_BATCH_SIZE = int(os.getenv("RISK_SCHEDULER_BATCH_SIZE", "500"))
+# 只评估有新事件 / 窗口未清空 / 待恢复判定的设备；设 RISK_SCHEDULER_CHANGED_ONLY=0 每轮全量评估
+DEFAULT_CHANGED_ONLY = os.getenv("RISK_SCHEDULER_CHANGED_ONLY", "1") != "0"
+# 变更筛选每次查询的设备数
+_DUE_CHUNK = 500
+# 并行评估的工作线程数（1 为单线程原实现，见 scheduler_pool）与每个任务块的设备数；
+# RISK_SCHEDULER_PROCESSES > 1 时改为多进程分片（见 scheduler_shards），优先于线程池
+DEFAULT_WORKERS = max(1, int(os.getenv("RISK_SCHEDULER_WORKERS", "1")))
+DEFAULT_CHUNK = max(1, int(os.getenv("RISK_SCHEDULER_CHUNK", "200")))
+# RISK_SCHEDULER_PRIORITY=1：按设备到期时间的最小堆自适应调度（见 scheduler_priority），取代按轮扫描
+# 多副本部署时 RISK_SCHEDULER_LEASES=1：各节点只评估自己持有租约的分片（见 scheduler_lease）
 
 
 class SchedulerState:
@@ -20,8 +44,24 @@ class SchedulerState:
 
     def __init__(self):
         self.thread: Optional[threading.Thread] = None
+        # 应用 lifespan 内挂载的 asyncio 调度循环；未挂载时（脚本 / 测试）回退到后台线程
+        self.async_scheduler: Optional[scheduler_async.AsyncScheduler] = None
         self.stop_event = threading.Event()
         self.interval_seconds: int = 60
+        self.batch_size: int = DEFAULT_BATCH_SIZE
+        self.changed_only: bool = DEFAULT_CHANGED_ONLY
+        self.workers: int = DEFAULT_WORKERS
+        self.processes: int = scheduler_shards.DEFAULT_PROCESSES
+        self.chunk_size: int = DEFAULT_CHUNK
+        self.last_workers: List[Dict[str, Any]] = []
+        self.last_shards: List[Dict[str, Any]] = []
+        self.priority: bool = scheduler_priority.ENABLED
+        self.prio = scheduler_priority.PriorityScheduler()
+        self.leases: bool = scheduler_lease.ENABLED
+        self.lease: Optional[scheduler_lease.LeaseCoordinator] = None
+        self.last_evaluated: Optional[int] = None
+        self.last_skipped: Optional[int] = None
+        self.last_config_version: Optional[int] = None
         self.running: bool = False
         self.last_run_start: Optional[float] = None
         self.last_run_end: Optional[float] = None
@@ -33,14 +73,39 @@ class SchedulerState:
 scheduler_state = SchedulerState()
 
 
-def start_scheduler(interval_seconds: int = 60) -> bool:
+def start_scheduler(
+    interval_seconds: int = 60,
+    workers: Optional[int] = None,
+    processes: Optional[int] = None,
+    priority: Optional[bool] = None,
+) -> bool:
     """
-    启动调度器线程。若已在运行返回 False。
+    启动调度器（workers / processes 为并行线程数 / 分片进程数，priority 为是否自适应优先级调度，
+    不传保持当前设置）。已挂载 asyncio 调度循环时在事件循环中启动，否则启动后台线程。
+    若已在运行返回 False。不可在事件循环线程中直接调用（lifespan 内用 asyncio.to_thread）。
     """
     st = scheduler_state
     if st.running:
         return False
+    if workers is not None:
+        if workers < 1:
+            raise ValueError("workers 至少为 1")
+        st.workers = workers
+    if processes is not None:
+        if processes < 0:
+            raise ValueError("processes 不能为负数")
+        st.processes = processes
+    if priority is not None:
+        st.priority = priority
     st.interval_seconds = interval_seconds
+    if st.leases:
+        # 先同步一次租约，首轮即只评估本节点的分片
+        if st.lease is None:
+            st.lease = scheduler_lease.LeaseCoordinator(SessionLocal)
+        st.lease.start()
+    if st.async_scheduler is not None:
+        st.running = st.async_scheduler.start_threadsafe()
+        return st.running
     st.stop_event.clear()
     t = threading.Thread(target=_runner, name="RiskSchedulerThread", daemon=True)
     st.thread = t
@@ -51,15 +116,22 @@ def start_scheduler(interval_seconds: int = 60) -> bool:
 
 def stop_scheduler() -> bool:
     """
-    停止调度器线程。若未运行返回 False。
+    停止调度器并等待正在执行的一轮评估结束。若未运行返回 False。
     """
     st = scheduler_state
     if not st.running:
         return False
+    if st.async_scheduler is not None:
+        st.async_scheduler.stop_threadsafe()
     st.stop_event.set()
     if st.thread and st.thread.is_alive():
-        st.thread.join(timeout=5)
+        st.thread.join(timeout=scheduler_async.STOP_TIMEOUT)
     st.running = False
+    # 释放分片子进程（下次启动时重建）
+    scheduler_shards.shutdown_pool()
+    # 主动释放租约，其它节点无需等待 TTL 即可接管
+    if st.lease is not None:
+        st.lease.stop(release=True)
     return True
 
 
@@ -72,6 +144,56 @@ def update_interval(interval_seconds: int) -> None:
     scheduler_state.interval_seconds = interval_seconds
 
 
+def update_priority(min_seconds: float, max_seconds: float) -> None:
+    """
+    调整自适应优先级调度的最短 / 最长评估间隔（秒）。
+    """
+    scheduler_state.prio.cadence.update(min_seconds, max_seconds)
+
+
+def attach_async(loop: asyncio.AbstractEventLoop) -> scheduler_async.AsyncScheduler:
+    """
+    挂载 asyncio 调度循环（应用 lifespan 启动时调用），之后的启停都在该事件循环中进行。
+    """
+    st = scheduler_state
+    st.async_scheduler = scheduler_async.AsyncScheduler(loop, run_once, tick_period)
+    return st.async_scheduler
+
+
+def detach_async() -> None:
+    scheduler_state.async_scheduler = None
+
+
+def tick_period() -> float:
+    """
+    两次调度之间的周期（秒）：优先级模式为 tick 间隔，否则为 interval_seconds。
+    """
+    st = scheduler_state
+    return scheduler_priority.TICK_SECONDS if st.priority else st.interval_seconds
+
+
+def run_once() -> None:
+    """
+    执行一轮调度并记录状态（线程主循环与 asyncio 调度循环共用）。
+    """
+    st = scheduler_state
+    start_ts = time.time()
+    st.last_run_start = start_ts
+    try:
+        if st.priority:
+            _evaluate_priority_tick()
+        else:
+            _evaluate_all_devices()
+        st.last_run_error = None
+    except Exception as e:
+        st.last_run_error = f"{e.__class__.__name__}: {e}"
+        traceback.print_exc()
+    end_ts = time.time()
+    st.last_run_end = end_ts
+    st.last_run_duration = round(end_ts - start_ts, 4)
+    st.total_runs += 1
+
+
 def get_status() -> Dict[str, Any]:
     """
     返回当前调度器状态。
@@ -79,7 +201,22 @@ def get_status() -> Dict[str, Any]:
     st = scheduler_state
     return {
         "running": st.running,
+        "mode": "asyncio" if st.async_scheduler is not None else "thread",
+        "async": st.async_scheduler.status() if st.async_scheduler is not None else None,
         "interval_seconds": st.interval_seconds,
+        "batch_size": st.batch_size,
+        "changed_only": st.changed_only,
+        "workers": st.workers,
+        "processes": st.processes,
+        "chunk_size": st.chunk_size,
+        "last_workers": st.last_workers,
+        "last_shards": st.last_shards,
+        "priority": st.priority,
+        "priority_queue": st.prio.status(),
+        "lease": st.lease.status() if st.lease is not None else {"enabled": False},
+        "last_evaluated": st.last_evaluated,
+        "last_skipped": st.last_skipped,
+        "last_config_version": st.last_config_version,
         "last_run_start": st.last_run_start,
         "last_run_end": st.last_run_end,
         "last_run_duration": st.last_run_duration,
@@ -90,28 +227,13 @@ def get_status() -> Dict[str, Any]:
 
 def _runner() -> None:
     """
-    后台线程主循环：按设定间隔调用 _evaluate_all_devices。
+    后台线程主循环（未挂载 asyncio 调度循环时使用）：按设定间隔调用 run_once。
     """
     st = scheduler_state
     while not st.stop_event.is_set():
-        start_ts = time.time()
-        st.last_run_start = start_ts
-        try:
-            _evaluate_all_devices()
-            st.last_run_error = None
-        except Exception as e:
-            st.last_run_error = f"{e.__class__.__name__}: {e}"
-            traceback.print_exc()
-        end_ts = time.time()
-        st.last_run_end = end_ts
-        st.last_run_duration = round(end_ts - start_ts, 4)
-        st.total_runs += 1
-
-        # 可中断的等待
-        for _ in range(st.interval_seconds):
-            if st.stop_event.is_set():
-                break
-            time.sleep(1)
+        run_once()
+        # 可中断的等待（优先级模式按 tick 间隔唤醒）
+        st.stop_event.wait(tick_period())
 
     st.running = False
 
@@ -120,33 +242,127 @@ def _evaluate_all_devices() -> None:
     """
     遍历所有设备并执行一次风险评估。
 
-    使用 evaluate_device_risk(db, 设备ID, window_minutes=5) 调用。
-    说明：
-    - evaluate_device_risk 内部（compute_risk_for_device）已经负责写 RiskScore / DeviceLog / 自动隔离/恢复 / commit。
-    - 如后续想改为批量提交，可以在 risk_engine 中去掉内部 commit，改成这里统一提交。
+    - batch_size > 0：按块调用 evaluate_devices_batch，每块集合查询 + 单事务提交；
+      某块失败时回滚，并对该块逐设备评估以隔离错误设备
+    - batch_size = 0：逐设备调用 evaluate_device_risk(db, 设备ID, window_minutes=5)（原实现）
+    - workers > 1：按 chunk_size 分块由多个工作线程并行评估（各自独立 Session，见 scheduler_pool）
+    - processes > 1：按 device_id 一致性哈希分片到常驻子进程评估（见 scheduler_shards），优先于 workers
+    - leases：只评估本节点持有租约的分片（device_id % 分片数），其余设备由其它节点负责
+    - changed_only：跳过无新事件且上次窗口为空的设备（其评分必然为 0 / low），
+      已隔离且冷却期已过的设备仍然评估，保证自动恢复按时触发
+    - 每轮开始时固定一个配置快照，本轮所有设备按同一配置版本评分
     """
     db: Session = SessionLocal()
     t0 = time.time()
+    batch_size = scheduler_state.batch_size
+    cfg = risk_config.snapshot()
+    scheduler_state.last_config_version = cfg.version
     try:
-        devices: List[Device] = db.query(Device).all()
-        print(f"[Scheduler] Start batch evaluate: devices={len(devices)}")
+        device_ids: List[int] = [d for (d,) in db.query(Device.id).order_by(Device.id).all()]
+        if scheduler_state.lease is not None:
+            device_ids = scheduler_state.lease.filter(device_ids)
+        total = len(device_ids)
+        if scheduler_state.changed_only:
+            device_ids = _select_due(db, device_ids, cfg)
+        scheduler_state.last_evaluated = len(device_ids)
+        scheduler_state.last_skipped = total - len(device_ids)
+        print(
+            f"[Scheduler] Start batch evaluate: devices={len(device_ids)} "
+            f"skipped={total - len(device_ids)} batch={batch_size} config_v={cfg.version}"
+        )
 
         errors = 0
-        for idx, d in enumerate(devices, 1):
-            try:
-                rs = evaluate_device_risk(db, d.id, window_minutes=5)
-                # rs 为 RiskScore ORM 实例
-                print(
-                    f"[Scheduler] ({idx}/{len(devices)}) "
-                    f"device_id={d.id} score={rs.score} level={rs.level}"
-                )
-            except Exception as e:
-                errors += 1
-                # compute_risk_for_device 内部 commit 失败时这里回滚确保事务干净
-                db.rollback()
-                print(f"[Scheduler] ERROR device_id={d.id}: {e}")
-
-        # 如果后面你改成自己批量处理并取消内部 commit，可在这里统一 db.commit()
+        if scheduler_state.processes > 1:
+            pool = scheduler_shards.get_pool(scheduler_state.processes)
+            errors, scheduler_state.last_shards = pool.run(
+                device_ids, cfg, scheduler_state.chunk_size
+            )
+        elif scheduler_state.workers > 1:
+            errors, scheduler_state.last_workers = scheduler_pool.evaluate_parallel(
+                device_ids,
+                cfg,
+                scheduler_state.workers,
+                scheduler_state.chunk_size,
+                SessionLocal,
+            )
+        elif batch_size > 0:
+            for i in range(0, len(device_ids), batch_size):
+                chunk = device_ids[i : i + batch_size]
+                try:
+                    results = evaluate_devices_batch(db, chunk, window_minutes=5, cfg=cfg)
+                    high = sum(1 for r in results if r["level"] == "high")
+                    actions = sum(len(r["actions"]) for r in results)
+                    print(
+                        f"[Scheduler] chunk {i // batch_size + 1} devices={len(chunk)} "
+                        f"high={high} actions={actions}"
+                    )
+                except Exception as e:
+                    db.rollback()
+                    print(f"[Scheduler] chunk ERROR ({e}), falling back to per-device")
+                    errors += _evaluate_each(db, chunk, cfg)
+        else:
+            errors = _evaluate_each(db, device_ids, cfg)
+
         print(f"[Scheduler] Batch done errors={errors} " f"duration={round(time.time() - t0, 3)}s")
     finally:
         db.close()
+
+
+def _evaluate_priority_tick() -> None:
+    """
+    自适应优先级调度的一次 tick：只评估已到期的设备（见 scheduler_priority）。
+    """
+    db: Session = SessionLocal()
+    cfg = risk_config.snapshot()
+    scheduler_state.last_config_version = cfg.version
+    try:
+        device_ids: List[int] = [d for (d,) in db.query(Device.id).order_by(Device.id).all()]
+        if scheduler_state.lease is not None:
+            device_ids = scheduler_state.lease.filter(device_ids)
+        stats = scheduler_state.prio.tick(db, device_ids, cfg, scheduler_state.interval_seconds)
+        scheduler_state.last_evaluated = stats["evaluated"]
+        scheduler_state.last_skipped = len(device_ids) - stats["evaluated"]
+        if stats["evaluated"]:
+            print(
+                f"[Scheduler] Priority tick: evaluated={stats['evaluated']} "
+                f"overdue={stats['overdue']} preempted={stats['preempted']} "
+                f"errors={stats['errors']} config_v={cfg.version}"
+            )
+    finally:
+        db.close()
+
+
+def _select_due(db: Session, device_ids: List[int], cfg: Mapping[str, Any]) -> List[int]:
+    """
+    变更驱动筛选：有新事件 / 上次窗口非空 / 从未评估 / 待自动恢复判定的设备。
+    """
+    due: List[int] = []
+    for i in range(0, len(device_ids), _DUE_CHUNK):
+        chunk = device_ids[i : i + _DUE_CHUNK]
+        keep = risk_state.due_devices(db, chunk) | restore_due(db, chunk, cfg)
+        due.extend(d for d in chunk if d in keep)
+    return due
+
+
+def _evaluate_each(db: Session, device_ids: List[int], cfg: Mapping[str, Any]) -> int:
+    """
+    逐设备评估，返回出错设备数。
+    """
+    errors = 0
+    for idx, device_id in enumerate(device_ids, 1):
+        try:
+            # 调度器管理事务：评分 + 日志 + 自动动作每台设备只提交一次
+            rs = evaluate_device_risk(db, device_id, window_minutes=5, commit=False, cfg=cfg)
+            # commit 后 ORM 实例会过期，提前取值避免再次 SELECT
+            score, level = rs.score, rs.level
+            db.commit()
+            print(
+                f"[Scheduler] ({idx}/{len(device_ids)}) "
+                f"device_id={device_id} score={score} level={level}"
+            )
+        except Exception as e:
+            errors += 1
+            # 评估或提交失败时回滚，该设备本轮写入全部丢弃，确保事务干净
+            db.rollback()
+            print(f"[Scheduler] ERROR device_id={device_id}: {e}")
+    return errors
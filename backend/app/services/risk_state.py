@@ -0,0 +1,240 @@
+"""
+设备评估水位 (变更驱动评估)
+
+device_risk_states 记录每台设备最近一次评估时的事件水位：
+  - last_event_id：评估开始前该设备的最大事件 id（先取水位再统计，之后写入的事件一定 > 水位）
+  - window_events：该次评估窗口内的事件数
+
+  - evaluated_at：该次评估的窗口结束时间
+
+下一轮调度时设备满足以下任一条件才需要重新评估：
+  - 从未评估过（无水位记录）
+  - 有 id > last_event_id 的新事件
+  - 有 ingested_at >= evaluated_at - RISK_STATE_LAG_SECONDS（默认 10）的事件：
+    id 在事务内分配、提交顺序不保证与 id 一致（PostgreSQL 序列 / 分区 id 分配器），
+    评估时尚未提交的较小 id 事件提交后仍低于水位，按写入时间兜底；滞后量同时容忍节点间时钟偏差
+  - 有 evaluated_at < ts <= 当前时间 的事件：上报时间晚于写入时间（未来时间戳 / 设备时钟超前）
+    的事件在写入时不在窗口内，其 ts 进入窗口后才影响评分
+  - 上次窗口内有事件（随时间过期，窗口内容会变化）
+否则窗口为空且无新事件，评分必然为 0 / low，与上次结果相同，可以跳过。
+需要自动恢复判定的隔离设备由调度器另行加入（见 risk_engine.restore_due）。
+"""
+
+from __future__ import annotations
+
+import os
+from datetime import UTC, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import func, null, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from ..models import Device, DeviceEvent, DeviceRiskState
+from . import event_store
+
+LAG_SECONDS = float(os.getenv("RISK_STATE_LAG_SECONDS", "10"))
+
+# (device_id, last_event_id, window_events, evaluated_at, 最大事件 id, 最大 ingested_at, 不晚于当前的最大 ts)
+StateRow = Tuple[
+    int,
+    Optional[int],
+    Optional[int],
+    Optional[datetime],
+    int,
+    Optional[datetime],
+    Optional[datetime],
+]
+
+
+def _to_utc_aware(dt: Optional[datetime]) -> Optional[datetime]:
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=UTC)
+    return dt.astimezone(UTC)
+
+
+def _max_event_id():
+    # 相关子查询：每台设备一次 device_id 索引定位，不扫描该设备全部事件
+    return (
+        select(func.max(DeviceEvent.id))
+        .where(DeviceEvent.device_id == Device.id)
+        .correlate(Device)
+        .scalar_subquery()
+    )
+
+
+def _max_ingested_at():
+    # 走 (device_id, ingested_at) 索引
+    return (
+        select(func.max(DeviceEvent.ingested_at))
+        .where(DeviceEvent.device_id == Device.id)
+        .correlate(Device)
+        .scalar_subquery()
+    )
+
+
+def _max_ts(now: datetime):
+    # 走 (device_id, ts) 索引
+    return (
+        select(func.max(DeviceEvent.ts))
+        .where(DeviceEvent.device_id == Device.id, DeviceEvent.ts <= now)
+        .correlate(Device)
+        .scalar_subquery()
+    )
+
+
+def event_watermarks(db: Session, device_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    返回 {device_id: 当前最大事件 id}，无事件的设备为 0。
+    """
+    ids = list(device_ids)
+    if not ids:
+        return {}
+    if event_store.ENABLED:
+        maxes = event_store.max_ids(db, ids)
+        return {d: maxes.get(d, 0) for d in ids}
+    rows = db.query(Device.id, _max_event_id()).filter(Device.id.in_(ids)).all()
+    return {d: (m or 0) for d, m in rows}
+
+
+def save(db: Session, marks: Dict[int, Tuple[int, int]], evaluated_at: datetime) -> None:
+    """
+    写入评估水位 {device_id: (last_event_id, window_events)}（不提交，随评分同一事务）。
+    """
+    if not marks:
+        return
+    values = [
+        {"device_id": d, "last_event_id": e, "window_events": n, "evaluated_at": evaluated_at}
+        for d, (e, n) in marks.items()
+    ]
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert_fn = sqlite_insert if dialect == "sqlite" else pg_insert
+        stmt: Any = insert_fn(DeviceRiskState).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["device_id"],
+            set_={
+                "last_event_id": stmt.excluded.last_event_id,
+                "window_events": stmt.excluded.window_events,
+                "evaluated_at": stmt.excluded.evaluated_at,
+            },
+        )
+        db.execute(stmt)
+    else:
+        existing = {
+            r.device_id: r
+            for r in db.query(DeviceRiskState).filter(DeviceRiskState.device_id.in_(list(marks)))
+        }
+        for d, (e, n) in marks.items():
+            row = existing.get(d)
+            if row is None:
+                db.add(
+                    DeviceRiskState(
+                        device_id=d, last_event_id=e, window_events=n, evaluated_at=evaluated_at
+                    )
+                )
+            else:
+                row.last_event_id = e
+                row.window_events = n
+                row.evaluated_at = evaluated_at
+
+
+def _state_rows(db: Session, ids: List[int]) -> List[StateRow]:
+    """
+    各设备的水位记录与当前事件状态（见 StateRow），无水位记录的设备前三项为 None。
+    """
+    now = datetime.now(UTC)
+    # 分区存储下逐分区查询，不放进相关子查询
+    partitioned = event_store.ENABLED
+    rows = (
+        db.query(
+            Device.id,
+            DeviceRiskState.last_event_id,
+            DeviceRiskState.window_events,
+            DeviceRiskState.evaluated_at,
+            null() if partitioned else _max_event_id(),
+            null() if partitioned else _max_ingested_at(),
+            null() if partitioned else _max_ts(now),
+        )
+        .outerjoin(DeviceRiskState, DeviceRiskState.device_id == Device.id)
+        .filter(Device.id.in_(ids))
+        .all()
+    )
+    if partitioned:
+        latest = event_store.latest(db, ids, now)
+        return [
+            (d, e, n, _to_utc_aware(at), *latest.get(d, (0, None, None)))
+            for d, e, n, at, *_ in rows
+        ]
+    return [
+        (d, e, n, _to_utc_aware(at), m or 0, _to_utc_aware(ing), _to_utc_aware(ts))
+        for d, e, n, at, m, ing, ts in rows
+    ]
+
+
+def _has_new_events(row: StateRow) -> bool:
+    _, last_event_id, _, evaluated_at, max_id, max_ingested, max_ts = row
+    if last_event_id is None or max_id > last_event_id:
+        return True
+    if evaluated_at is None:
+        return False
+    if max_ingested is not None and max_ingested >= evaluated_at - timedelta(seconds=LAG_SECONDS):
+        return True
+    return max_ts is not None and max_ts > evaluated_at
+
+
+def due_devices(db: Session, device_ids: Iterable[int]) -> Set[int]:
+    """
+    返回需要重新评估的设备（条件见模块说明）。
+    """
+    ids = list(device_ids)
+    if not ids:
+        return set()
+    return {row[0] for row in _state_rows(db, ids) if row[2] or _has_new_events(row)}
+
+
+def new_event_devices(db: Session, device_ids: Iterable[int]) -> Set[int]:
+    """
+    返回上次评估后有新事件（或从未评估）的设备，不含仅因窗口非空而需要评估的设备。
+    """
+    ids = list(device_ids)
+    if not ids:
+        return set()
+    return {row[0] for row in _state_rows(db, ids) if _has_new_events(row)}
+
+
+def window_counts(db: Session, device_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    返回 {device_id: 最近一次评估窗口内的事件数}，无水位记录的设备不返回。
+    """
+    ids = list(device_ids)
+    if not ids:
+        return {}
+    rows = db.query(DeviceRiskState.device_id, DeviceRiskState.window_events).filter(
+        DeviceRiskState.device_id.in_(ids)
+    )
+    return {d: n for d, n in rows}
+
+
+def delete_device(db: Session, device_id: int) -> None:
+    """
+    删除设备时清理水位（不提交）。
+    """
+    db.query(DeviceRiskState).filter(DeviceRiskState.device_id == device_id).delete(
+        synchronize_session=False
+    )
+
+
+def reset(db: Session, device_ids: Optional[List[int]] = None) -> int:
+    """
+    清除水位（全部或指定设备）并提交，下一轮调度将重新评估这些设备。
+    """
+    q = db.query(DeviceRiskState)
+    if device_ids is not None:
+        q = q.filter(DeviceRiskState.device_id.in_(device_ids))
+    n = q.delete(synchronize_session=False)
+    db.commit()
+    return n
@@ -0,0 +1,233 @@
+"""
+事件触发评估 (可选，RISK_EVENT_TRIGGER=1 开启)
+
+事件写入提交后将设备标记为 dirty，由单个评估线程在防抖窗口后调用 evaluate_device_risk：
+  - 设备最后一次被标记后 RISK_TRIGGER_DEBOUNCE_MS 毫秒内无新事件即评估
+  - 持续有事件写入时，自首次标记起最多延迟 RISK_TRIGGER_MAX_DELAY_MS 毫秒也会评估，
+    避免突发流量一直推迟评估
+  - 同一设备在防抖窗口内的多次标记合并为一次评估（1000 条事件的突发只评估一次）
+  - 评估期间设备再次被标记时重新进入 dirty 集合，保证最新事件一定会被评分
+
+调度器轮询仍然保留（兜底 + 窗口过期后的降分 / 自动恢复），事件触发只缩短首次评分的延迟；
+触发评估同样更新 device_risk_states 水位，调度器按变更筛选时不会重复评估无新事件的设备。
+
+dirty 集合只在本进程内存中，进程退出时未评估的设备由调度器下一轮覆盖。
+
+开启调度租约（RISK_SCHEDULER_LEASES=1）时只评估本节点持有租约分片内的设备，
+其余设备由持有分片的节点的调度器评估，避免多个副本对同一设备重复评分 / 自动隔离。
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from .risk_engine import evaluate_device_risk
+
+ENABLED = os.getenv("RISK_EVENT_TRIGGER", "0") == "1"
+DEBOUNCE_MS = float(os.getenv("RISK_TRIGGER_DEBOUNCE_MS", "2000"))
+MAX_DELAY_MS = float(os.getenv("RISK_TRIGGER_MAX_DELAY_MS", "10000"))
+
+# evaluate(db, device_id)：评估单台设备（不提交，由评估线程提交）
+Evaluate = Callable[[Session, int], Any]
+
+
+def _evaluate(db: Session, device_id: int) -> Any:
+    return evaluate_device_risk(db, device_id, window_minutes=5, commit=False)
+
+
+def _lease_owns(device_id: int) -> bool:
+    # 延迟导入：risk_scheduler 在导入链上依赖事件写入路径
+    from .risk_scheduler import scheduler_state
+
+    if not scheduler_state.leases:
+        return True
+    lease = scheduler_state.lease
+    return lease is not None and lease.owns(device_id)
+
+
+class DirtyEvaluator:
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        debounce_ms: float = DEBOUNCE_MS,
+        max_delay_ms: float = MAX_DELAY_MS,
+        evaluate: Evaluate = _evaluate,
+        owns: Callable[[int], bool] = _lease_owns,
+    ) -> None:
+        self.session_factory = session_factory
+        self.debounce = debounce_ms / 1000.0
+        self.max_delay = max(max_delay_ms, debounce_ms) / 1000.0
+        self.evaluate = evaluate
+        self.owns = owns
+        self._cond = threading.Condition()
+        # device_id -> (首次标记时间, 最近标记时间)
+        self._dirty: Dict[int, Tuple[float, float]] = {}
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+        # 指标
+        self.marks = 0
+        # 设备已在 dirty 集合中时的重复标记（合并掉的评估次数）
+        self.coalesced = 0
+        self.evaluations = 0
+        self.errors = 0
+        # 不在本节点租约分片内而跳过的设备
+        self.not_owned = 0
+        self.last_delay_ms: Optional[float] = None
+        self.max_delay_seen_ms = 0.0
+
+    # ---------------- 标记 ----------------
+    def mark(self, device_ids: Iterable[int]) -> None:
+        now = time.monotonic()
+        with self._cond:
+            if self._stop:
+                return
+            self._ensure_started()
+            for device_id in device_ids:
+                prev = self._dirty.get(device_id)
+                if prev is None:
+                    self._dirty[device_id] = (now, now)
+                else:
+                    self._dirty[device_id] = (prev[0], now)
+                    self.coalesced += 1
+                self.marks += 1
+            self._cond.notify_all()
+
+    def _due_at(self, first: float, last: float) -> float:
+        return min(last + self.debounce, first + self.max_delay)
+
+    # ---------------- 评估线程 ----------------
+    def _ensure_started(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="RiskTriggerThread", daemon=True)
+            self._thread.start()
+
+    def _take_due(self) -> List[Tuple[int, float]]:
+        """
+        等待到至少一台设备到期后取出所有到期设备，返回 [(device_id, 首次标记时间)]。
+        停止时不再等待防抖，直接取出全部剩余设备。
+        """
+        with self._cond:
+            while True:
+                if not self._dirty:
+                    if self._stop:
+                        return []
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                due = [
+                    (d, first)
+                    for d, (first, last) in self._dirty.items()
+                    if self._stop or self._due_at(first, last) <= now
+                ]
+                if due:
+                    for d, _ in due:
+                        del self._dirty[d]
+                    return due
+                next_at = min(self._due_at(f, last) for f, last in self._dirty.values())
+                self._cond.wait(max(0.0, next_at - now))
+
+    def _run(self) -> None:
+        while True:
+            due = self._take_due()
+            if not due:
+                return
+            self._evaluate_due(due)
+
+    def _evaluate_due(self, due: List[Tuple[int, float]]) -> None:
+        db = self.session_factory()
+        try:
+            for device_id, first in due:
+                if not self.owns(device_id):
+                    with self._cond:
+                        self.not_owned += 1
+                    continue
+                try:
+                    self.evaluate(db, device_id)
+                    db.commit()
+                    delay_ms = round((time.monotonic() - first) * 1000, 3)
+                    with self._cond:
+                        self.evaluations += 1
+                        self.last_delay_ms = delay_ms
+                        self.max_delay_seen_ms = max(self.max_delay_seen_ms, delay_ms)
+                except Exception as e:
+                    # 设备已删除等：回滚后跳过，调度器下一轮兜底
+                    db.rollback()
+                    with self._cond:
+                        self.errors += 1
+                    print(f"[RiskTrigger] ERROR device_id={device_id}: {e}")
+                    traceback.print_exc()
+        finally:
+            db.close()
+            with self._cond:
+                self._cond.notify_all()
+
+    # ---------------- 管理 ----------------
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._dirty)
+
+    def stop(self, timeout: float = 30) -> None:
+        """
+        停止评估线程；剩余 dirty 设备立即评估（不再等待防抖）。
+        """
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def status(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "enabled": ENABLED,
+                "debounce_ms": self.debounce * 1000,
+                "max_delay_ms": self.max_delay * 1000,
+                "pending": len(self._dirty),
+                "marks": self.marks,
+                "evaluations": self.evaluations,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+                "not_owned": self.not_owned,
+                "last_delay_ms": self.last_delay_ms,
+                "max_delay_ms_seen": self.max_delay_seen_ms,
+                "worker_alive": bool(self._thread and self._thread.is_alive()),
+            }
+
+
+_evaluator: Optional[DirtyEvaluator] = None
+_evaluator_lock = threading.Lock()
+
+
+def get_evaluator() -> DirtyEvaluator:
+    """
+    进程内单例（首次标记时创建，进程退出时评估剩余设备）。
+    """
+    global _evaluator
+    with _evaluator_lock:
+        if _evaluator is None:
+            from ..db import SessionLocal
+
+            _evaluator = DirtyEvaluator(SessionLocal)
+            atexit.register(_evaluator.stop)
+        return _evaluator
+
+
+def mark_dirty(device_ids: Iterable[int]) -> None:
+    """
+    写入路径调用：标记设备有新事件（RISK_EVENT_TRIGGER 关闭时不做任何事）。
+    """
+    if ENABLED:
+        get_evaluator().mark(device_ids)
+
+
+def status() -> Dict[str, Any]:
+    if _evaluator is None:
+        return {"enabled": ENABLED, "started": False}
+    return {**_evaluator.status(), "started": True}
@@ -0,0 +1,290 @@
+"""
+内存滑动窗口计数 (可选，RISK_WINDOW_STATE=1 开启)
+
+每台设备维护按秒（RISK_WINDOW_BUCKET_SECONDS）分桶的稀疏环形计数，
+事件写入提交后由 event_ingest 同步累加：
+  - 各 event_type 计数（auth_fail / auth_success / policy_violation ...）
+  - net_flow bytes_out(>0) 峰值与协议集合
+  - command 的 cmd 列表（命令异常指标使用）
+评分时窗口统计为 O(桶数) 的内存读取，不再访问 device_events。
+
+说明：
+  - 仅保留最近 HORIZON_SECONDS（/risk/evaluate 最大窗口 60 分钟）
+  - 窗口边界与 SQL 路径一致（ts >= start AND ts < end）：完全落在窗口内的桶直接读汇总，
+    首尾两个部分相交的桶按桶内保存的逐事件时间戳（微秒）精确筛选
+  - 状态只包含本进程写入的事件，多 worker 部署时评估进程必须同时承担写入，
+    否则请保持关闭（回落到 SQL 聚合）
+  - 冷启动 / 重启后首次评分时自动从数据库重建（rebuild）
+  - 与 SQL 路径的一致性可通过 risk_engine.check_window_state 对比
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from datetime import UTC, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from ..models import extract_hot_columns
+from . import event_store
+
+ENABLED = os.getenv("RISK_WINDOW_STATE", "0") == "1"
+BUCKET_SECONDS = max(1, int(os.getenv("RISK_WINDOW_BUCKET_SECONDS", "1")))
+HORIZON_SECONDS = 3600
+
+# (event_id, device_id, event_type, payload, ts)
+EventItem = Tuple[Optional[int], int, str, Any, datetime]
+# 桶内逐事件记录：(ts 微秒, event_type, bytes_out, protocol, cmd)，供窗口首尾桶精确筛选
+_Entry = Tuple[int, str, Any, Any, Any]
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+
+
+class _Bucket:
+    __slots__ = ("counts", "flow_peak", "protocols", "cmds", "entries")
+
+    def __init__(self) -> None:
+        self.counts: Dict[str, int] = {}
+        self.flow_peak: Any = None
+        self.protocols: Set[Any] = set()
+        self.cmds: List[Any] = []
+        self.entries: List[_Entry] = []
+
+
+class _WindowState:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # device_id -> {bucket_index: _Bucket}
+        self.devices: Dict[int, Dict[int, _Bucket]] = {}
+        self.ready = False
+        # 重建时已载入的最大事件 id，之后 record 跳过 <= 该 id 的事件避免重复计数
+        self.watermark = 0
+        self.rebuilt_at: Optional[float] = None
+        self.recorded = 0
+        self.last_prune = 0.0
+        # 重建期间写入的事件先缓存，重建完成后按 watermark 回放
+        self.rebuilding = False
+        self.pending: List[EventItem] = []
+
+
+_state = _WindowState()
+
+
+def _epoch(ts: datetime) -> float:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=UTC)
+    return ts.timestamp()
+
+
+def _micros(ts: datetime) -> int:
+    # 整数微秒，避免浮点秒在边界处的精度误差
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=UTC)
+    return (ts - _EPOCH) // timedelta(microseconds=1)
+
+
+def _fold(b: _Bucket, event_type: str, bytes_out: Any, protocol: Any, cmd: Any) -> None:
+    b.counts[event_type] = b.counts.get(event_type, 0) + 1
+    if event_type == "net_flow":
+        if bytes_out is not None and bytes_out > 0:
+            if b.flow_peak is None or bytes_out > b.flow_peak:
+                b.flow_peak = bytes_out
+        if protocol:
+            b.protocols.add(protocol)
+    elif event_type == "command" and cmd:
+        b.cmds.append(cmd)
+
+
+def _add(buckets: Dict[int, _Bucket], event_type: str, payload: Any, ts: datetime) -> None:
+    us = _micros(ts)
+    idx = us // (BUCKET_SECONDS * 1_000_000)
+    b = buckets.get(idx)
+    if b is None:
+        b = buckets[idx] = _Bucket()
+    bytes_out = protocol = cmd = None
+    if event_type in ("net_flow", "command"):
+        # 与 device_events 热点列同一提取规则，内存滑窗与 SQL 路径比较的值一致
+        hot = extract_hot_columns(payload)
+        if event_type == "net_flow":
+            bytes_out, protocol = hot["bytes_out"], hot["protocol"]
+        else:
+            cmd = hot["cmd"]
+    _fold(b, event_type, bytes_out, protocol, cmd)
+    b.entries.append((us, event_type, bytes_out, protocol, cmd))
+
+
+def _partial(b: _Bucket, start_us: int, end_us: int) -> _Bucket:
+    # 首尾桶只部分落在窗口内：按逐事件时间戳重新汇总
+    out = _Bucket()
+    for us, event_type, bytes_out, protocol, cmd in b.entries:
+        if start_us <= us < end_us:
+            _fold(out, event_type, bytes_out, protocol, cmd)
+    return out
+
+
+def _prune_unlocked(now: float) -> None:
+    cutoff = int(now - HORIZON_SECONDS) // BUCKET_SECONDS
+    for device_id in list(_state.devices):
+        buckets = _state.devices[device_id]
+        for idx in [i for i in buckets if i < cutoff]:
+            del buckets[idx]
+        if not buckets:
+            del _state.devices[device_id]
+    _state.last_prune = now
+
+
+# ================== 写入 ==================
+def record(items: Iterable[EventItem]) -> int:
+    """
+    累加已提交的事件，返回计入的条数（超出保留期或已被重建载入的事件跳过）。
+    """
+    now = time.time()
+    oldest = now - HORIZON_SECONDS
+    n = 0
+    with _state.lock:
+        if _state.rebuilding:
+            _state.pending.extend(items)
+            return 0
+        for event_id, device_id, event_type, payload, ts in items:
+            if event_id is not None and event_id <= _state.watermark:
+                continue
+            if _epoch(ts) < oldest:
+                continue
+            _add(_state.devices.setdefault(device_id, {}), event_type, payload, ts)
+            n += 1
+        _state.recorded += n
+        if now - _state.last_prune >= 60:
+            _prune_unlocked(now)
+    return n
+
+
+def forget(device_id: int) -> None:
+    with _state.lock:
+        _state.devices.pop(device_id, None)
+
+
+# ================== 读取 ==================
+def is_ready() -> bool:
+    return _state.ready
+
+
+def snapshot(
+    device_ids: Iterable[int], window_start: datetime, window_end: datetime
+) -> Dict[int, Dict[str, Any]]:
+    """
+    返回 {device_id: 窗口统计}，仅包含窗口内有事件的设备。
+    """
+    start_us, end_us = _micros(window_start), _micros(window_end)
+    width = BUCKET_SECONDS * 1_000_000
+    lo, hi = start_us // width, end_us // width
+    out: Dict[int, Dict[str, Any]] = {}
+    with _state.lock:
+        for device_id in device_ids:
+            buckets = _state.devices.get(device_id)
+            if not buckets:
+                continue
+            counts: Dict[str, int] = {}
+            peak: Any = None
+            protocols: Set[Any] = set()
+            cmds: List[Any] = []
+            for idx in sorted(i for i in buckets if lo <= i <= hi):
+                b = buckets[idx]
+                if idx * width < start_us or (idx + 1) * width > end_us:
+                    b = _partial(b, start_us, end_us)
+                for k, v in b.counts.items():
+                    counts[k] = counts.get(k, 0) + v
+                if b.flow_peak is not None and (peak is None or b.flow_peak > peak):
+                    peak = b.flow_peak
+                protocols |= b.protocols
+                cmds.extend(b.cmds)
+            total = sum(counts.values())
+            if not total:
+                continue
+            out[device_id] = {
+                "event_count": total,
+                "auth_fail": counts.get("auth_fail", 0),
+                "auth_success": counts.get("auth_success", 0),
+                "policy_violation": counts.get("policy_violation", 0),
+                "flow_peak": peak,
+                "protocols": protocols,
+                "cmds": cmds,
+            }
+    return out
+
+
+def status() -> Dict[str, Any]:
+    with _state.lock:
+        return {
+            "enabled": ENABLED,
+            "ready": _state.ready,
+            "bucket_seconds": BUCKET_SECONDS,
+            "horizon_seconds": HORIZON_SECONDS,
+            "devices": len(_state.devices),
+            "buckets": sum(len(b) for b in _state.devices.values()),
+            "watermark": _state.watermark,
+            "recorded": _state.recorded,
+            "rebuilt_at": _state.rebuilt_at,
+        }
+
+
+# ================== 冷启动重建 ==================
+def rebuild(db: Session) -> int:
+    """
+    从 device_events 载入最近 HORIZON_SECONDS 的事件重建状态，返回载入条数。
+    """
+    with _state.lock:
+        _state.rebuilding = True
+    since = datetime.now(UTC) - timedelta(seconds=HORIZON_SECONDS)
+    try:
+        ev = event_store.source(db, since)
+        rows = (
+            db.query(ev.c.id, ev.c.device_id, ev.c.event_type, ev.c.payload, ev.c.ts)
+            .filter(ev.c.ts >= since)
+            .order_by(ev.c.id)
+            .all()
+        )
+    except Exception:
+        with _state.lock:
+            _state.rebuilding = False
+            pending, _state.pending = _state.pending, []
+        record(pending)
+        raise
+    devices: Dict[int, Dict[int, _Bucket]] = {}
+    watermark = 0
+    for event_id, device_id, event_type, payload, ts in rows:
+        _add(devices.setdefault(device_id, {}), event_type, payload, ts)
+        watermark = max(watermark, event_id)
+    with _state.lock:
+        _state.devices = devices
+        _state.watermark = max(watermark, _state.watermark)
+        _state.ready = True
+        _state.rebuilt_at = time.time()
+        _state.last_prune = time.time()
+        _state.rebuilding = False
+        pending, _state.pending = _state.pending, []
+    record(pending)
+    return len(rows)
+
+
+def ensure_ready(db: Session) -> None:
+    """
+    尚未重建时执行一次冷启动重建。
+    """
+    if not _state.ready:
+        rebuild(db)
+
+
+def reset() -> None:
+    """
+    清空状态（测试 / 管理用途），之后需重新 rebuild 才会启用。
+    """
+    with _state.lock:
+        _state.devices = {}
+        _state.ready = False
+        _state.watermark = 0
+        _state.recorded = 0
+        _state.rebuilt_at = None
+        _state.pending = []
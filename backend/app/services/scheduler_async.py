@@ -0,0 +1,147 @@
+"""
+asyncio 调度循环（随 FastAPI lifespan 启停，见 main.py）
+
+替代原 daemon 线程 + 1 秒步长 sleep 的主循环：
+  - 按单调时钟（loop.time()）的截止时间触发：第 n 次 tick 的计划时间为 起点 + n * 周期，
+    tick 本身的耗时不会累积成漂移；某次 tick 超过一个周期时跳过错过的时间点（计入 missed），不会补跑
+  - 每次 tick 的阻塞数据库工作提交到专用的单线程执行器，事件循环不被阻塞，同一时刻最多一个 tick 在执行
+  - 停止时立即唤醒等待中的循环；若有 tick 正在执行，等待其完成（最多 RISK_SCHEDULER_STOP_TIMEOUT 秒，
+    默认 30）后再关闭执行器，评估事务不会被中途打断
+  - 启停延迟从最长 interval_seconds 降到毫秒级
+
+管理接口（同步路由，运行在线程池）经 start_threadsafe / stop_threadsafe 把启停提交到事件循环。
+
+RISK_SCHEDULER_AUTOSTART=1 时应用启动即开始调度，间隔 RISK_SCHEDULER_INTERVAL 秒（默认 60）。
+每个 uvicorn / gunicorn worker 都会各自启动调度器，未开启租约时多 worker 会重复评估每台设备，
+因此默认仅在 RISK_SCHEDULER_LEASES=1 时自动启动，否则需经 POST /risk/scheduler/start 手动启动。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from .scheduler_lease import ENABLED as LEASES_ENABLED
+
+AUTOSTART = os.getenv("RISK_SCHEDULER_AUTOSTART", "1" if LEASES_ENABLED else "0") == "1"
+DEFAULT_INTERVAL = int(os.getenv("RISK_SCHEDULER_INTERVAL", "60"))
+STOP_TIMEOUT = float(os.getenv("RISK_SCHEDULER_STOP_TIMEOUT", "30"))
+
+
+class AsyncScheduler:
+    """
+    tick：一次阻塞的调度工作（在执行器线程中运行）；period：返回当前周期（秒），每次 tick 后重新读取。
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        tick: Callable[[], Any],
+        period: Callable[[], float],
+    ) -> None:
+        self.loop = loop
+        self._tick = tick
+        self._period = period
+        self._task: Optional[asyncio.Task] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_flight = False
+        # 指标
+        self.ticks = 0
+        self.missed = 0
+        self.last_lag_ms: Optional[float] = None
+        self.last_start_latency_ms: Optional[float] = None
+        self.last_stop_latency_ms: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    # ---------------- 事件循环内 ----------------
+    async def start(self) -> bool:
+        if self.running:
+            return False
+        t0 = time.perf_counter()
+        self._stop = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="RiskScheduler")
+        self._task = asyncio.create_task(self._run(), name="RiskScheduler")
+        self.last_start_latency_ms = round((time.perf_counter() - t0) * 1000, 3)
+        return True
+
+    async def stop(self, timeout: float = STOP_TIMEOUT) -> bool:
+        if not self.running:
+            return False
+        assert self._task is not None and self._stop is not None
+        t0 = time.perf_counter()
+        self._stop.set()
+        try:
+            # shield：超时只放弃等待，不取消正在执行器中运行的评估
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            print(f"[AsyncScheduler] tick still running after {timeout}s, detaching")
+            self._task.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._task = None
+        self.last_stop_latency_ms = round((time.perf_counter() - t0) * 1000, 3)
+        return True
+
+    async def _run(self) -> None:
+        assert self._stop is not None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while not self._stop.is_set():
+            self.last_lag_ms = round((loop.time() - deadline) * 1000, 3)
+            self._in_flight = True
+            try:
+                await loop.run_in_executor(self._executor, self._tick)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self._in_flight = False
+            self.ticks += 1
+
+            period = max(0.001, float(self._period()))
+            deadline += period
+            now = loop.time()
+            if deadline <= now:
+                skipped = int((now - deadline) // period) + 1
+                deadline += skipped * period
+                self.missed += skipped
+            try:
+                await asyncio.wait_for(self._stop.wait(), deadline - now)
+            except asyncio.TimeoutError:
+                pass
+
+    # ---------------- 其它线程 ----------------
+    def _call(self, coro: Any, timeout: Optional[float]) -> Any:
+        try:
+            on_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            coro.close()
+            raise RuntimeError("在事件循环线程内请直接 await start() / stop()")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def start_threadsafe(self, timeout: float = 5) -> bool:
+        return self._call(self.start(), timeout)
+
+    def stop_threadsafe(self, timeout: float = STOP_TIMEOUT) -> bool:
+        return self._call(self.stop(timeout), timeout + 5)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "in_flight": self._in_flight,
+            "ticks": self.ticks,
+            "missed": self.missed,
+            "last_lag_ms": self.last_lag_ms,
+            "last_start_latency_ms": self.last_start_latency_ms,
+            "last_stop_latency_ms": self.last_stop_latency_ms,
+        }
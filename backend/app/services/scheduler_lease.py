@@ -0,0 +1,384 @@
+"""
+多节点调度分片租约 (RISK_SCHEDULER_LEASES=1 开启)
+
+多个 API 副本都启动调度器时，各自只评估自己持有租约的分片，避免重复评分与自动隔离竞争：
+  - 设备按 device_id % RISK_LEASE_SHARDS（默认 16）划分分片，scheduler_leases 每个分片一行
+  - 节点每 TTL/3 同步一次（后台心跳线程）：
+      1. 刷新 scheduler_nodes 心跳；心跳未过期的节点数决定每个节点的目标分片数 ceil(分片数 / 节点数)
+      2. 续约自己持有的分片（owner = 本节点）
+      3. 持有数超过目标时释放多余分片（新节点加入后让出）
+      4. 不足目标时认领空闲或已过期（原持有节点失联）的分片
+  - 认领 / 续约均为带条件的 UPDATE，并发节点对同一分片只有一个能成功（依赖数据库写锁 / 行锁）
+  - 租约 RISK_LEASE_TTL_SECONDS（默认 30）内未续约即可被其它节点接管；各节点时钟偏差应远小于 TTL
+  - 本节点认为自己持有的分片只在最近一次成功同步后的 TTL 内有效：同步持续失败（数据库不可达等）时
+    到期即视为不再持有（owned / owns / filter 返回空），不会在租约被其它节点接管后继续评估
+
+节点标识 RISK_NODE_ID，默认 主机名:进程号。
+
+claim_job / release_job 为单实例后台任务（保留期清理等）提供同样基于条件 UPDATE 的跨进程互斥租约。
+
+本地多进程验证（共享同一个 SQLite 文件，分别在多个终端运行，观察分片划分与失联接管）：
+    python -m backend.app.services.scheduler_lease --url sqlite:///./lease_demo.db --node a
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import UTC, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Set, cast
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import CursorResult
+from sqlalchemy.orm import Session
+
+from ..models import JobLease, SchedulerLease, SchedulerNode
+
+ENABLED = os.getenv("RISK_SCHEDULER_LEASES", "0") == "1"
+SHARDS = max(1, int(os.getenv("RISK_LEASE_SHARDS", "16")))
+TTL_SECONDS = float(os.getenv("RISK_LEASE_TTL_SECONDS", "30"))
+NODE_ID = os.getenv("RISK_NODE_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _to_utc_aware(dt: Optional[datetime]) -> Optional[datetime]:
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=UTC)
+    return dt.astimezone(UTC)
+
+
+def _upsert(db: Session, model: Any, values: List[Dict[str, Any]], update_cols: List[str]) -> None:
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert_fn = sqlite_insert if dialect == "sqlite" else pg_insert
+        stmt: Any = insert_fn(model).values(values)
+        key = [c.name for c in model.__table__.primary_key]
+        if update_cols:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=key, set_={c: getattr(stmt.excluded, c) for c in update_cols}
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=key)
+        db.execute(stmt)
+        return
+    for v in values:
+        if db.get(model, tuple(v[c.name] for c in model.__table__.primary_key)) is None:
+            db.execute(insert(model).values(v))
+        elif update_cols:
+            db.merge(model(**v))
+
+
+def _rowcount(result: Any) -> int:
+    return cast(CursorResult, result).rowcount
+
+
+class LeaseCoordinator:
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        node_id: str = NODE_ID,
+        shards: int = SHARDS,
+        ttl_seconds: float = TTL_SECONDS,
+    ) -> None:
+        self.session_factory = session_factory
+        self.node_id = node_id
+        self.shards = shards
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self._lock = threading.Lock()
+        self._owned: Set[int] = set()
+        # 最近一次成功同步开始时刻 + TTL（单调时钟），过期后视为不再持有任何分片
+        self._valid_until = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._initialized = False
+        # 指标
+        self.live_nodes = 0
+        self.target = 0
+        self.last_sync: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.claimed = 0
+        self.released = 0
+        self.lost = 0
+
+    # ---------------- 分片归属 ----------------
+    def shard_of(self, device_id: int) -> int:
+        return device_id % self.shards
+
+    def _current(self) -> Set[int]:
+        # 调用方持有 _lock
+        return self._owned if time.monotonic() < self._valid_until else set()
+
+    def owned(self) -> Set[int]:
+        with self._lock:
+            return set(self._current())
+
+    def owns(self, device_id: int) -> bool:
+        with self._lock:
+            return self.shard_of(device_id) in self._current()
+
+    def filter(self, device_ids: List[int]) -> List[int]:
+        owned = self.owned()
+        return [d for d in device_ids if self.shard_of(d) in owned]
+
+    # ---------------- 同步 ----------------
+    def _ensure_rows(self, db: Session) -> None:
+        if self._initialized:
+            return
+        _upsert(db, SchedulerLease, [{"shard": s} for s in range(self.shards)], [])
+        self._initialized = True
+
+    def sync(self, db: Session, now: Optional[datetime] = None) -> Set[int]:
+        """
+        心跳 + 续约 + 均衡（释放多余 / 认领空闲与过期分片），提交后返回当前持有的分片。
+        """
+        started = time.monotonic()
+        now = now or datetime.now(UTC)
+        expires = now + self.ttl
+        me = self.node_id
+        _upsert(db, SchedulerNode, [{"node_id": me, "heartbeat_at": now}], ["heartbeat_at"])
+        self._ensure_rows(db)
+
+        live = (
+            db.query(func.count(SchedulerNode.node_id))
+            .filter(SchedulerNode.heartbeat_at > now - self.ttl)
+            .scalar()
+            or 1
+        )
+        target = math.ceil(self.shards / live)
+
+        # 续约：owner 仍为本节点的分片（过期但未被接管的也一并续上）
+        db.execute(
+            update(SchedulerLease)
+            .where(SchedulerLease.owner == me, SchedulerLease.shard < self.shards)
+            .values(expires_at=expires)
+        )
+        owned = {
+            s
+            for (s,) in db.query(SchedulerLease.shard).filter(
+                SchedulerLease.owner == me, SchedulerLease.shard < self.shards
+            )
+        }
+
+        released = 0
+        if len(owned) > target:
+            extra = sorted(owned)[target:]
+            db.execute(
+                update(SchedulerLease)
+                .where(SchedulerLease.owner == me, SchedulerLease.shard.in_(extra))
+                .values(owner=None, expires_at=None)
+            )
+            owned -= set(extra)
+            released = len(extra)
+
+        claimed = 0
+        if len(owned) < target:
+            free = [
+                s
+                for (s,) in db.query(SchedulerLease.shard)
+                .filter(
+                    SchedulerLease.shard < self.shards,
+                    (SchedulerLease.owner.is_(None)) | (SchedulerLease.expires_at <= now),
+                )
+                .order_by(SchedulerLease.shard)
+            ]
+            for s in free:
+                if len(owned) >= target:
+                    break
+                res = db.execute(
+                    update(SchedulerLease)
+                    .where(
+                        SchedulerLease.shard == s,
+                        (SchedulerLease.owner.is_(None)) | (SchedulerLease.expires_at <= now),
+                    )
+                    .values(owner=me, expires_at=expires)
+                )
+                if _rowcount(res) == 1:
+                    owned.add(s)
+                    claimed += 1
+        db.commit()
+
+        with self._lock:
+            lost = len({s for s in self._owned if s not in owned}) - released
+            self.lost += max(0, lost)
+            self._owned = owned
+            self._valid_until = started + self.ttl.total_seconds()
+            self.live_nodes = live
+            self.target = target
+            self.claimed += claimed
+            self.released += released
+            self.last_sync = time.time()
+        return owned
+
+    def release_all(self, db: Session) -> None:
+        """
+        主动释放本节点的全部分片并注销（正常停止时调用，其它节点无需等待 TTL 即可接管）。
+        """
+        db.execute(
+            update(SchedulerLease)
+            .where(SchedulerLease.owner == self.node_id)
+            .values(owner=None, expires_at=None)
+        )
+        db.query(SchedulerNode).filter(SchedulerNode.node_id == self.node_id).delete(
+            synchronize_session=False
+        )
+        db.commit()
+        with self._lock:
+            self._owned = set()
+
+    # ---------------- 心跳线程 ----------------
+    def _sync_once(self) -> None:
+        db = self.session_factory()
+        try:
+            self.sync(db)
+            self.last_error = None
+        except Exception as e:
+            db.rollback()
+            self.last_error = f"{e.__class__.__name__}: {e}"
+            traceback.print_exc()
+        finally:
+            db.close()
+
+    def _run(self) -> None:
+        interval = self.ttl.total_seconds() / 3
+        while not self._stop.wait(interval):
+            self._sync_once()
+
+    def start(self) -> None:
+        """
+        同步一次（调度器首轮即按租约过滤），然后启动心跳线程。
+        """
+        self._stop.clear()
+        self._sync_once()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="RiskLeaseThread", daemon=True)
+            self._thread.start()
+
+    def stop(self, release: bool = True) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if release:
+            db = self.session_factory()
+            try:
+                self.release_all(db)
+            finally:
+                db.close()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": True,
+                "node_id": self.node_id,
+                "shards": self.shards,
+                "ttl_seconds": self.ttl.total_seconds(),
+                "owned": sorted(self._current()),
+                "live_nodes": self.live_nodes,
+                "target": self.target,
+                "claimed": self.claimed,
+                "released": self.released,
+                "lost": self.lost,
+                "last_sync": self.last_sync,
+                "last_error": self.last_error,
+                "heartbeat_alive": bool(self._thread and self._thread.is_alive()),
+            }
+
+
+# ================== 单实例任务租约 ==================
+def claim_job(
+    db: Session, name: str, owner: str, ttl_seconds: float, now: Optional[datetime] = None
+) -> bool:
+    """
+    认领或续约任务租约并提交：空闲、已过期或本 owner 持有时成功，其它 owner 持有未过期时返回 False。
+    """
+    now = now or datetime.now(UTC)
+    _upsert(db, JobLease, [{"name": name}], [])
+    res = db.execute(
+        update(JobLease)
+        .where(
+            JobLease.name == name,
+            JobLease.owner.is_(None) | (JobLease.expires_at <= now) | (JobLease.owner == owner),
+        )
+        .values(owner=owner, expires_at=now + timedelta(seconds=ttl_seconds))
+    )
+    db.commit()
+    return _rowcount(res) == 1
+
+
+def release_job(db: Session, name: str, owner: str) -> None:
+    """
+    释放本 owner 持有的任务租约并提交。
+    """
+    db.execute(
+        update(JobLease)
+        .where(JobLease.name == name, JobLease.owner == owner)
+        .values(owner=None, expires_at=None)
+    )
+    db.commit()
+
+
+def lease_table(db: Session, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    当前全部租约与节点（管理接口使用）。
+    """
+    now = now or datetime.now(UTC)
+    leases = []
+    for s, owner, exp in db.execute(
+        select(SchedulerLease.shard, SchedulerLease.owner, SchedulerLease.expires_at).order_by(
+            SchedulerLease.shard
+        )
+    ):
+        expires_at = _to_utc_aware(exp)
+        live = owner is not None and expires_at is not None and expires_at > now
+        leases.append({"shard": s, "owner": owner, "expires_at": expires_at, "live": live})
+    nodes = [
+        {"node_id": n, "heartbeat_at": _to_utc_aware(hb)}
+        for n, hb in db.execute(
+            select(SchedulerNode.node_id, SchedulerNode.heartbeat_at).order_by(
+                SchedulerNode.node_id
+            )
+        )
+    ]
+    return {"leases": leases, "nodes": nodes}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from sqlalchemy.orm import sessionmaker
+
+    from ..db import create_db_engine
+    from ..models import Base
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", required=True)
+    parser.add_argument("--node", required=True)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--shards", type=int, default=SHARDS)
+    parser.add_argument("--ttl", type=float, default=TTL_SECONDS)
+    parser.add_argument("--no-release", action="store_true", help="exit without releasing")
+    args = parser.parse_args()
+
+    engine = create_db_engine(args.url)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    coord = LeaseCoordinator(factory, node_id=args.node, shards=args.shards, ttl_seconds=args.ttl)
+    session = factory()
+    try:
+        for _ in range(args.rounds):
+            owned = coord.sync(session)
+            print(json.dumps({"node": args.node, "owned": sorted(owned)}), flush=True)
+            time.sleep(args.interval)
+        if not args.no_release:
+            coord.release_all(session)
+    finally:
+        session.close()
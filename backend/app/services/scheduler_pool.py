@@ -0,0 +1,132 @@
+"""
+调度器并行评估 (RISK_SCHEDULER_WORKERS > 1 时启用)
+
+一轮评估的设备 id 按块（RISK_SCHEDULER_CHUNK，默认 200）放入共享队列，由 N 个工作线程领取：
+  - 每个工作线程持有独立的 Session（整轮复用），线程之间不共享 ORM 状态
+  - 每块调用 evaluate_devices_batch（整块集合查询 + 单事务提交）；整块失败时回滚并逐设备重试，
+    出错设备只影响自身
+  - 慢设备 / 慢块只占用一个工作线程，其余线程继续领取后续块
+
+SQLite 单写者：读取与评分并行，写入阶段经进程内写锁串行化（evaluate_devices_batch 的 write_lock），
+避免多个连接同时升级写事务导致 database is locked；其它数据库不加锁。
+
+每轮结束后各工作线程的设备数 / 块数 / 错误数 / 耗时 / 吞吐见 /risk/scheduler/status 的 last_workers。
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from typing import Any, Callable, ContextManager, Deque, Dict, List, Mapping, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from .risk_engine import evaluate_device_risk, evaluate_devices_batch
+
+# 进程内 SQLite 写锁（所有并行工作线程共用）
+WRITE_LOCK = threading.Lock()
+
+
+def write_lock_for(db: Session) -> Optional[ContextManager[Any]]:
+    return WRITE_LOCK if db.get_bind().dialect.name == "sqlite" else None
+
+
+class WorkerStats:
+    __slots__ = ("name", "devices", "chunks", "errors", "busy_seconds")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.devices = 0
+        self.chunks = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "worker": self.name,
+            "devices": self.devices,
+            "chunks": self.chunks,
+            "errors": self.errors,
+            "busy_seconds": round(self.busy_seconds, 4),
+            "devices_per_second": (
+                round(self.devices / self.busy_seconds, 2) if self.busy_seconds else None
+            ),
+        }
+
+
+def evaluate_each(
+    db: Session,
+    device_ids: List[int],
+    cfg: Mapping[str, Any],
+    lock: Optional[ContextManager[Any]],
+) -> int:
+    """
+    块失败后的逐设备重试（SQLite 下整台设备的评估在写锁内完成），返回出错设备数。
+    """
+    errors = 0
+    for device_id in device_ids:
+        with lock if lock is not None else nullcontext():
+            try:
+                evaluate_device_risk(db, device_id, window_minutes=5, commit=False, cfg=cfg)
+                db.commit()
+            except Exception as e:
+                errors += 1
+                db.rollback()
+                print(f"[SchedulerPool] ERROR device_id={device_id}: {e}")
+    return errors
+
+
+def evaluate_parallel(
+    device_ids: List[int],
+    cfg: Mapping[str, Any],
+    workers: int,
+    chunk_size: int,
+    session_factory: Callable[[], Session],
+) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    并行评估一轮设备，返回 (出错设备数, 各工作线程统计)。
+    """
+    chunks: Deque[List[int]] = deque(
+        device_ids[i : i + chunk_size] for i in range(0, len(device_ids), chunk_size)
+    )
+    queue_lock = threading.Lock()
+    stats = [WorkerStats(f"worker-{i + 1}") for i in range(max(1, min(workers, len(chunks))))]
+
+    def _take() -> Optional[List[int]]:
+        with queue_lock:
+            return chunks.popleft() if chunks else None
+
+    def _work(st: WorkerStats) -> None:
+        db = session_factory()
+        lock = write_lock_for(db)
+        try:
+            while True:
+                chunk = _take()
+                if chunk is None:
+                    return
+                t0 = time.perf_counter()
+                try:
+                    evaluate_devices_batch(db, chunk, window_minutes=5, cfg=cfg, write_lock=lock)
+                except Exception as e:
+                    db.rollback()
+                    print(
+                        f"[SchedulerPool] {st.name} chunk ERROR ({e}), falling back to per-device"
+                    )
+                    st.errors += evaluate_each(db, chunk, cfg, lock)
+                st.devices += len(chunk)
+                st.chunks += 1
+                st.busy_seconds += time.perf_counter() - t0
+        finally:
+            db.close()
+
+    threads = [
+        threading.Thread(target=_work, args=(st,), name=f"RiskScheduler-{st.name}", daemon=True)
+        for st in stats
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(st.errors for st in stats), [st.as_dict() for st in stats]
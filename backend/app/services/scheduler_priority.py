@@ -0,0 +1,264 @@
+"""
+自适应优先级调度 (RISK_SCHEDULER_PRIORITY=1 开启，或启动调度器时传 priority=true)
+
+默认调度每轮按同一间隔扫描全部设备；该模式改为按"下次到期时间"排序的最小堆：
+  - 调度线程每 RISK_PRIORITY_TICK_SECONDS（默认 5）秒取出已到期的设备，
+    每次最多 RISK_PRIORITY_BUDGET（默认 500）台，最早到期者优先，其余留在堆中下次继续
+  - 评估后按结果决定该设备的下次间隔（限制在 [min_seconds, max_seconds] 内）：
+      high / 已隔离且冷却期已过（等待自动恢复判定）  -> min_seconds
+      medium                                       -> 2 * min_seconds
+      low 但窗口内有事件                            -> 基准间隔（调度器 interval_seconds）
+      窗口为空（空闲）                              -> 上次间隔翻倍（指数退避），直到 max_seconds
+  - 退避中的设备出现新事件时提前到当前时刻（每 min_seconds 检查一次事件水位）
+  - 新设备立即到期，已删除的设备在下次同步设备列表时移出堆
+
+min_seconds / max_seconds 默认取 RISK_PRIORITY_MIN_SECONDS（15）/ RISK_PRIORITY_MAX_SECONDS（900），
+可通过 PATCH /risk/scheduler/priority 在运行时调整（新间隔从各设备下次评估后生效）。
+"""
+
+from __future__ import annotations
+
+import heapq
+import os
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import risk_state
+from .risk_engine import evaluate_devices_batch, restore_due
+from .scheduler_pool import evaluate_each
+
+ENABLED = os.getenv("RISK_SCHEDULER_PRIORITY", "0") == "1"
+MIN_SECONDS = float(os.getenv("RISK_PRIORITY_MIN_SECONDS", "15"))
+MAX_SECONDS = float(os.getenv("RISK_PRIORITY_MAX_SECONDS", "900"))
+TICK_SECONDS = max(1, int(os.getenv("RISK_PRIORITY_TICK_SECONDS", "5")))
+BUDGET = max(1, int(os.getenv("RISK_PRIORITY_BUDGET", "500")))
+# 到期设备分块评估的块大小 / 新事件检查每次查询的设备数
+_CHUNK = 200
+_SCAN_CHUNK = 500
+
+
+class Cadence:
+    """
+    每台设备下次评估间隔的计算规则。
+    """
+
+    def __init__(self, min_seconds: float = MIN_SECONDS, max_seconds: float = MAX_SECONDS) -> None:
+        self.update(min_seconds, max_seconds)
+
+    def update(self, min_seconds: float, max_seconds: float) -> None:
+        if min_seconds < 1:
+            raise ValueError("min_seconds 至少为 1 秒")
+        if max_seconds < min_seconds:
+            raise ValueError("max_seconds 不能小于 min_seconds")
+        self.min_seconds = float(min_seconds)
+        self.max_seconds = float(max_seconds)
+
+    def _clamp(self, seconds: float) -> float:
+        return min(self.max_seconds, max(self.min_seconds, seconds))
+
+    def next_interval(
+        self,
+        level: Optional[str],
+        window_events: int,
+        restore_pending: bool,
+        previous: Optional[float],
+        base: float,
+    ) -> float:
+        if restore_pending or level == "high":
+            return self.min_seconds
+        if level == "medium":
+            return self._clamp(2 * self.min_seconds)
+        if window_events:
+            return self._clamp(base)
+        # 空闲：从基准间隔开始逐次翻倍
+        return self._clamp(2 * max(previous or 0.0, base / 2))
+
+
+class DueHeap:
+    """
+    按到期时间排序的设备最小堆；重新入堆时旧条目不删除，弹出时按 _due 判定并丢弃过期条目。
+    """
+
+    def __init__(self) -> None:
+        self._heap: List[Tuple[float, int]] = []
+        self._due: Dict[int, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def __contains__(self, device_id: object) -> bool:
+        return device_id in self._due
+
+    def push(self, device_id: int, due: float) -> None:
+        self._due[device_id] = due
+        heapq.heappush(self._heap, (due, device_id))
+
+    def bump(self, device_id: int, due: float) -> bool:
+        """
+        提前到期（只会提前，不会推迟），返回是否发生变化。
+        """
+        if self._due.get(device_id, float("inf")) <= due:
+            return False
+        self.push(device_id, due)
+        return True
+
+    def discard(self, device_id: int) -> None:
+        self._due.pop(device_id, None)
+
+    def due_at(self, device_id: int) -> Optional[float]:
+        return self._due.get(device_id)
+
+    def next_due(self) -> Optional[float]:
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float, limit: int) -> List[int]:
+        out: List[int] = []
+        while len(out) < limit:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            _, device_id = heapq.heappop(self._heap)
+            del self._due[device_id]
+            out.append(device_id)
+        # 过期条目过多时重建，避免堆无限增长
+        if len(self._heap) > 2 * len(self._due) + 1024:
+            self._heap = [(d, i) for i, d in self._due.items()]
+            heapq.heapify(self._heap)
+        return out
+
+    def _drop_stale(self) -> None:
+        while self._heap:
+            due, device_id = self._heap[0]
+            if self._due.get(device_id) == due:
+                return
+            heapq.heappop(self._heap)
+
+
+class PriorityScheduler:
+    def __init__(self, cadence: Optional[Cadence] = None, budget: int = BUDGET) -> None:
+        self.cadence = cadence or Cadence()
+        self.budget = budget
+        self.heap = DueHeap()
+        self._interval: Dict[int, float] = {}
+        self._last_scan: Optional[float] = None
+        self._lock = threading.Lock()
+        # 指标
+        self.ticks = 0
+        self.evaluated = 0
+        self.preempted = 0
+        self.last_tick: Dict[str, Any] = {}
+
+    def _sync(self, device_ids: List[int], now: float) -> None:
+        current: Set[int] = set(device_ids)
+        for device_id in device_ids:
+            if device_id not in self.heap:
+                self.heap.push(device_id, now)
+        for device_id in [d for d in self._interval if d not in current]:
+            self.heap.discard(device_id)
+            del self._interval[device_id]
+        self._interval.update({d: 0.0 for d in device_ids if d not in self._interval})
+
+    def _preempt(self, db: Session, device_ids: List[int], now: float) -> int:
+        """
+        下次到期时间在 min_seconds 之后、但已有新事件的设备提前到当前时刻。
+        """
+        horizon = now + self.cadence.min_seconds
+        waiting = [d for d in device_ids if (self.heap.due_at(d) or 0.0) > horizon]
+        bumped = 0
+        for i in range(0, len(waiting), _SCAN_CHUNK):
+            for device_id in risk_state.new_event_devices(db, waiting[i : i + _SCAN_CHUNK]):
+                bumped += self.heap.bump(device_id, now)
+        return bumped
+
+    def tick(
+        self,
+        db: Session,
+        device_ids: List[int],
+        cfg: Mapping[str, Any],
+        base_seconds: float,
+        now: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """
+        同步设备列表、评估已到期设备（最多 budget 台）并重新排期，返回本次统计。
+        """
+        with self._lock:
+            now = time.time() if now is None else now
+            t0 = time.perf_counter()
+            self._sync(device_ids, now)
+            preempted = 0
+            if self._last_scan is None or now - self._last_scan >= self.cadence.min_seconds:
+                preempted = self._preempt(db, device_ids, now)
+                self._last_scan = now
+
+            due = self.heap.pop_due(now, self.budget)
+            levels: Dict[int, str] = {}
+            errors = 0
+            for i in range(0, len(due), _CHUNK):
+                chunk = due[i : i + _CHUNK]
+                try:
+                    for r in evaluate_devices_batch(db, chunk, window_minutes=5, cfg=cfg):
+                        levels[r["device_id"]] = r["level"]
+                except Exception as e:
+                    db.rollback()
+                    print(f"[PriorityScheduler] chunk ERROR ({e}), falling back to per-device")
+                    errors += evaluate_each(db, chunk, cfg, None)
+
+            windows = risk_state.window_counts(db, due)
+            pending = restore_due(db, due, cfg)
+            db.commit()
+            for device_id in due:
+                interval = self.cadence.next_interval(
+                    levels.get(device_id),
+                    windows.get(device_id, 0),
+                    device_id in pending,
+                    self._interval.get(device_id),
+                    base_seconds,
+                )
+                self._interval[device_id] = interval
+                self.heap.push(device_id, now + interval)
+
+            self.ticks += 1
+            self.evaluated += len(due)
+            self.preempted += preempted
+            self.last_tick = {
+                "at": now,
+                "evaluated": len(due),
+                "errors": errors,
+                "preempted": preempted,
+                "overdue": sum(1 for d in device_ids if (self.heap.due_at(d) or 0.0) <= now),
+                "seconds": round(time.perf_counter() - t0, 4),
+            }
+            return self.last_tick
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            buckets: Dict[str, int] = {"min": 0, "active": 0, "backoff": 0, "max": 0}
+            for interval in self._interval.values():
+                if interval <= 0:
+                    continue
+                if interval <= self.cadence.min_seconds:
+                    buckets["min"] += 1
+                elif interval >= self.cadence.max_seconds:
+                    buckets["max"] += 1
+                elif interval <= 2 * self.cadence.min_seconds:
+                    buckets["active"] += 1
+                else:
+                    buckets["backoff"] += 1
+            next_due = self.heap.next_due()
+            return {
+                "min_seconds": self.cadence.min_seconds,
+                "max_seconds": self.cadence.max_seconds,
+                "budget": self.budget,
+                "tick_seconds": TICK_SECONDS,
+                "devices": len(self.heap),
+                "next_due_in": round(next_due - time.time(), 3) if next_due is not None else None,
+                "intervals": buckets,
+                "ticks": self.ticks,
+                "evaluated": self.evaluated,
+                "preempted": self.preempted,
+                "last_tick": self.last_tick,
+            }
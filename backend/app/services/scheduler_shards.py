@@ -0,0 +1,233 @@
+"""
+多进程分片调度 (RISK_SCHEDULER_PROCESSES > 1 时启用)
+
+评分变为 CPU 密集（如引入模型打分）后，线程池受 GIL 限制只能用满一个核。该模式：
+  - 按 device_id 一致性哈希（每个分片 RISK_SHARD_VNODES 个虚拟节点，默认 64）把设备分到 N 个分片；
+    分片数变化时只有约 1/N 的设备换分片
+  - 每个分片固定对应一个单进程 ProcessPoolExecutor（spawn），进程跨轮常驻：
+    同一设备每轮都落在同一进程，进程内只读缓存（协议索引等）保持预热；
+    子进程崩溃导致执行器损坏（BrokenProcessPool）时该分片本轮记为失败，并重建执行器供下一轮使用
+  - 内存滑窗（risk_window）只由父进程的写入路径维护，子进程中的副本会过期，
+    因此子进程内关闭 RISK_WINDOW_STATE，窗口统计走 SQL 路径
+  - 子进程启动时用父进程的连接串自建引擎与 Session；
+    每轮下发父进程的配置快照（内容 + version + digest），子进程校验 digest 后按同一版本评分
+  - 各分片结果（设备数 / 错误数 / 耗时 / 进程号 / 配置版本）汇总回 SchedulerState.last_shards
+
+SQLite 下各进程的写入阶段经同一把跨进程锁串行化（与线程池模式的写锁语义相同）。
+
+吞吐对比：python scripts/bench_scheduler_shards.py --devices 2000 --processes 1 2 4
+"""
+
+from __future__ import annotations
+
+import atexit
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from bisect import bisect_right
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, ContextManager, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from ..db import create_db_engine
+from ..db import engine as default_engine
+from . import risk_engine, risk_window
+from .risk_config import ConfigSnapshot
+from .risk_engine import evaluate_devices_batch
+from .scheduler_pool import evaluate_each
+
+DEFAULT_PROCESSES = int(os.getenv("RISK_SCHEDULER_PROCESSES", "0"))
+VNODES = max(1, int(os.getenv("RISK_SHARD_VNODES", "64")))
+
+
+# ================== 一致性哈希 ==================
+def _hash(key: str) -> int:
+    # 不使用内置 hash()：其值随进程的 PYTHONHASHSEED 变化
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    device_id -> 分片号的一致性哈希环。
+    """
+
+    def __init__(self, shards: int, vnodes: int = VNODES) -> None:
+        if shards < 1:
+            raise ValueError("shards 至少为 1")
+        self.shards = shards
+        points = sorted((_hash(f"shard-{s}#{v}"), s) for s in range(shards) for v in range(vnodes))
+        self._keys = [h for h, _ in points]
+        self._owners = [s for _, s in points]
+
+    def shard_for(self, device_id: int) -> int:
+        i = bisect_right(self._keys, _hash(str(device_id)))
+        return self._owners[i % len(self._owners)]
+
+    def split(self, device_ids: List[int]) -> List[List[int]]:
+        out: List[List[int]] = [[] for _ in range(self.shards)]
+        for device_id in device_ids:
+            out[self.shard_for(device_id)].append(device_id)
+        return out
+
+
+# ================== 子进程 ==================
+_session_factory: Optional[sessionmaker] = None
+_write_lock: Optional[ContextManager[Any]] = None
+
+
+def _init_process(url: str, write_lock: Any) -> None:
+    global _session_factory, _write_lock
+    # 子进程收不到父进程写入路径的滑窗更新，改用 SQL 统计窗口
+    risk_window.ENABLED = False
+    risk_engine.RISK_WINDOW_STATE = False
+    engine = create_db_engine(url)
+    _session_factory = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    _write_lock = write_lock if engine.dialect.name == "sqlite" else None
+
+
+def _evaluate_shard(
+    shard: int,
+    device_ids: List[int],
+    cfg_data: Dict[str, Any],
+    cfg_version: int,
+    cfg_digest: str,
+    chunk_size: int,
+) -> Dict[str, Any]:
+    cfg = ConfigSnapshot(cfg_data, cfg_version)
+    if cfg.digest != cfg_digest:
+        raise RuntimeError(f"config digest mismatch: {cfg.digest} != {cfg_digest}")
+    assert _session_factory is not None, "process not initialized"
+    db: Session = _session_factory()
+    t0 = time.perf_counter()
+    errors = 0
+    try:
+        for i in range(0, len(device_ids), chunk_size):
+            chunk = device_ids[i : i + chunk_size]
+            try:
+                evaluate_devices_batch(db, chunk, window_minutes=5, cfg=cfg, write_lock=_write_lock)
+            except Exception as e:
+                db.rollback()
+                print(f"[SchedulerShard {shard}] chunk ERROR ({e}), falling back to per-device")
+                errors += evaluate_each(db, chunk, cfg, _write_lock)
+    finally:
+        db.close()
+    seconds = time.perf_counter() - t0
+    return {
+        "shard": shard,
+        "pid": os.getpid(),
+        "devices": len(device_ids),
+        "errors": errors,
+        "seconds": round(seconds, 4),
+        "devices_per_second": round(len(device_ids) / seconds, 2) if seconds else None,
+        "config_version": cfg.version,
+        "config_digest": cfg.digest,
+    }
+
+
+# ================== 父进程 ==================
+class ShardedPool:
+    """
+    N 个常驻单进程执行器，分片 i 始终提交到执行器 i。
+    """
+
+    def __init__(self, processes: int, url: str, vnodes: int = VNODES) -> None:
+        ctx = multiprocessing.get_context("spawn")
+        self.processes = processes
+        self.url = url
+        self.ring = HashRing(processes, vnodes)
+        self._ctx = ctx
+        self._lock = ctx.Lock()
+        self._executors = [self._new_executor() for _ in range(processes)]
+        self.respawns = 0
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=self._ctx,
+            initializer=_init_process,
+            initargs=(self.url, self._lock),
+        )
+
+    def _respawn(self, shard: int) -> None:
+        """
+        重建损坏的分片执行器（子进程被杀 / 崩溃后该执行器不再可用）。
+        """
+        self._executors[shard].shutdown(wait=False, cancel_futures=True)
+        self._executors[shard] = self._new_executor()
+        self.respawns += 1
+        print(f"[SchedulerShard {shard}] process pool broken, respawned")
+
+    def _submit(self, shard: int, *args: Any) -> Future:
+        try:
+            return self._executors[shard].submit(_evaluate_shard, shard, *args)
+        except BrokenProcessPool:
+            self._respawn(shard)
+            return self._executors[shard].submit(_evaluate_shard, shard, *args)
+
+    def run(
+        self, device_ids: List[int], cfg: ConfigSnapshot, chunk_size: int
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        并行评估一轮设备，返回 (出错设备数, 各分片结果)。
+        """
+        data = cfg.to_dict()
+        shards = self.ring.split(device_ids)
+        futures = [
+            (shard, self._submit(shard, ids, data, cfg.version, cfg.digest, chunk_size))
+            for shard, ids in enumerate(shards)
+            if ids
+        ]
+        results: List[Dict[str, Any]] = []
+        errors = 0
+        for shard, fut in futures:
+            try:
+                r = fut.result()
+            except Exception as e:
+                # 子进程崩溃 / 配置校验失败：整个分片记为失败，下一轮重试
+                r = {"shard": shard, "error": f"{e.__class__.__name__}: {e}"}
+                errors += len(shards[shard])
+                if isinstance(e, BrokenProcessPool):
+                    self._respawn(shard)
+            else:
+                errors += r["errors"]
+            results.append(r)
+        return errors, results
+
+    def shutdown(self) -> None:
+        for ex in self._executors:
+            ex.shutdown(wait=True, cancel_futures=True)
+
+
+_pool: Optional[ShardedPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(processes: int, url: Optional[str] = None) -> ShardedPool:
+    """
+    进程内单例；分片数或连接串变化时重建（旧进程退出）。
+    """
+    global _pool
+    if url is None:
+        url = default_engine.url.render_as_string(hide_password=False)
+    with _pool_lock:
+        if _pool is not None and (_pool.processes != processes or _pool.url != url):
+            _pool.shutdown()
+            _pool = None
+        if _pool is None:
+            _pool = ShardedPool(processes, url)
+        return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+atexit.register(shutdown_pool)
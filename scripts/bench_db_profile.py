@@ -0,0 +1,90 @@
+"""
+SQLite 连接 profile 吞吐对比（default / tuned，见 backend/app/db.py）：
+  - ingest   : 每个请求一批事件，insert_events 单独提交（模拟逐请求写入）
+  - evaluate : 逐设备 evaluate_device_risk（每台设备一次提交）
+
+用法（项目根目录）：
+    python scripts/bench_db_profile.py --devices 50 --requests 400 --batch 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import UTC, datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from backend.app.db import create_db_engine  # noqa: E402
+from backend.app.models import Base, Device  # noqa: E402
+from backend.app.services.event_ingest import build_values, insert_events  # noqa: E402
+from backend.app.services.risk_engine import evaluate_device_risk  # noqa: E402
+
+
+def _spec(i: int):
+    if i % 3 == 0:
+        return "net_flow", {"bytes_out": 1000 + i, "protocol": "mqtt"}
+    if i % 3 == 1:
+        return "auth_fail", {}
+    return "command", {"cmd": "status"}
+
+
+def _run(profile: str, tmp: str, args) -> None:
+    engine = create_db_engine(
+        f"sqlite:///{os.path.join(tmp, profile + '.db')}", sqlite_profile=profile
+    )
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine, autoflush=False)
+    db = session_factory()
+    try:
+        devices = [
+            Device(name=f"bench-{i}", type="sensor", owner_id=1) for i in range(args.devices)
+        ]
+        db.add_all(devices)
+        db.commit()
+        ids = [d.id for d in devices]
+
+        t0 = time.perf_counter()
+        for r in range(args.requests):
+            now = datetime.now(UTC)
+            device_id = ids[r % len(ids)]
+            insert_events(
+                db, [build_values(device_id, *_spec(i), None, now) for i in range(args.batch)]
+            )
+        ingest_s = time.perf_counter() - t0
+        events = args.requests * args.batch
+
+        t0 = time.perf_counter()
+        for device_id in ids:
+            evaluate_device_risk(db, device_id)
+        eval_s = time.perf_counter() - t0
+    finally:
+        db.close()
+        engine.dispose()
+    print(
+        f"{profile:8s} ingest: {events} events in {ingest_s * 1000:8.1f}ms "
+        f"({events / ingest_s:8.0f} events/s, {args.requests / ingest_s:6.0f} commits/s) | "
+        f"evaluate: {len(ids)} devices in {eval_s * 1000:7.1f}ms "
+        f"({len(ids) / eval_s:6.0f} devices/s)"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--batch", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for profile in ("default", "tuned"):
+            _run(profile, tmp, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+事件写入吞吐对比（SQLite）：
+  - orm_refresh : 原实现，ORM add_all + commit + 逐行 refresh
+  - orm         : persist_events（ORM 写入，无 refresh）
+  - bulk        : insert_events（Core INSERT ... RETURNING，单条语句 executemany）
+
+用法（项目根目录）：
+    python scripts/bench_ingest.py --batch 1000 --rounds 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import UTC, datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from backend.app.models import Base, Device  # noqa: E402
+from backend.app.services.event_ingest import (  # noqa: E402
+    build_event,
+    build_values,
+    insert_events,
+    persist_events,
+)
+
+
+def _spec(i: int):
+    if i % 3 == 0:
+        return "net_flow", {"bytes_out": 1000 + i, "protocol": "mqtt"}
+    if i % 3 == 1:
+        return "auth_fail", {}
+    return "command", {"cmd": "status"}
+
+
+def _run(mode: str, session_factory, device_id: int, batch: int) -> float:
+    db = session_factory()
+    now = datetime.now(UTC)
+    t0 = time.perf_counter()
+    try:
+        if mode == "bulk":
+            insert_events(db, [build_values(device_id, *_spec(i), None, now) for i in range(batch)])
+        else:
+            rows = [build_event(device_id, *_spec(i), None, now) for i in range(batch)]
+            persist_events(db, rows)
+            if mode == "orm_refresh":
+                for r in rows:
+                    db.refresh(r)
+    finally:
+        db.close()
+    return time.perf_counter() - t0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine, autoflush=False)
+        with session_factory() as db:
+            d = Device(name="bench", type="sensor", owner_id=1)
+            db.add(d)
+            db.commit()
+            device_id = d.id
+
+        for mode in ("orm_refresh", "orm", "bulk"):
+            _run(mode, session_factory, device_id, args.batch)  # 预热
+            elapsed = [
+                _run(mode, session_factory, device_id, args.batch) for _ in range(args.rounds)
+            ]
+            best = min(elapsed)
+            print(
+                f"{mode:12s} batch={args.batch} best={best * 1000:8.1f}ms "
+                f"events/s={args.batch / best:10.0f}"
+            )
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
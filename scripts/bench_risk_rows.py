@@ -0,0 +1,122 @@
+"""
+风险引擎行加载路径对比（SQLite，单设备窗口内 N 条事件）：
+  - orm        : 原实现，db.query(DeviceEvent) 加载完整实体（含 joined Device），进入 identity map
+  - projection : risk_engine._collect_stats_rows，列投影 Row，不构造实体、不跟踪
+
+输出每种方式的最佳耗时与 tracemalloc 峰值内存（内存单独一轮统计）。
+
+用法（项目根目录）：
+    python scripts/bench_risk_rows.py --events 10000 --rounds 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import UTC, datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import joinedload, sessionmaker  # noqa: E402
+
+from backend.app.models import Base, Device, DeviceEvent  # noqa: E402
+from backend.app.services.event_ingest import build_values, insert_events  # noqa: E402
+from backend.app.services.risk_engine import _collect_stats_rows  # noqa: E402
+
+
+def _spec(i: int):
+    if i % 3 == 0:
+        return "net_flow", {"bytes_out": 1000 + i, "protocol": "mqtt"}
+    if i % 3 == 1:
+        return "auth_fail", {}
+    return "command", {"cmd": "status"}
+
+
+def _orm(db, device_id: int, start: datetime, end: datetime) -> int:
+    # 原实现的窗口加载方式（DeviceEvent.device 原为 lazy="joined"）
+    events = (
+        db.query(DeviceEvent)
+        .options(joinedload(DeviceEvent.device))
+        .filter(
+            DeviceEvent.device_id == device_id,
+            DeviceEvent.ts >= start,
+            DeviceEvent.ts < end,
+        )
+        .all()
+    )
+    cur = [(e.payload or {}).get("bytes_out", 0) for e in events if e.event_type == "net_flow"]
+    return len(events) + len(cur)
+
+
+def _projection(db, device_id: int, start: datetime, end: datetime) -> int:
+    return _collect_stats_rows(db, device_id, start, end).event_count
+
+
+def _time(fn, session_factory, device_id: int, start: datetime, end: datetime) -> float:
+    db = session_factory()
+    try:
+        t0 = time.perf_counter()
+        fn(db, device_id, start, end)
+        return time.perf_counter() - t0
+    finally:
+        db.close()
+
+
+def _peak_mem(fn, session_factory, device_id: int, start: datetime, end: datetime) -> int:
+    # 单独一轮统计内存：tracemalloc 会显著拖慢耗时测量
+    db = session_factory()
+    try:
+        tracemalloc.start()
+        fn(db, device_id, start, end)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return peak
+    finally:
+        db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine, autoflush=False)
+        now = datetime.now(UTC)
+        with session_factory() as db:
+            d = Device(name="bench", type="sensor", owner_id=1)
+            db.add(d)
+            db.commit()
+            device_id = d.id
+            insert_events(
+                db,
+                [
+                    build_values(device_id, *_spec(i), now - timedelta(seconds=i % 240), now)
+                    for i in range(args.events)
+                ],
+            )
+        start, end = now - timedelta(minutes=5), now + timedelta(seconds=1)
+
+        for name, fn in (("orm", _orm), ("projection", _projection)):
+            _time(fn, session_factory, device_id, start, end)  # 预热
+            best = min(
+                _time(fn, session_factory, device_id, start, end) for _ in range(args.rounds)
+            )
+            peak = _peak_mem(fn, session_factory, device_id, start, end)
+            print(
+                f"{name:11s} events={args.events} best={best * 1000:8.1f}ms "
+                f"peak_mem={peak / 1024 / 1024:7.2f}MiB"
+            )
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
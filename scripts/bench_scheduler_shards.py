@@ -0,0 +1,94 @@
+"""
+多进程分片调度扩展性（见 backend/app/services/scheduler_shards.py）：
+合成设备群（每台设备窗口内若干 net_flow / auth_fail / command 事件），
+对每个进程数先跑一轮预热（进程启动 + 缓存预热），再计时 --rounds 轮完整调度，
+输出每轮墙钟时间与相对单进程的加速比。
+
+SQLite 下写入阶段跨进程串行，加速比上限取决于评分（读取 + 计算）在单轮中的占比；
+CPU 密集的评分（模型打分）越重，越接近按核数线性扩展。
+
+用法（项目根目录）：
+    python scripts/bench_scheduler_shards.py --devices 2000 --processes 1 2 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import UTC, datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from backend.app.db import create_db_engine  # noqa: E402
+from backend.app.models import Base, Device  # noqa: E402
+from backend.app.services.event_ingest import build_values, insert_events  # noqa: E402
+from backend.app.services.risk_config import risk_config  # noqa: E402
+from backend.app.services.scheduler_shards import ShardedPool  # noqa: E402
+
+
+def _seed(url: str, devices: int, events: int):
+    engine = create_db_engine(url)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine, autoflush=False)()
+    try:
+        rows = [Device(name=f"bench-{i}", type="sensor", owner_id=1) for i in range(devices)]
+        db.add_all(rows)
+        db.commit()
+        ids = [d.id for d in rows]
+        now = datetime.now(UTC)
+        specs = [
+            ("net_flow", {"bytes_out": 1500, "protocol": "mqtt"}),
+            ("auth_fail", {}),
+            ("command", {"cmd": "status"}),
+        ]
+        values = [
+            build_values(d, *specs[i % len(specs)], None, now) for d in ids for i in range(events)
+        ]
+        for i in range(0, len(values), 5000):
+            insert_events(db, values[i : i + 5000])
+        return ids
+    finally:
+        db.close()
+        engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=2000)
+    parser.add_argument("--events", type=int, default=6, help="events per device")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--chunk", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"cpu_count={os.cpu_count()} devices={args.devices} events/device={args.events}")
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'shards.db')}"
+        ids = _seed(url, args.devices, args.events)
+        cfg = risk_config.snapshot()
+        base = None
+        for n in args.processes:
+            pool = ShardedPool(n, url)
+            try:
+                pool.run(ids, cfg, args.chunk)  # 预热
+                t0 = time.perf_counter()
+                for _ in range(args.rounds):
+                    errors, _ = pool.run(ids, cfg, args.chunk)
+                per_round = (time.perf_counter() - t0) / args.rounds
+            finally:
+                pool.shutdown()
+            base = base or per_round
+            print(
+                f"processes={n:2d} round={per_round * 1000:8.1f}ms "
+                f"({len(ids) / per_round:7.0f} devices/s) speedup={base / per_round:4.2f}x "
+                f"errors={errors}"
+            )
+
+
+if __name__ == "__main__":
+    main()
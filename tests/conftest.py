@@ -14,6 +14,9 @@ ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
+# Tests start the scheduler explicitly; keep the app lifespan from autostarting it
+os.environ.setdefault("RISK_SCHEDULER_AUTOSTART", "0")
+
 from backend.app import auth  # to override get_current_user in tests
 
 # ------------------------------
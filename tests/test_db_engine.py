@@ -0,0 +1,31 @@
+import pytest
+
+from backend.app.db import create_db_engine, runtime_info
+
+
+def test_tuned_sqlite_profile_applies_pragmas(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'tuned.db'}", sqlite_profile="tuned")
+    try:
+        pragmas = runtime_info(engine)["pragmas"]
+        assert pragmas["journal_mode"] == "wal"
+        assert pragmas["synchronous"] == 1  # NORMAL
+        assert pragmas["busy_timeout"] == 5000
+        assert pragmas["temp_store"] == 2  # MEMORY
+        assert pragmas["cache_size"] == -65536
+    finally:
+        engine.dispose()
+
+
+def test_default_sqlite_profile_keeps_sqlite_defaults(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'plain.db'}", sqlite_profile="default")
+    try:
+        pragmas = runtime_info(engine)["pragmas"]
+        assert pragmas["journal_mode"] == "delete"
+        assert pragmas["synchronous"] == 2  # FULL
+    finally:
+        engine.dispose()
+
+
+def test_unknown_profile_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        create_db_engine(f"sqlite:///{tmp_path / 'x.db'}", sqlite_profile="turbo")
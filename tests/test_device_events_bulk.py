@@ -0,0 +1,127 @@
+import pytest
+from sqlalchemy.orm import Session
+
+from backend.app import auth
+from backend.app.main import app
+from backend.app.models import Device, DeviceEvent, DeviceProtocol
+
+
+@pytest.fixture
+def events_db(db_session: Session):
+    # device_events 路由使用 auth.get_db
+    app.dependency_overrides[auth.get_db] = lambda: db_session
+    yield db_session
+    app.dependency_overrides.pop(auth.get_db, None)
+
+
+def _device(db: Session) -> int:
+    d = Device(name="bulk-cam", type="camera", owner_id=1)
+    db.add(d)
+    db.commit()
+    db.refresh(d)
+    return d.id
+
+
+def test_bulk_ingest_echo_and_compact(client, as_admin, events_db: Session):
+    device_id = _device(events_db)
+    body = {
+        "events": [
+            {"event_type": "net_flow", "payload": {"bytes_out": 100, "protocol": "mqtt"}},
+            {"event_type": "auth_fail", "payload": {}},
+        ]
+    }
+
+    r = client.post(f"/devices/{device_id}/events", json=body)
+    assert r.status_code == 201, r.text
+    echoed = r.json()
+    assert [e["event_type"] for e in echoed] == ["net_flow", "auth_fail"]
+    assert echoed[1]["id"] == echoed[0]["id"] + 1
+    assert echoed[0]["payload"]["protocol"] == "mqtt"
+
+    body["events"] *= 50
+    r = client.post(f"/devices/{device_id}/events?echo=false", json=body)
+    assert r.status_code == 201, r.text
+    summary = r.json()
+    assert summary["ingested"] == 100
+    assert summary["first_id"] == echoed[1]["id"] + 1
+    assert summary["last_id"] - summary["first_id"] == 99
+
+    assert events_db.query(DeviceEvent).filter_by(device_id=device_id).count() == 102
+    # 派生索引与事件同一事务维护
+    assert events_db.query(DeviceProtocol).filter_by(device_id=device_id).count() == 1
+
+
+def test_ndjson_ingest_reports_line_errors(client, as_admin, events_db: Session, monkeypatch):
+    from backend.app.routers import device_events
+
+    monkeypatch.setattr(device_events, "NDJSON_CHUNK_SIZE", 2)
+    device_id = _device(events_db)
+    lines = [
+        '{"event_type": "auth_fail", "payload": {}}',
+        '{"event_type": "net_flow", "payload": {"bytes_out": 10, "protocol": "coap"}}',
+        "not json",
+        "",
+        '{"event_type": "unknown"}',
+        '{"event_type": "command", "payload": {"cmd": "ls"}}',
+    ]
+    r = client.post(
+        f"/devices/{device_id}/events/ndjson",
+        content="\n".join(lines).encode(),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert r.status_code == 201, r.text
+    summary = r.json()
+    assert (summary["lines"], summary["ingested"], summary["rejected"]) == (6, 3, 2)
+    assert summary["chunks"] == 2
+    assert [e["line"] for e in summary["errors"]] == [3, 5]
+    assert summary["last_id"] - summary["first_id"] == 2
+    assert events_db.query(DeviceEvent).filter_by(device_id=device_id).count() == 3
+
+    r = client.post(f"/devices/{device_id}/events/ndjson", json={"event_type": "auth_fail"})
+    assert r.status_code == 415
+
+
+def test_ndjson_rejects_long_lines_within_a_chunk(
+    client, as_admin, events_db: Session, monkeypatch
+):
+    from backend.app.routers import device_events
+
+    monkeypatch.setattr(device_events, "NDJSON_MAX_LINE_BYTES", 64)
+    device_id = _device(events_db)
+    ok = b'{"event_type": "auth_fail", "payload": {}}'
+    long = b'{"event_type": "command", "payload": {"cmd": "' + b"x" * 100 + b'"}}'
+    # 完整超长行与其它行在同一块内；跨块的超长尾部同样拒绝
+    parts = [ok + b"\n" + long + b"\n" + ok + b"\n" + long[:40], long[40:] + b"\n" + ok]
+
+    r = client.post(
+        f"/devices/{device_id}/events/ndjson",
+        content=iter(parts),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert r.status_code == 201, r.text
+    summary = r.json()
+    assert (summary["lines"], summary["ingested"], summary["rejected"]) == (5, 3, 2)
+    assert [e["line"] for e in summary["errors"]] == [2, 4]
+
+
+def test_ndjson_rejects_deeply_nested_lines(client, as_admin, events_db: Session):
+    device_id = _device(events_db)
+    ok = b'{"event_type": "auth_fail", "payload": {}}'
+    r = client.post(
+        f"/devices/{device_id}/events/ndjson",
+        content=ok + b"\n" + b"[" * 40000 + b"\n" + ok,
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert r.status_code == 201, r.text
+    summary = r.json()
+    assert (summary["lines"], summary["ingested"], summary["rejected"]) == (3, 2, 1)
+    assert summary["errors"] == [{"line": 2, "error": "line is nested too deeply"}]
+
+
+def test_ingest_accepts_non_string_protocol(client, as_admin, events_db: Session):
+    device_id = _device(events_db)
+    body = {"event_type": "net_flow", "payload": {"protocol": ["a"], "bytes_out": True}}
+
+    r = client.post(f"/devices/{device_id}/events", json=body)
+    assert r.status_code == 201, r.text
+    assert events_db.query(DeviceProtocol).filter_by(device_id=device_id).count() == 0
@@ -0,0 +1,134 @@
+from datetime import UTC, datetime
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import Session, sessionmaker
+
+from backend.app.models import Base, Device, DeviceEvent
+from backend.app.services import flow_rollup, risk_window
+from backend.app.services.event_columns import backfill, ensure_backfilled, ensure_columns
+from backend.app.services.event_ingest import build_values, insert_events
+
+
+def _device(db: Session) -> int:
+    d = Device(name="hot-cols", type="gateway", owner_id=1)
+    db.add(d)
+    db.commit()
+    db.refresh(d)
+    return d.id
+
+
+def test_ingest_populates_typed_columns(db_session: Session):
+    device_id = _device(db_session)
+    now = datetime.now(UTC)
+    orm = DeviceEvent(
+        device_id=device_id,
+        event_type="net_flow",
+        payload={"bytes_out": 1200, "protocol": "mqtt", "extra": [1]},
+        ts=now,
+    )
+    db_session.add(orm)
+    db_session.commit()
+    insert_events(
+        db_session,
+        [
+            build_values(device_id, "command", {"cmd": "reboot"}, None, now),
+            build_values(device_id, "net_flow", {"bytes_out": "big", "protocol": ""}, None, now),
+        ],
+    )
+
+    rows = db_session.query(DeviceEvent).order_by(DeviceEvent.id).all()
+    assert [(r.bytes_out, r.protocol, r.cmd) for r in rows] == [
+        (1200, "mqtt", None),
+        (None, None, "reboot"),
+        (None, None, None),
+    ]
+    # 原始 payload 保持不变
+    assert rows[0].payload == {"bytes_out": 1200, "protocol": "mqtt", "extra": [1]}
+
+
+def _legacy_engine(path):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for col in ("bytes_out", "protocol", "cmd"):
+            conn.execute(text(f"ALTER TABLE device_events DROP COLUMN {col}"))
+        conn.execute(
+            text(
+                "INSERT INTO device_events (device_id, event_type, ts, payload, ingested_at) "
+                "VALUES (1, 'net_flow', :ts, :p1, :ts), (1, 'command', :ts, :p2, :ts), "
+                "(1, 'auth_fail', :ts, :p3, :ts)"
+            ),
+            {
+                "ts": datetime.now(UTC),
+                "p1": '{"bytes_out": 5000, "protocol": "coap"}',
+                "p2": '{"cmd": "ls"}',
+                "p3": "{}",
+            },
+        )
+    return engine
+
+
+def test_ensure_columns_tolerates_concurrent_workers(tmp_path, monkeypatch):
+    from backend.app.services import event_columns
+
+    engine = _legacy_engine(tmp_path / "race.db")
+    # 本进程检查时列尚缺失，另一个 worker 抢先 ADD COLUMN
+    stale = inspect(engine)
+    stale.get_columns("device_events")
+    assert ensure_columns(engine) == ["bytes_out", "protocol", "cmd"]
+
+    real_inspect = event_columns.inspect
+    calls = []
+
+    def _inspect(bind):
+        calls.append(bind)
+        return stale if len(calls) == 1 else real_inspect(bind)
+
+    monkeypatch.setattr(event_columns, "inspect", _inspect)
+    assert ensure_columns(engine) == []
+    assert len(calls) > 1
+    engine.dispose()
+
+
+def test_migrate_and_backfill_legacy_table(tmp_path):
+    engine = _legacy_engine(tmp_path / "legacy.db")
+    assert ensure_columns(engine) == ["bytes_out", "protocol", "cmd"]
+    assert ensure_columns(engine) == []
+    assert {"bytes_out", "protocol", "cmd"} <= {
+        c["name"] for c in inspect(engine).get_columns("device_events")
+    }
+
+    db = sessionmaker(bind=engine)()
+    try:
+        assert backfill(db, batch_size=2) == 2
+        assert backfill(db) == 0
+        rows = db.query(DeviceEvent).order_by(DeviceEvent.id).all()
+        assert [(r.bytes_out, r.protocol, r.cmd) for r in rows] == [
+            (5000, "coap", None),
+            (None, None, "ls"),
+            (None, None, None),
+        ]
+    finally:
+        db.close()
+        engine.dispose()
+
+
+def test_startup_backfills_new_columns(tmp_path):
+    engine = _legacy_engine(tmp_path / "upgrade.db")
+    # 启动时刚补齐列：同步回填后评分即可读到历史协议 / 流量
+    assert ensure_backfilled(engine, ensure_columns(engine)) is None
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT bytes_out, protocol FROM device_events ORDER BY id"))
+        assert rows.first() == (5000, "coap")
+    engine.dispose()
+
+
+def test_derived_indexes_use_hot_column_rules():
+    odd = {"bytes_out": True, "protocol": ["a"], "cmd": {"x": 1}}
+    assert flow_rollup._flow_bytes("net_flow", odd) is None
+    buckets: dict = {}
+    risk_window._add(buckets, "net_flow", odd, datetime.now(UTC))
+    risk_window._add(buckets, "net_flow", {"protocol": "p" * 100}, datetime.now(UTC))
+    risk_window._add(buckets, "net_flow", {"protocol": 502, "bytes_out": 1.5}, datetime.now(UTC))
+    (b,) = buckets.values()
+    assert b.flow_peak == 1.5 and b.protocols == {"p" * 100, "502"}
@@ -0,0 +1,167 @@
+from datetime import UTC, date, datetime, timedelta
+
+import pytest
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+
+from backend.app.models import Device, DeviceEvent
+from backend.app.services import event_store
+from backend.app.services.event_ingest import build_values, insert_events
+from backend.app.services.risk_engine import compute_risk_for_device
+
+
+@pytest.fixture
+def partitioned(monkeypatch, db_session: Session):
+    monkeypatch.setattr(event_store, "ENABLED", True)
+    event_store.reset_cache()
+    yield
+    # conftest 的 drop_all 不包含分区表
+    event_store.drop_before(db_session, date.max)
+    event_store.reset_cache()
+
+
+def _device(db: Session, name: str) -> int:
+    d = Device(name=name, type="camera", owner_id=1)
+    db.add(d)
+    db.commit()
+    return d.id
+
+
+def _seed(db: Session, device_id: int, now: datetime) -> None:
+    recent = now - timedelta(minutes=1)
+    old = now - timedelta(hours=2)
+    events = [
+        ("net_flow", {"bytes_out": 1000, "protocol": "mqtt"}, old),
+        ("net_flow", {"bytes_out": 3000, "protocol": "mqtt"}, old),
+        ("net_flow", {"bytes_out": 30000, "protocol": "mqtt"}, recent),
+        ("net_flow", {"bytes_out": 12000, "protocol": "coap"}, recent),
+        ("command", {"cmd": "factory_reset"}, recent),
+    ]
+    events += [("auth_fail", {}, recent)] * 5
+    insert_events(db, [build_values(device_id, t, p, ts, now) for t, p, ts in events])
+
+
+def _table_names(db: Session):
+    return set(inspect(db.connection()).get_table_names())
+
+
+def test_ingest_routes_to_day_tables(db_session: Session, partitioned):
+    device_id = _device(db_session, "part-cam")
+    now = datetime.now(UTC)
+    old = now - timedelta(days=3)
+    records = insert_events(
+        db_session,
+        [
+            build_values(device_id, "auth_fail", {}, now, now),
+            build_values(device_id, "net_flow", {"bytes_out": 10}, old, now),
+            build_values(device_id, "auth_fail", {}, now, now),
+        ],
+    )
+    ids = [r.id for r in records]
+    assert ids == sorted(ids) and len(set(ids)) == 3
+
+    names = _table_names(db_session)
+    assert event_store.partition_name(now.date()) in names
+    assert event_store.partition_name(old.date()) in names
+    assert db_session.query(DeviceEvent).count() == 0
+    assert event_store.max_ids(db_session, [device_id]) == {device_id: ids[-1]}
+
+    # 后续批次的 id 继续递增
+    more = insert_events(db_session, [build_values(device_id, "auth_fail", {}, now, now)])
+    assert more[0].id > ids[-1]
+
+
+def test_partitioned_score_matches_single_table(db_session: Session, monkeypatch):
+    now = datetime.now(UTC)
+    plain = _device(db_session, "plain-cam")
+    _seed(db_session, plain, now)
+    expected = compute_risk_for_device(db_session, plain, aggregate=True)
+
+    monkeypatch.setattr(event_store, "ENABLED", True)
+    event_store.reset_cache()
+    try:
+        routed = _device(db_session, "part-cam")
+        _seed(db_session, routed, now)
+        for aggregate in (True, False):
+            rs = compute_risk_for_device(db_session, routed, aggregate=aggregate)
+            assert rs.score == expected.score
+            assert rs.level == expected.level
+            assert sorted(r["metric"] for r in rs.reasons) == sorted(
+                r["metric"] for r in expected.reasons
+            )
+    finally:
+        event_store.drop_before(db_session, date.max)
+        event_store.reset_cache()
+
+
+def test_source_prunes_partitions(db_session: Session, partitioned):
+    device_id = _device(db_session, "prune-cam")
+    noon = datetime.now(UTC).replace(hour=12, minute=0, second=0, microsecond=0)
+    insert_events(
+        db_session,
+        [
+            build_values(device_id, "auth_fail", {}, noon - timedelta(days=k), noon)
+            for k in range(4)
+        ],
+    )
+    today = event_store.partition_name(noon.date())
+    yesterday = event_store.partition_name((noon - timedelta(days=1)).date())
+    older = event_store.partition_name((noon - timedelta(days=2)).date())
+
+    window = event_store.source(db_session, noon - timedelta(minutes=5), noon)
+    assert window.name == today
+
+    baseline = str(event_store.source(db_session, noon - timedelta(hours=24), noon).compile())
+    assert today in baseline and yesterday in baseline
+    assert older not in baseline
+
+
+def test_source_sees_partitions_created_by_other_workers(db_session: Session, partitioned):
+    device_id = _device(db_session, "peer-cam")
+    now = datetime.now(UTC)
+    yesterday = now - timedelta(days=1)
+    insert_events(db_session, [build_values(device_id, "auth_fail", {}, yesterday, now)])
+    assert event_store.partition_days(db_session) == [yesterday.date()]
+
+    # 另一个 worker 建了今天的分区并写入：本进程缓存未过期，但查询范围包含该日期
+    event_store.partition_table(now.date()).create(bind=db_session.connection())
+    table = event_store.partition_table(now.date())
+    db_session.execute(
+        table.insert().values(
+            id=10**6, device_id=device_id, event_type="auth_fail", ts=now, ingested_at=now
+        )
+    )
+
+    window = event_store.source(db_session, now - timedelta(minutes=5), now + timedelta(seconds=1))
+    assert window.name == event_store.partition_name(now.date())
+    assert event_store.partition_days(db_session) == [yesterday.date(), now.date()]
+
+
+def test_drop_before_and_migrate_legacy(db_session: Session, monkeypatch):
+    device_id = _device(db_session, "legacy-cam")
+    now = datetime.now(UTC)
+    old = now - timedelta(days=10)
+    legacy = insert_events(
+        db_session,
+        [
+            build_values(device_id, "auth_fail", {}, old, now),
+            build_values(device_id, "net_flow", {"bytes_out": 5}, now, now),
+        ],
+    )
+
+    monkeypatch.setattr(event_store, "ENABLED", True)
+    event_store.reset_cache()
+    try:
+        assert event_store.migrate_legacy(db_session) == 2
+        assert db_session.query(DeviceEvent).count() == 0
+        assert event_store.max_ids(db_session, [device_id]) == {device_id: legacy[-1].id}
+        fresh = insert_events(db_session, [build_values(device_id, "auth_fail", {}, now, now)])
+        assert fresh[0].id > legacy[-1].id
+
+        dropped = event_store.drop_before(db_session, now.date() - timedelta(days=1))
+        assert dropped == [event_store.partition_name(old.date())]
+        assert event_store.partition_name(old.date()) not in _table_names(db_session)
+        assert event_store.partition_days(db_session) == [now.date()]
+    finally:
+        event_store.drop_before(db_session, date.max)
+        event_store.reset_cache()
@@ -0,0 +1,75 @@
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from backend.app.models import Device, DeviceEvent, DeviceFlowRollup
+from backend.app.services import flow_rollup
+from backend.app.services.event_ingest import persist_events
+
+
+def _raw_mean(db: Session, device_id: int, start: datetime, end: datetime) -> float:
+    vals = []
+    for e in db.query(DeviceEvent).filter(
+        DeviceEvent.device_id == device_id,
+        DeviceEvent.event_type == "net_flow",
+        DeviceEvent.ts >= start,
+        DeviceEvent.ts < end,
+    ):
+        v = (e.payload or {}).get("bytes_out", 0)
+        if v > 0:
+            vals.append(v)
+    return (sum(vals) / len(vals)) if vals else 0
+
+
+def _seed(db: Session) -> int:
+    d = Device(name="rollup-gw", type="gateway", owner_id=1)
+    db.add(d)
+    db.commit()
+    db.refresh(d)
+
+    now = datetime.now(UTC)
+    rows = []
+    # 每 17 分钟一条，覆盖 26 小时，包含不足整点的头尾
+    for i in range(26 * 60 // 17):
+        rows.append(
+            DeviceEvent(
+                device_id=d.id,
+                event_type="net_flow",
+                payload={"bytes_out": 100 + (i * 37) % 900, "protocol": "mqtt"},
+                ts=now - timedelta(minutes=17 * i),
+            )
+        )
+    rows.append(
+        DeviceEvent(device_id=d.id, event_type="net_flow", payload={"bytes_out": 0}, ts=now)
+    )
+    persist_events(db, rows)
+    return d.id
+
+
+def test_hist_mean_matches_raw_rows(db_session: Session):
+    device_id = _seed(db_session)
+    window_end = datetime.now(UTC)
+    window_start = window_end - timedelta(minutes=5)
+    day_ago = window_end - timedelta(hours=24)
+
+    expected = _raw_mean(db_session, device_id, day_ago, window_start)
+    assert expected > 0
+    assert flow_rollup.hist_mean(db_session, device_id, day_ago, window_start) == expected
+
+    buckets = db_session.query(DeviceFlowRollup).filter_by(device_id=device_id).count()
+    assert 24 <= buckets <= 28
+
+
+def test_rebuild_reproduces_ingest_buckets(db_session: Session):
+    device_id = _seed(db_session)
+
+    def snapshot():
+        return sorted(
+            (r.bucket_start, r.bytes_sum, r.flow_count, r.bytes_max)
+            for r in db_session.query(DeviceFlowRollup).filter_by(device_id=device_id)
+        )
+
+    before = snapshot()
+    assert flow_rollup.rebuild(db_session, [device_id]) == len(before)
+    db_session.expire_all()
+    assert snapshot() == before
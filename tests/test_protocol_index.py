@@ -0,0 +1,81 @@
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from backend.app.models import Device, DeviceEvent, DeviceProtocol
+from backend.app.services import protocol_index
+from backend.app.services.event_ingest import persist_events
+
+
+def _device(db: Session, name: str) -> int:
+    d = Device(name=name, type="camera", owner_id=1)
+    db.add(d)
+    db.commit()
+    db.refresh(d)
+    return d.id
+
+
+def _flow(device_id: int, proto: str, ts: datetime) -> DeviceEvent:
+    return DeviceEvent(
+        device_id=device_id, event_type="net_flow", payload={"protocol": proto}, ts=ts
+    )
+
+
+def test_ingest_maintains_earliest_first_seen(db_session: Session):
+    device_id = _device(db_session, "proto-a")
+    now = datetime.now(UTC)
+
+    persist_events(db_session, [_flow(device_id, "mqtt", now - timedelta(minutes=1))])
+    # 补录更早的事件应把 first_seen 前移
+    persist_events(db_session, [_flow(device_id, "mqtt", now - timedelta(hours=3))])
+    persist_events(db_session, [_flow(device_id, "mqtt", now)])
+
+    rows = db_session.query(DeviceProtocol).filter_by(device_id=device_id).all()
+    assert len(rows) == 1
+    assert rows[0].first_seen.replace(tzinfo=UTC) == now - timedelta(hours=3)
+
+    window_start = now - timedelta(minutes=5)
+    assert protocol_index.new_protocols(db_session, device_id, {"mqtt"}, window_start) == set()
+    assert protocol_index.new_protocols(db_session, device_id, {"mqtt", "coap"}, window_start) == {
+        "coap"
+    }
+
+
+def test_protocol_first_seen_inside_window_is_new(db_session: Session):
+    device_id = _device(db_session, "proto-b")
+    now = datetime.now(UTC)
+    persist_events(db_session, [_flow(device_id, "http", now - timedelta(minutes=1))])
+
+    window_start = now - timedelta(minutes=5)
+    assert protocol_index.new_protocols(db_session, device_id, {"http"}, window_start) == {"http"}
+
+
+def test_rebuild_from_existing_events(db_session: Session):
+    device_id = _device(db_session, "proto-c")
+    old = datetime.now(UTC) - timedelta(days=2)
+    # 直接写事件表，模拟索引上线前的历史数据
+    db_session.add_all([_flow(device_id, "mqtt", old), _flow(device_id, "coap", old)])
+    db_session.add(DeviceEvent(device_id=device_id, event_type="net_flow", payload={}, ts=old))
+    db_session.commit()
+    protocol_index.invalidate()
+
+    assert protocol_index.rebuild(db_session) == 2
+    protos = {r.protocol for r in db_session.query(DeviceProtocol).filter_by(device_id=device_id)}
+    assert protos == {"mqtt", "coap"}
+
+
+def test_only_hot_column_protocols_are_indexed(db_session: Session):
+    device_id = _device(db_session, "proto-odd")
+    now = datetime.now(UTC)
+    long_proto = "x" * 100
+    events = [
+        DeviceEvent(
+            device_id=device_id, event_type="net_flow", payload={"protocol": ["a"]}, ts=now
+        ),
+        _flow(device_id, long_proto, now),
+    ]
+    persist_events(db_session, events)
+
+    rows = db_session.query(DeviceProtocol.protocol).filter_by(device_id=device_id).all()
+    # 非标量协议不入索引；超长协议保留完整值，与 device_events.protocol 一致
+    assert [p for (p,) in rows] == [long_proto]
@@ -0,0 +1,84 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import Session
+
+from backend.app import auth
+from backend.app.main import app
+from backend.app.models import Base
+from backend.app.services import query_plans
+
+
+@pytest.mark.parametrize("name", sorted(query_plans.HOT_QUERIES))
+def test_hot_query_uses_index(db_session: Session, name: str):
+    res = query_plans.explain(db_session, name)
+    assert res["plan"], res
+    assert res["scans"] == [], res["plan"]
+    assert res["uses_expected_index"], res["plan"]
+
+
+def test_ensure_indexes_upgrades_existing_tables(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_device_events_device_type_ts"))
+        conn.execute(text("DROP INDEX ix_risk_actions_device_action"))
+        conn.execute(text("CREATE INDEX ix_device_events_event_type ON device_events (event_type)"))
+
+    changed = query_plans.ensure_indexes(engine)
+    assert sorted(changed) == [
+        "ix_device_events_device_type_ts",
+        "ix_device_events_event_type",
+        "ix_risk_actions_device_action",
+    ]
+    names = {ix["name"] for ix in inspect(engine).get_indexes("device_events")}
+    assert "ix_device_events_device_type_ts" in names
+    assert "ix_device_events_event_type" not in names
+    assert query_plans.ensure_indexes(engine) == []
+    engine.dispose()
+
+
+class _Snapshot:
+    """
+    固定某一时刻的索引列表，模拟检查之后被其它 worker 抢先补建的情况。
+    """
+
+    def __init__(self, engine):
+        insp = inspect(engine)
+        self.indexes = {t: insp.get_indexes(t) for t in insp.get_table_names()}
+
+    def has_table(self, name):
+        return name in self.indexes
+
+    def get_indexes(self, name):
+        return self.indexes[name]
+
+
+def test_ensure_indexes_tolerates_concurrent_workers(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'race.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_device_events_device_type_ts"))
+        conn.execute(text("CREATE INDEX ix_device_events_event_type ON device_events (event_type)"))
+    stale = _Snapshot(engine)
+    assert query_plans.ensure_indexes(engine)
+
+    monkeypatch.setattr(query_plans, "inspect", lambda _: stale)
+    query_plans.ensure_indexes(engine)
+    monkeypatch.undo()
+    names = {ix["name"] for ix in inspect(engine).get_indexes("device_events")}
+    assert "ix_device_events_device_type_ts" in names
+    assert "ix_device_events_event_type" not in names
+    engine.dispose()
+
+
+def test_query_plans_endpoint(client, as_admin, db_session: Session):
+    # 调度器管理路由使用 auth.get_db
+    app.dependency_overrides[auth.get_db] = lambda: db_session
+    try:
+        r = client.get("/risk/scheduler/query-plans")
+    finally:
+        app.dependency_overrides.pop(auth.get_db, None)
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body["dialect"] == "sqlite" and body["ok"] is True
+    assert {q["name"] for q in body["queries"]} == set(query_plans.HOT_QUERIES)
@@ -0,0 +1,157 @@
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from backend.app.models import Device, DeviceLog, JobLease, RiskAction, RiskScore, RiskScoreHourly
+from backend.app.routers import risk_scheduler_admin
+from backend.app.services import retention
+from backend.app.services.scheduler_lease import claim_job
+
+
+def _device(db: Session) -> int:
+    d = Device(name="ret-cam", type="camera", owner_id=1)
+    db.add(d)
+    db.commit()
+    return d.id
+
+
+def _score(device_id: int, end: datetime, score: float, level: str) -> RiskScore:
+    return RiskScore(
+        device_id=device_id,
+        window_start=end - timedelta(minutes=5),
+        window_end=end,
+        score=score,
+        level=level,
+        reasons=[],
+    )
+
+
+def test_scores_downsampled_into_hourly_buckets(db_session: Session):
+    device_id = _device(db_session)
+    now = datetime.now(UTC)
+    hour = (now - timedelta(days=10)).replace(minute=0, second=0, microsecond=0)
+    db_session.add_all(
+        [
+            _score(device_id, hour + timedelta(minutes=1), 10, "low"),
+            _score(device_id, hour + timedelta(minutes=20), 50, "medium"),
+            _score(device_id, hour + timedelta(minutes=40), 90, "high"),
+            _score(device_id, hour + timedelta(hours=1, minutes=5), 20, "low"),
+            _score(device_id, now - timedelta(minutes=1), 30, "low"),
+        ]
+    )
+    db_session.commit()
+
+    # 每批 2 行：第一个小时跨两批，验证同一桶的合并
+    report = retention.run_retention(db_session, now=now, batch_size=2, pause_ms=0)
+    assert report["risk_scores"] == 4
+    assert report["batches"] >= 2
+    assert db_session.query(RiskScore).count() == 1
+
+    buckets = db_session.query(RiskScoreHourly).order_by(RiskScoreHourly.bucket_start).all()
+    assert len(buckets) == 2
+    first, second = buckets
+    assert first.score_count == 3
+    assert (first.score_min, first.score_max, first.score_avg) == (10, 90, 50)
+    assert first.level_counts == {"low": 1, "medium": 1, "high": 1}
+    assert second.score_count == 1 and second.level_counts == {"low": 1}
+
+
+def test_scores_referenced_by_actions_are_kept(db_session: Session):
+    device_id = _device(db_session)
+    now = datetime.now(UTC)
+    old = now - timedelta(days=10)
+    kept, dropped = _score(device_id, old, 90, "high"), _score(device_id, old, 10, "low")
+    db_session.add_all([kept, dropped])
+    db_session.flush()
+    db_session.add(
+        RiskAction(device_id=device_id, score_id=kept.id, action_type="isolate", executed=True)
+    )
+    db_session.commit()
+    kept_id = kept.id
+
+    report = retention.run_retention(db_session, now=now, pause_ms=0)
+    assert report["risk_scores"] == 1
+    assert [s.id for s in db_session.query(RiskScore)] == [kept_id]
+    action = db_session.query(RiskAction).one()
+    assert action.score_id == kept_id and action.score is not None
+    assert db_session.query(RiskScoreHourly).one().level_counts == {"low": 1}
+
+
+def test_run_skipped_while_another_process_holds_the_lease(db_session: Session):
+    device_id = _device(db_session)
+    now = datetime.now(UTC)
+    db_session.add(_score(device_id, now - timedelta(days=10), 10, "low"))
+    db_session.commit()
+
+    assert claim_job(db_session, retention.LOCK_NAME, "other-node", 60)
+    with pytest.raises(RuntimeError):
+        retention.run_retention(db_session, now=now, pause_ms=0)
+    assert db_session.query(RiskScore).count() == 1
+
+    # 持有者失联、租约过期后可接管
+    assert claim_job(
+        db_session, retention.LOCK_NAME, "other-node", 60, now=now - timedelta(minutes=2)
+    )
+    assert retention.run_retention(db_session, now=now, pause_ms=0)["risk_scores"] == 1
+    assert db_session.query(JobLease).one().owner is None
+
+
+def test_run_stops_when_lease_is_lost(db_session: Session, monkeypatch):
+    device_id = _device(db_session)
+    now = datetime.now(UTC)
+    db_session.add_all([_score(device_id, now - timedelta(days=10), 10, "low") for _ in range(3)])
+    db_session.commit()
+
+    claims = iter([True, False])
+    monkeypatch.setattr(retention, "claim_job", lambda *a, **kw: next(claims, False))
+    report = retention.run_retention(db_session, now=now, batch_size=1, pause_ms=0)
+    assert report["lease_lost"] is True
+    assert report["risk_scores"] == 1
+    assert db_session.query(RiskScoreHourly).one().score_count == 1
+
+
+def test_log_ttls_per_type(db_session: Session):
+    device_id = _device(db_session)
+    now = datetime.now(UTC)
+    db_session.add_all(
+        [
+            DeviceLog(
+                device_id=device_id,
+                log_type="risk_eval",
+                message="old",
+                timestamp=now - timedelta(days=10),
+            ),
+            DeviceLog(device_id=device_id, log_type="risk_eval", message="new", timestamp=now),
+            DeviceLog(
+                device_id=device_id,
+                log_type="risk_alert",
+                message="keep",
+                timestamp=now - timedelta(days=10),
+            ),
+            DeviceLog(
+                device_id=device_id,
+                log_type="risk_alert",
+                message="old",
+                timestamp=now - timedelta(days=100),
+            ),
+        ]
+    )
+    db_session.commit()
+
+    report = retention.run_retention(db_session, now=now, pause_ms=0)
+    assert report["eval_logs"] == 1
+    assert report["device_logs"] == 1
+    left = sorted((r.log_type, r.message) for r in db_session.query(DeviceLog))
+    assert left == [("risk_alert", "keep"), ("risk_eval", "new")]
+
+
+def test_run_endpoint_rejects_concurrent_run(db_session: Session):
+    out = risk_scheduler_admin.retention_run(db=db_session, admin=None)
+    assert out["ran"] is True
+
+    with retention._run_lock:
+        with pytest.raises(HTTPException) as exc:
+            risk_scheduler_admin.retention_run(db=db_session, admin=None)
+    assert exc.value.status_code == 409
@@ -0,0 +1,46 @@
+import pytest
+
+from backend.app.services.risk_config import RiskConfig
+
+
+def test_snapshot_is_frozen_and_versioned(tmp_path):
+    rc = RiskConfig(str(tmp_path / "risk_config.json"))
+    snap = rc.snapshot()
+
+    # 读取不拷贝：同一版本返回同一对象
+    assert rc.snapshot() is snap
+    with pytest.raises(TypeError):
+        snap["weights"]["flow_spike"] = 0
+    assert isinstance(snap["auto_response"]["restore"]["allow_levels"], tuple)
+
+    rc.merge({"weights": {"flow_spike": 45}})
+    new = rc.snapshot()
+    assert new.version == snap.version + 1
+    assert new["weights"]["flow_spike"] == 45
+    # 已被持有的旧快照不受影响
+    assert snap["weights"]["flow_spike"] == 30
+
+    # get() 仍返回可修改的独立副本
+    cfg = rc.get()
+    cfg["weights"]["flow_spike"] = 1
+    assert rc.snapshot()["weights"]["flow_spike"] == 45
+    assert cfg["auto_response"]["restore"]["allow_levels"] == ["low", "medium"]
+
+
+def test_reload_propagates_between_workers(tmp_path):
+    path = str(tmp_path / "risk_config.json")
+    worker_a, worker_b = RiskConfig(path), RiskConfig(path)
+    assert worker_b.reload_if_changed() is False
+
+    worker_a.merge({"weights": {"new_protocol": 12}})
+    assert worker_b.snapshot()["weights"]["new_protocol"] == 10
+    assert worker_b.reload_if_changed() is True
+    assert worker_b.snapshot()["weights"]["new_protocol"] == 12
+    assert worker_b.snapshot().digest == worker_a.snapshot().digest
+    assert worker_b.reload_if_changed() is False
+
+    # 写到一半 / 非法的文件不会替换当前快照
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"weights": ')
+    assert worker_b.reload_if_changed() is False
+    assert worker_b.snapshot()["weights"]["new_protocol"] == 12
@@ -0,0 +1,136 @@
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from backend.app.models import Device, DeviceEvent
+from backend.app.services.event_ingest import persist_events
+from backend.app.services.risk_engine import compute_risk_for_device
+
+
+def _seed(db: Session) -> int:
+    d = Device(name="agg-camera", type="camera", owner_id=1)
+    db.add(d)
+    db.commit()
+    db.refresh(d)
+
+    now = datetime.now(UTC)
+    recent = now - timedelta(minutes=1)
+    old = now - timedelta(hours=2)
+    events = [
+        ("net_flow", {"bytes_out": 1000, "protocol": "mqtt"}, old),
+        ("net_flow", {"bytes_out": 3000, "protocol": "mqtt"}, old),
+        ("net_flow", {"bytes_out": 0, "protocol": "http"}, old),
+    ]
+    events += [("auth_fail", {}, recent)] * 5
+    events += [
+        ("auth_success", {}, recent),
+        ("policy_violation", {"rule": "block-telnet"}, recent),
+        ("policy_violation", {"rule": "block-ssh"}, recent),
+        ("net_flow", {"bytes_out": 30000, "protocol": "mqtt"}, recent),
+        ("net_flow", {"bytes_out": 12000, "protocol": "coap"}, recent),
+        ("net_flow", {"protocol": "http"}, recent),
+        ("command", {"cmd": "factory_reset"}, recent),
+        ("command", {"cmd": "ls"}, recent),
+        ("command", {"cmd": "reboot"}, recent),
+        ("command", {}, recent),
+    ]
+    persist_events(
+        db,
+        [
+            DeviceEvent(device_id=d.id, event_type=event_type, payload=payload, ts=ts)
+            for event_type, payload, ts in events
+        ],
+    )
+    return d.id
+
+
+def _normalized(reasons):
+    out = []
+    for r in reasons:
+        r = dict(r)
+        if "protocols" in r:
+            r["protocols"] = sorted(r["protocols"])
+        out.append(r)
+    return out
+
+
+def test_aggregate_matches_row_path(db_session: Session):
+    device_id = _seed(db_session)
+
+    rows = compute_risk_for_device(db_session, device_id, aggregate=False)
+    agg = compute_risk_for_device(db_session, device_id, aggregate=True)
+
+    assert agg.score == rows.score
+    assert agg.level == rows.level
+    assert _normalized(agg.reasons) == _normalized(rows.reasons)
+
+    metrics = {r["metric"]: r for r in agg.reasons}
+    assert metrics["flow_spike"]["peak"] == 30000
+    assert metrics["flow_spike"]["hist_mean"] == 2000
+    assert sorted(metrics["new_protocol"]["protocols"]) == ["coap"]
+    assert metrics["command_anomaly"]["cmds"] == ["factory_reset", "reboot"]
+
+
+def test_hot_columns_keep_payload_semantics(db_session: Session):
+    d = Device(name="agg-odd", type="camera", owner_id=1)
+    db_session.add(d)
+    db_session.commit()
+    now = datetime.now(UTC)
+    recent, old = now - timedelta(minutes=1), now - timedelta(hours=2)
+    long_a, long_b = "x" * 100 + "a", "x" * 100 + "b"
+    cmd_a, cmd_b = "y" * 300 + "1", "y" * 300 + "2"
+    events = [
+        ("net_flow", {"bytes_out": 1000.5, "protocol": long_a}, old),
+        ("net_flow", {"bytes_out": 3000, "protocol": 1883}, old),
+        ("net_flow", {"bytes_out": 25000.5, "protocol": long_b}, recent),
+        ("net_flow", {"bytes_out": 10, "protocol": 1883}, recent),
+        ("net_flow", {"protocol": 502}, recent),
+        ("command", {"cmd": cmd_a}, recent),
+        ("command", {"cmd": cmd_b}, recent),
+        ("command", {"cmd": 7}, recent),
+    ]
+    persist_events(
+        db_session,
+        [DeviceEvent(device_id=d.id, event_type=t, payload=p, ts=ts) for t, p, ts in events],
+    )
+
+    rows = compute_risk_for_device(db_session, d.id, aggregate=False)
+    agg = compute_risk_for_device(db_session, d.id, aggregate=True)
+    assert agg.score == rows.score
+    assert _normalized(agg.reasons) == _normalized(rows.reasons)
+
+    # 与直接读取 payload 的结果一致：浮点流量不取整、超长值不截断、非字符串标量按 str() 参与
+    metrics = {r["metric"]: r for r in agg.reasons}
+    assert metrics["flow_spike"]["peak"] == 25000.5
+    assert metrics["flow_spike"]["hist_mean"] == 2000.25
+    assert sorted(metrics["new_protocol"]["protocols"]) == ["502", long_b]
+    assert sorted(metrics["command_anomaly"]["cmds"]) == sorted([cmd_a, cmd_b, "7"])
+
+
+def test_aggregate_empty_window(db_session: Session):
+    d = Device(name="agg-idle", type="sensor", owner_id=1)
+    db_session.add(d)
+    db_session.commit()
+
+    rs = compute_risk_for_device(db_session, d.id, aggregate=True)
+    assert rs.score == 0
+    assert rs.level == "low"
+    assert rs.reasons == []
+
+
+def test_row_path_does_not_hydrate_events(db_session: Session):
+    device_id = _seed(db_session)
+    loaded = []
+
+    def _on_load(target, context):
+        loaded.append(type(target).__name__)
+
+    event.listen(DeviceEvent, "load", _on_load)
+    event.listen(Device, "load", _on_load)
+    try:
+        compute_risk_for_device(db_session, device_id, aggregate=False)
+    finally:
+        event.remove(DeviceEvent, "load", _on_load)
+        event.remove(Device, "load", _on_load)
+    assert loaded == []
@@ -0,0 +1,94 @@
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from backend.app.models import Device, DeviceEvent, RiskAction, RiskScore
+from backend.app.services import risk_engine
+from backend.app.services.event_ingest import persist_events
+from backend.app.services.risk_config import ConfigSnapshot
+
+
+def _device(db: Session, name: str) -> int:
+    d = Device(name=name, type="camera", owner_id=1)
+    db.add(d)
+    db.commit()
+    db.refresh(d)
+    return d.id
+
+
+def _events(device_id: int, spec, ts: datetime):
+    return [DeviceEvent(device_id=device_id, event_type=t, payload=p, ts=ts) for t, p in spec]
+
+
+HIGH = [("auth_fail", {})] * 5 + [
+    ("policy_violation", {"rule": "block-telnet"}),
+    ("net_flow", {"bytes_out": 30000, "protocol": "mqtt"}),
+    ("command", {"cmd": "factory_reset"}),
+]
+MEDIUM = [("net_flow", {"bytes_out": 9000, "protocol": "coap"}), ("command", {"cmd": "reboot"})]
+
+
+def test_batch_matches_single_device_path(db_session: Session):
+    now = datetime.now(UTC)
+    recent = now - timedelta(minutes=1)
+    ids = [_device(db_session, f"batch-{i}") for i in range(4)]
+    persist_events(db_session, _events(ids[0], HIGH, recent))
+    persist_events(db_session, _events(ids[1], MEDIUM, recent))
+    persist_events(
+        db_session,
+        _events(
+            ids[2],
+            [("net_flow", {"bytes_out": 1000, "protocol": "mqtt"})],
+            now - timedelta(hours=3),
+        )
+        + _events(ids[2], [("net_flow", {"bytes_out": 20000, "protocol": "mqtt"})], recent),
+    )
+    # ids[3] 无事件
+
+    batch = {r["device_id"]: r for r in risk_engine.evaluate_devices_batch(db_session, ids)}
+    assert set(batch) == set(ids)
+    assert batch[ids[0]]["level"] == "high"
+    assert batch[ids[0]]["actions"] == ["isolate"]
+    assert batch[ids[3]]["score"] == 0
+
+    for device_id in ids:
+        single = risk_engine.compute_risk_for_device(db_session, device_id, aggregate=False)
+        assert single.score == batch[device_id]["score"]
+        assert single.level == batch[device_id]["level"]
+        stored = db_session.get(RiskScore, batch[device_id]["score_id"])
+        assert stored.reasons == single.reasons
+
+    isolates = db_session.query(RiskAction).filter_by(action_type="isolate").all()
+    # 批量已隔离，单设备路径不应重复隔离
+    assert [a.device_id for a in isolates] == [ids[0]]
+
+
+def test_batch_auto_restore_after_cooldown(db_session: Session, monkeypatch):
+    cfg = risk_engine.risk_config.get()
+    cfg["auto_response"]["restore"].update(
+        {"enabled": True, "min_consecutive_non_high": 2, "cooldown_seconds": 60}
+    )
+    monkeypatch.setattr(risk_engine.risk_config, "snapshot", lambda: ConfigSnapshot(cfg))
+
+    device_id = _device(db_session, "batch-restore")
+    long_ago = datetime.now(UTC) - timedelta(hours=1)
+    db_session.add(
+        RiskAction(device_id=device_id, action_type="isolate", executed=True, created_at=long_ago)
+    )
+    db_session.add(
+        RiskScore(
+            device_id=device_id,
+            window_start=long_ago,
+            window_end=long_ago,
+            score=0,
+            level="low",
+            reasons=[],
+        )
+    )
+    db_session.commit()
+
+    (res,) = risk_engine.evaluate_devices_batch(db_session, [device_id])
+    assert res["actions"] == ["restore"]
+
+    (res2,) = risk_engine.evaluate_devices_batch(db_session, [device_id])
+    assert res2["actions"] == []
@@ -0,0 +1,74 @@
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from backend.app.models import Device, DeviceEvent, DeviceLog, RiskAction
+from backend.app.services import risk_engine
+from backend.app.services.event_ingest import persist_events
+
+
+def _high_risk_device(db: Session) -> int:
+    d = Device(name="tx-camera", type="camera", owner_id=1)
+    db.add(d)
+    db.commit()
+    db.refresh(d)
+    recent = datetime.now(UTC) - timedelta(minutes=1)
+    spec = [("auth_fail", {})] * 5 + [
+        ("policy_violation", {"rule": "block-telnet"}),
+        ("net_flow", {"bytes_out": 30000, "protocol": "mqtt"}),
+        ("command", {"cmd": "factory_reset"}),
+    ]
+    persist_events(
+        db, [DeviceEvent(device_id=d.id, event_type=t, payload=p, ts=recent) for t, p in spec]
+    )
+    return d.id
+
+
+def _count_commits(db: Session):
+    commits = []
+    event.listen(db, "after_commit", lambda s: commits.append(1))
+    return commits
+
+
+def test_single_commit_per_evaluation(db_session: Session, monkeypatch):
+    monkeypatch.setattr(risk_engine, "RISK_SINGLE_TRANSACTION", True)
+    device_id = _high_risk_device(db_session)
+    commits = _count_commits(db_session)
+
+    rs = risk_engine.compute_risk_for_device(db_session, device_id)
+    assert rs.level == "high"
+    assert len(commits) == 1
+    act = db_session.query(RiskAction).filter_by(device_id=device_id).one()
+    assert (act.action_type, act.score_id) == ("isolate", rs.id)
+
+
+def test_caller_managed_transaction(db_session: Session):
+    device_id = _high_risk_device(db_session)
+    commits = _count_commits(db_session)
+
+    rs = risk_engine.evaluate_device_risk(db_session, device_id, commit=False)
+    assert rs.id is not None
+    assert commits == []
+
+    # 调用方回滚：评分、日志、隔离动作一并丢弃
+    db_session.rollback()
+    assert db_session.query(RiskAction).filter_by(device_id=device_id).count() == 0
+    assert (
+        db_session.query(DeviceLog).filter_by(device_id=device_id, log_type="risk_alert").count()
+        == 0
+    )
+
+
+def test_isolation_visible_within_caller_transaction(db_session: Session):
+    # 会话 autoflush=False：同一事务内第二次评估必须看到第一次写入的隔离动作
+    assert db_session.autoflush is False
+    device_id = _high_risk_device(db_session)
+
+    risk_engine.evaluate_device_risk(db_session, device_id, commit=False)
+    assert risk_engine._is_device_isolated(db_session, device_id)
+    risk_engine.evaluate_device_risk(db_session, device_id, commit=False)
+    db_session.commit()
+
+    actions = db_session.query(RiskAction).filter_by(device_id=device_id).all()
+    assert [a.action_type for a in actions] == ["isolate"]
@@ -0,0 +1,60 @@
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from backend.app.models import Device, DeviceEvent
+from backend.app.services import risk_engine, risk_metrics
+from backend.app.services.event_ingest import persist_events
+from backend.app.services.risk_config import ConfigSnapshot
+
+
+def _seed(db: Session) -> int:
+    d = Device(name="metric-cam", type="camera", owner_id=1)
+    db.add(d)
+    db.commit()
+    db.refresh(d)
+    recent = datetime.now(UTC) - timedelta(minutes=1)
+    spec = [("auth_fail", {})] * 5 + [
+        ("net_flow", {"bytes_out": 30000, "protocol": "mqtt"}),
+        ("command", {"cmd": "factory_reset"}),
+    ]
+    persist_events(
+        db, [DeviceEvent(device_id=d.id, event_type=t, payload=p, ts=recent) for t, p in spec]
+    )
+    return d.id
+
+
+def test_zero_weight_metrics_are_not_queried(db_session: Session, monkeypatch):
+    cfg = risk_engine.risk_config.get()
+    cfg["weights"].update({"new_protocol": 0, "command_anomaly_max": 0})
+    monkeypatch.setattr(risk_engine.risk_config, "snapshot", lambda: ConfigSnapshot(cfg))
+    device_id = _seed(db_session)
+
+    plan = risk_metrics.plan(cfg)
+    assert plan.skipped == ["new_protocol", "command_anomaly"]
+    assert risk_metrics.PROTOCOLS not in plan.needs
+    assert risk_metrics.COMMANDS not in plan.needs
+
+    risk_metrics.reset_timings()
+    rs = risk_engine.compute_risk_for_device(db_session, device_id, aggregate=True)
+    assert [r["metric"] for r in rs.reasons] == ["auth_fail_rate", "flow_spike_first"]
+
+    timings = risk_metrics.timing_snapshot()
+    assert "query:window_counts" in timings
+    assert "metric:auth_fail_rate" in timings
+    assert not {"query:protocols", "query:commands", "metric:new_protocol"} & set(timings)
+
+
+def test_registered_metric_joins_pipeline(db_session: Session, monkeypatch):
+    device_id = _seed(db_session)
+
+    def _burst(stats, W, T, device_id):
+        if stats.event_count < 5:
+            return None
+        return {"metric": "event_burst", "count": stats.event_count, "weight": 5}
+
+    monkeypatch.setattr(risk_metrics, "REGISTRY", list(risk_metrics.REGISTRY))
+    risk_metrics.register(risk_metrics.Metric("event_burst", [], _burst))
+
+    rs = risk_engine.compute_risk_for_device(db_session, device_id)
+    assert rs.reasons[-1] == {"metric": "event_burst", "count": 7, "weight": 5}
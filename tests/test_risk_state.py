@@ -0,0 +1,91 @@
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from backend.app.models import Device, DeviceEvent, RiskAction
+from backend.app.services import risk_engine, risk_state
+from backend.app.services.event_ingest import persist_events
+from backend.app.services.risk_config import ConfigSnapshot
+
+
+def _device(db: Session, name: str) -> int:
+    d = Device(name=name, type="sensor", owner_id=1)
+    db.add(d)
+    db.commit()
+    db.refresh(d)
+    return d.id
+
+
+def _event(device_id: int, ts: datetime, **kw) -> DeviceEvent:
+    return DeviceEvent(device_id=device_id, event_type="auth_fail", payload={}, ts=ts, **kw)
+
+
+def test_idle_devices_are_skipped_until_new_events(db_session: Session):
+    now = datetime.now(UTC)
+    idle, active, stale = (_device(db_session, n) for n in ("idle", "active", "stale"))
+    persist_events(db_session, [_event(active, now - timedelta(minutes=1))])
+    # 事件早已过期（且早已写入），窗口为空
+    old = now - timedelta(hours=2)
+    persist_events(db_session, [_event(stale, old, ingested_at=old)])
+    ids = [idle, active, stale]
+
+    # 从未评估过：全部需要评估
+    assert risk_state.due_devices(db_session, ids) == set(ids)
+
+    risk_engine.evaluate_devices_batch(db_session, ids)
+    # 窗口为空且无新事件的设备跳过；窗口内有事件的设备继续评估（事件会过期）
+    assert risk_state.due_devices(db_session, ids) == {active}
+
+    persist_events(db_session, [_event(idle, now)])
+    assert risk_state.due_devices(db_session, ids) == {active, idle}
+
+    risk_engine.compute_risk_for_device(db_session, stale)
+    assert stale not in risk_state.due_devices(db_session, ids)
+
+
+def test_isolated_device_due_for_restore(db_session: Session, monkeypatch):
+    cfg = risk_engine.risk_config.get()
+    cfg["auto_response"]["restore"].update({"enabled": True, "cooldown_seconds": 60})
+    monkeypatch.setattr(risk_engine.risk_config, "snapshot", lambda: ConfigSnapshot(cfg))
+
+    fresh, cooled = _device(db_session, "iso-fresh"), _device(db_session, "iso-cooled")
+    now = datetime.now(UTC)
+    for device_id, at in ((fresh, now), (cooled, now - timedelta(minutes=10))):
+        db_session.add(
+            RiskAction(device_id=device_id, action_type="isolate", executed=True, created_at=at)
+        )
+    db_session.commit()
+    risk_engine.evaluate_devices_batch(db_session, [fresh, cooled])
+
+    assert risk_state.due_devices(db_session, [fresh, cooled]) == set()
+    assert risk_engine.restore_due(db_session, [fresh, cooled]) == {cooled}
+
+
+def test_late_commits_and_late_timestamps_are_due(db_session: Session):
+    now = datetime.now(UTC)
+    late, future = _device(db_session, "late-commit"), _device(db_session, "future-ts")
+    old = now - timedelta(hours=2)
+    persist_events(db_session, [_event(late, old, ingested_at=old)])
+    # 写入时 ts 在未来（设备时钟超前），评估时不在窗口内
+    persist_events(db_session, [_event(future, now - timedelta(minutes=1), ingested_at=old)])
+    ids = [late, future]
+    marks = risk_state.event_watermarks(db_session, ids)
+
+    # 评估发生在该 ts 之前：ts 进入窗口后需要重新评估
+    risk_state.save(db_session, {future: (marks[future], 0)}, now - timedelta(minutes=5))
+    risk_state.save(db_session, {late: (marks[late], 0)}, now)
+    db_session.commit()
+    assert risk_state.due_devices(db_session, ids) == {future}
+
+    # 较小 id 的事件在评估之后才提交：id 不超过水位，按 ingested_at 判定
+    persist_events(db_session, [_event(late, old)])
+    risk_state.save(
+        db_session, {late: (risk_state.event_watermarks(db_session, [late])[late], 0)}, now
+    )
+    db_session.commit()
+    assert risk_state.due_devices(db_session, ids) == {late, future}
+    assert risk_state.new_event_devices(db_session, ids) == {late, future}
+
+    # 重新评估后不再视为新事件（窗口非空仍按窗口规则评估）
+    risk_engine.evaluate_devices_batch(db_session, [future])
+    assert future not in risk_state.new_event_devices(db_session, ids)
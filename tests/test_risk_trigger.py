@@ -0,0 +1,108 @@
+import time
+from datetime import UTC, datetime
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from backend.app.models import Device, RiskScore
+from backend.app.services import event_ingest, risk_trigger
+from backend.app.services.event_ingest import build_values, insert_events
+from backend.app.services.risk_trigger import DirtyEvaluator
+
+
+def _device(db: Session) -> int:
+    d = Device(name="trigger-cam", type="camera", owner_id=1)
+    db.add(d)
+    db.commit()
+    db.refresh(d)
+    return d.id
+
+
+def _wait_idle(ev: DirtyEvaluator, evaluations: int, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        st = ev.status()
+        if st["evaluations"] + st["errors"] >= evaluations and not st["pending"]:
+            return
+        time.sleep(0.01)
+
+
+def test_burst_is_debounced_into_one_evaluation(db_session: Session, monkeypatch):
+    device_id = _device(db_session)
+    ev = DirtyEvaluator(sessionmaker(bind=db_session.get_bind()), debounce_ms=100)
+    monkeypatch.setattr(risk_trigger, "ENABLED", True)
+    monkeypatch.setattr(risk_trigger, "get_evaluator", lambda: ev)
+    try:
+        now = datetime.now(UTC)
+        for _ in range(50):
+            insert_events(db_session, [build_values(device_id, "auth_fail", {}, None, now)])
+        _wait_idle(ev, 1)
+    finally:
+        ev.stop()
+
+    st = ev.status()
+    assert st["marks"] == 50
+    assert st["evaluations"] == 1 and st["coalesced"] == 49
+    db_session.expire_all()
+    scores = db_session.query(RiskScore).filter_by(device_id=device_id).all()
+    assert len(scores) == 1
+    assert scores[0].reasons and scores[0].reasons[0]["auth_fail"] == 50
+
+
+def test_max_delay_bounds_continuous_stream(db_session: Session):
+    calls = []
+    ev = DirtyEvaluator(
+        sessionmaker(bind=db_session.get_bind()),
+        debounce_ms=200,
+        max_delay_ms=300,
+        evaluate=lambda db, device_id: calls.append((device_id, time.monotonic())),
+    )
+    start = time.monotonic()
+    try:
+        # 每 50ms 标记一次，防抖窗口一直未结束，由最大延迟触发评估
+        while time.monotonic() - start < 0.6:
+            ev.mark([7])
+            time.sleep(0.05)
+    finally:
+        ev.stop()
+
+    assert calls and calls[0][0] == 7
+    assert calls[0][1] - start < 0.5
+    assert len(calls) < 12
+
+
+def test_disabled_by_default_does_not_mark(db_session: Session):
+    device_id = _device(db_session)
+    assert event_ingest.risk_trigger.ENABLED is False
+    insert_events(db_session, [build_values(device_id, "auth_fail", {}, None, datetime.now(UTC))])
+    assert risk_trigger.status()["started"] is False
+
+
+def test_leases_limit_triggered_evaluations_to_owned_shards(db_session: Session, monkeypatch):
+    from backend.app.services.risk_scheduler import scheduler_state
+    from backend.app.services.scheduler_lease import LeaseCoordinator
+
+    lease = LeaseCoordinator(lambda: db_session, node_id="trigger-node", shards=2, ttl_seconds=30)
+    lease.sync(db_session)
+    # 另一节点持有分片 1
+    lease._owned = {0}
+    monkeypatch.setattr(scheduler_state, "leases", True)
+    monkeypatch.setattr(scheduler_state, "lease", lease)
+
+    calls = []
+    ev = DirtyEvaluator(
+        sessionmaker(bind=db_session.get_bind()),
+        debounce_ms=10,
+        evaluate=lambda db, device_id: calls.append(device_id),
+    )
+    try:
+        ev.mark([2, 3, 4, 5])
+        deadline = time.monotonic() + 5
+        while ev.status()["evaluations"] + ev.status()["not_owned"] < 4:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    finally:
+        ev.stop()
+        lease.release_all(db_session)
+
+    assert sorted(calls) == [2, 4]
+    assert ev.status()["not_owned"] == 2
@@ -0,0 +1,113 @@
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from sqlalchemy.orm import Session
+
+from backend.app.models import Device, DeviceEvent
+from backend.app.services import risk_engine, risk_window
+from backend.app.services.event_ingest import persist_events
+
+
+@pytest.fixture
+def window_state(monkeypatch):
+    risk_window.reset()
+    monkeypatch.setattr(risk_window, "ENABLED", True)
+    yield
+    risk_window.reset()
+
+
+def _seed(db: Session) -> int:
+    d = Device(name="window-cam", type="camera", owner_id=1)
+    db.add(d)
+    db.commit()
+    db.refresh(d)
+    recent = datetime.now(UTC) - timedelta(minutes=2)
+    spec = [("auth_fail", {})] * 4 + [
+        ("auth_success", {}),
+        ("policy_violation", {"rule": "r1"}),
+        ("net_flow", {"bytes_out": 25000, "protocol": "mqtt"}),
+        ("net_flow", {"bytes_out": 9000, "protocol": "coap"}),
+        ("command", {"cmd": "reboot"}),
+        ("command", {"cmd": "ls"}),
+    ]
+    persist_events(
+        db, [DeviceEvent(device_id=d.id, event_type=t, payload=p, ts=recent) for t, p in spec]
+    )
+    # 超出 5 分钟窗口的旧事件不应计入
+    persist_events(
+        db,
+        [
+            DeviceEvent(
+                device_id=d.id,
+                event_type="auth_fail",
+                payload={},
+                ts=datetime.now(UTC) - timedelta(minutes=30),
+            )
+        ],
+    )
+    return d.id
+
+
+def test_memory_window_matches_sql(db_session: Session, window_state, monkeypatch):
+    # 冷启动：重建后再写入的事件由 ingest 增量累加
+    assert risk_window.rebuild(db_session) == 0
+    device_id = _seed(db_session)
+
+    check = risk_engine.check_window_state(db_session, [device_id])
+    assert check["ready"] is True
+    assert check["mismatches"] == []
+
+    sql = risk_engine.compute_risk_for_device(db_session, device_id, aggregate=True)
+    monkeypatch.setattr(risk_engine, "RISK_WINDOW_STATE", True)
+    mem = risk_engine.compute_risk_for_device(db_session, device_id, aggregate=True)
+    assert (mem.score, mem.level) == (sql.score, sql.level)
+    assert mem.reasons == sql.reasons
+
+
+def test_cold_start_rebuild_from_db(db_session: Session, window_state, monkeypatch):
+    device_id = _seed(db_session)
+    risk_window.reset()
+    assert not risk_window.is_ready()
+
+    monkeypatch.setattr(risk_engine, "RISK_WINDOW_STATE", True)
+    rs = risk_engine.compute_risk_for_device(db_session, device_id, aggregate=True)
+    assert risk_window.is_ready()
+    assert risk_window.status()["devices"] == 1
+    assert risk_engine.check_window_state(db_session, [device_id])["mismatches"] == []
+    assert any(r["metric"] == "command_anomaly" for r in rs.reasons)
+
+
+def test_window_edges_match_sql_bounds(db_session: Session, window_state, monkeypatch):
+    # 宽桶下窗口首尾都落在桶中间：边界外同桶事件不计入，与 SQL 的 [start, end) 一致
+    monkeypatch.setattr(risk_window, "BUCKET_SECONDS", 10)
+    assert risk_window.rebuild(db_session) == 0
+    d = Device(name="window-edge", type="camera", owner_id=1)
+    db_session.add(d)
+    db_session.commit()
+    end = datetime.now(UTC).replace(microsecond=0) - timedelta(minutes=1, seconds=5)
+    start = end - timedelta(minutes=5)
+    tiny = timedelta(microseconds=1)
+    spec = [
+        ("auth_fail", {}, start - tiny),
+        ("auth_fail", {}, start),
+        ("net_flow", {"bytes_out": 500, "protocol": "coap"}, start + tiny),
+        ("net_flow", {"bytes_out": 90000, "protocol": "mqtt"}, end),
+        ("command", {"cmd": "ls"}, end - tiny),
+        ("command", {"cmd": "reboot"}, end),
+    ]
+    persist_events(
+        db_session,
+        [DeviceEvent(device_id=d.id, event_type=t, payload=p, ts=ts) for t, p, ts in spec],
+    )
+
+    snap = risk_window.snapshot([d.id], start, end)[d.id]
+    assert (snap["event_count"], snap["auth_fail"]) == (3, 1)
+    assert (snap["flow_peak"], snap["protocols"], snap["cmds"]) == (500, {"coap"}, ["ls"])
+
+    sql = {d.id: risk_engine.WindowStats()}
+    mem = {d.id: risk_engine.WindowStats()}
+    sql_protos = risk_engine._fill_window_sql(db_session, sql, start, end)
+    mem_protos = risk_engine._fill_window_memory(mem, start, end)
+    fields = ("event_count", "auth_fail", "auth_ok", "policy_viol", "flow_peak", "cmds")
+    assert [getattr(mem[d.id], f) for f in fields] == [getattr(sql[d.id], f) for f in fields]
+    assert mem_protos == sql_protos
@@ -0,0 +1,52 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+
+from backend.app.main import app
+from backend.app.services import risk_scheduler, scheduler_async
+from backend.app.services.scheduler_async import AsyncScheduler
+
+
+def test_ticks_follow_deadlines_and_stop_waits_for_in_flight():
+    starts = []
+    finished = []
+
+    def tick():
+        starts.append(time.monotonic())
+        time.sleep(0.1)
+        finished.append(True)
+
+    async def main():
+        sched = AsyncScheduler(asyncio.get_running_loop(), tick, lambda: 0.2)
+        assert await sched.start()
+        assert not await sched.start()
+        # 第 4 次 tick（0.6s 起，耗时 0.1s）正在执行时停止：等待其完成
+        await asyncio.sleep(0.63)
+        assert await sched.stop()
+        return sched
+
+    sched = asyncio.run(main())
+    assert len(starts) == len(finished) == 4
+    # 按截止时间触发：tick 耗时不累积成漂移
+    assert abs((starts[3] - starts[0]) - 0.6) < 0.05
+    assert sched.missed == 0 and not sched.running
+    assert sched.last_start_latency_ms < 50
+
+
+def test_lifespan_starts_and_stops_scheduler(monkeypatch):
+    runs = []
+    monkeypatch.setattr(scheduler_async, "AUTOSTART", True)
+    monkeypatch.setattr(risk_scheduler, "_evaluate_all_devices", lambda: runs.append(1))
+    monkeypatch.setattr(risk_scheduler.scheduler_state, "priority", False)
+
+    with TestClient(app):
+        status = risk_scheduler.get_status()
+        assert status["running"] and status["mode"] == "asyncio"
+        for _ in range(50):
+            if runs:
+                break
+            time.sleep(0.02)
+    assert runs
+    status = risk_scheduler.get_status()
+    assert not status["running"] and status["mode"] == "thread"
@@ -0,0 +1,81 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from backend.app.db import create_db_engine
+from backend.app.models import Base, SchedulerLease
+from backend.app.services.scheduler_lease import LeaseCoordinator
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def test_two_nodes_split_shards_and_take_over(db_session: Session):
+    a = LeaseCoordinator(lambda: db_session, node_id="node-a", shards=8, ttl_seconds=30)
+    b = LeaseCoordinator(lambda: db_session, node_id="node-b", shards=8, ttl_seconds=30)
+    t = datetime.now(UTC)
+
+    assert a.sync(db_session, t) == set(range(8))
+    # b 加入：a 尚未让出前没有空闲分片
+    assert b.sync(db_session, t) == set()
+    owned_a = a.sync(db_session, t + timedelta(seconds=1))
+    owned_b = b.sync(db_session, t + timedelta(seconds=1))
+    assert len(owned_a) == len(owned_b) == 4
+    assert owned_a.isdisjoint(owned_b)
+    assert a.filter(list(range(1, 17))) == [d for d in range(1, 17) if d % 8 in owned_a]
+
+    # a 失联（不再续约）：租约过期后 b 接管全部分片
+    assert b.sync(db_session, t + timedelta(seconds=20)) == owned_b
+    assert b.sync(db_session, t + timedelta(seconds=40)) == set(range(8))
+
+    b.release_all(db_session)
+    assert db_session.query(SchedulerLease).filter(SchedulerLease.owner.isnot(None)).count() == 0
+
+
+def test_processes_share_sqlite_file(tmp_path):
+    url = f"sqlite:///{tmp_path / 'lease.db'}"
+    engine = create_db_engine(url)
+    Base.metadata.create_all(bind=engine)
+
+    cmd = [sys.executable, "-m", "backend.app.services.scheduler_lease", "--url", url]
+    args = ["--rounds", "12", "--interval", "0.25", "--shards", "8", "--no-release"]
+    procs = [
+        subprocess.Popen(cmd + ["--node", n] + args, cwd=ROOT, stdout=subprocess.PIPE, text=True)
+        for n in ("p1", "p2")
+    ]
+    outs = [p.communicate(timeout=60)[0] for p in procs]
+    assert all(p.returncode == 0 for p in procs)
+
+    last = [json.loads(o.strip().splitlines()[-1]) for o in outs]
+    assert len(last[0]["owned"]) == len(last[1]["owned"]) == 4
+    assert set(last[0]["owned"]).isdisjoint(last[1]["owned"])
+
+    db = sessionmaker(bind=engine)()
+    try:
+        owners = {s.shard: s.owner for s in db.query(SchedulerLease)}
+    finally:
+        db.close()
+        engine.dispose()
+    assert sorted(owners) == list(range(8))
+    assert sorted(owners.values()) == ["p1"] * 4 + ["p2"] * 4
+
+
+def test_failed_sync_stops_claiming_devices_after_ttl(db_session: Session, monkeypatch):
+    node = LeaseCoordinator(lambda: db_session, node_id="flaky", shards=4, ttl_seconds=0.3)
+    assert node.sync(db_session) == set(range(4))
+    assert node.filter([1, 2]) == [1, 2] and node.owns(3)
+
+    def _fail(db, now=None):
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(node, "sync", _fail)
+    node._sync_once()
+    assert node.last_error == "RuntimeError: database unavailable"
+    # 上次成功同步的租约到期后（其它节点此时可接管）不再认为持有任何分片
+    time.sleep(0.35)
+    assert node.filter([1, 2]) == [] and not node.owns(3)
+    assert node.owned() == set() and node.status()["owned"] == []
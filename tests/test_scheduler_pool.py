@@ -0,0 +1,75 @@
+from datetime import UTC, datetime
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, sessionmaker
+
+from backend.app.models import Device, RiskScore
+from backend.app.services import scheduler_pool
+from backend.app.services.event_ingest import build_values, insert_events
+from backend.app.services.risk_config import risk_config
+
+
+def _seed(db: Session, n: int):
+    devices = [Device(name=f"pool-{i}", type="sensor", owner_id=1) for i in range(n)]
+    db.add_all(devices)
+    db.commit()
+    ids = [d.id for d in devices]
+    now = datetime.now(UTC)
+    insert_events(
+        db, [build_values(d, "auth_fail", {}, now, now) for d in ids[::3] for _ in range(5)]
+    )
+    return ids
+
+
+def _factory(db: Session):
+    return sessionmaker(bind=db.get_bind(), autoflush=False, autocommit=False)
+
+
+def test_parallel_scores_every_device_once(db_session: Session):
+    ids = _seed(db_session, 30)
+
+    errors, workers = scheduler_pool.evaluate_parallel(
+        ids, risk_config.snapshot(), workers=4, chunk_size=5, session_factory=_factory(db_session)
+    )
+
+    assert errors == 0
+    assert len(workers) == 4
+    assert sum(w["devices"] for w in workers) == 30
+    assert sum(w["chunks"] for w in workers) == 6
+    counts = dict(
+        db_session.query(RiskScore.device_id, func.count(RiskScore.id))
+        .group_by(RiskScore.device_id)
+        .all()
+    )
+    assert counts == {d: 1 for d in ids}
+    flagged = {d for (d,) in db_session.query(RiskScore.device_id).filter(RiskScore.score > 0)}
+    assert flagged == set(ids[::3])
+
+
+def test_failing_device_is_isolated(db_session: Session, monkeypatch):
+    ids = _seed(db_session, 10)
+    bad = ids[3]
+    real_batch = scheduler_pool.evaluate_devices_batch
+    real_single = scheduler_pool.evaluate_device_risk
+
+    def _batch(db, chunk, **kw):
+        if bad in chunk:
+            raise RuntimeError("boom")
+        return real_batch(db, chunk, **kw)
+
+    def _single(db, device_id, **kw):
+        if device_id == bad:
+            raise RuntimeError("boom")
+        return real_single(db, device_id, **kw)
+
+    monkeypatch.setattr(scheduler_pool, "evaluate_devices_batch", _batch)
+    monkeypatch.setattr(scheduler_pool, "evaluate_device_risk", _single)
+
+    errors, workers = scheduler_pool.evaluate_parallel(
+        ids, risk_config.snapshot(), workers=3, chunk_size=4, session_factory=_factory(db_session)
+    )
+
+    assert errors == 1
+    assert sum(w["errors"] for w in workers) == 1
+    scored = {d for (d,) in db_session.query(RiskScore.device_id)}
+    assert scored == set(ids) - {bad}
@@ -0,0 +1,61 @@
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from backend.app.models import Device
+from backend.app.services.event_ingest import build_values, insert_events
+from backend.app.services.risk_config import risk_config
+from backend.app.services.scheduler_priority import Cadence, DueHeap, PriorityScheduler
+
+
+def test_due_heap_and_cadence():
+    heap = DueHeap()
+    heap.push(1, 30.0)
+    heap.push(2, 10.0)
+    heap.push(3, 20.0)
+    heap.push(2, 40.0)  # 重新排期，旧条目作废
+    assert heap.bump(1, 5.0) and not heap.bump(3, 25.0)
+    assert heap.pop_due(25.0, limit=10) == [1, 3]
+    assert heap.next_due() == 40.0 and len(heap) == 1
+
+    c = Cadence(10, 300)
+    assert c.next_interval("high", 0, False, None, 60) == 10
+    assert c.next_interval("low", 0, True, None, 60) == 10
+    assert c.next_interval("medium", 3, False, None, 60) == 20
+    assert c.next_interval("low", 3, False, 240, 60) == 60
+    # 空闲设备逐次翻倍，直到上限
+    assert c.next_interval("low", 0, False, None, 60) == 60
+    assert c.next_interval("low", 0, False, 60, 60) == 120
+    assert c.next_interval("low", 0, False, 240, 60) == 300
+
+
+def test_tick_backs_off_idle_devices_and_preempts_on_events(db_session: Session):
+    busy, idle = Device(name="busy", type="sensor", owner_id=1), Device(
+        name="idle", type="sensor", owner_id=1
+    )
+    db_session.add_all([busy, idle])
+    db_session.commit()
+    now = datetime.now(UTC)
+    # 调度时钟为模拟时间，写入时间提前到滞后窗口之外（见 risk_state.LAG_SECONDS）
+    row = build_values(busy.id, "net_flow", {"bytes_out": 10}, now, now)
+    insert_events(db_session, [{**row, "ingested_at": now - timedelta(minutes=1)}])
+
+    cfg = risk_config.snapshot()
+    sched = PriorityScheduler(Cadence(10, 600), budget=100)
+    ids = [busy.id, idle.id]
+    t = 1000.0
+    assert sched.tick(db_session, ids, cfg, 60, now=t)["evaluated"] == 2
+    assert sched.heap.due_at(busy.id) == t + 60
+    assert sched.heap.due_at(idle.id) == t + 60
+    assert sched.tick(db_session, ids, cfg, 60, now=t + 1)["evaluated"] == 0
+
+    t += 60
+    sched.tick(db_session, ids, cfg, 60, now=t)
+    assert sched.heap.due_at(busy.id) == t + 60  # 窗口内仍有事件
+    assert sched.heap.due_at(idle.id) == t + 120  # 空闲退避
+
+    # 退避中的设备出现新事件：下次 tick 提前评估
+    insert_events(db_session, [build_values(idle.id, "auth_fail", {}, now, now)])
+    stats = sched.tick(db_session, ids, cfg, 60, now=t + 11)
+    assert stats["preempted"] == 1 and stats["evaluated"] == 1
+    assert sched.status()["evaluated"] == 5
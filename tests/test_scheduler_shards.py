@@ -0,0 +1,85 @@
+import os
+import signal
+import time
+from datetime import UTC, datetime
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from backend.app.models import Device, RiskScore
+from backend.app.services.event_ingest import build_values, insert_events
+from backend.app.services.risk_config import risk_config
+from backend.app.services.scheduler_shards import HashRing, ShardedPool
+
+
+def test_ring_is_balanced_and_stable():
+    ids = list(range(1, 4001))
+    four = HashRing(4)
+    sizes = [len(s) for s in four.split(ids)]
+    assert sum(sizes) == len(ids)
+    assert all(0.15 * len(ids) < n < 0.35 * len(ids) for n in sizes)
+    # 同样的参数得到同样的分片（跨进程一致）
+    assert HashRing(4).split(ids) == four.split(ids)
+
+    # 增加一个分片：只有新分片接手的设备发生移动
+    five = HashRing(5)
+    moved = [d for d in ids if four.shard_for(d) != five.shard_for(d)]
+    assert all(five.shard_for(d) == 4 for d in moved)
+    assert len(moved) < 0.35 * len(ids)
+
+
+def test_sharded_pool_scores_every_device_once(db_session: Session):
+    devices = [Device(name=f"shard-{i}", type="sensor", owner_id=1) for i in range(12)]
+    db_session.add_all(devices)
+    db_session.commit()
+    ids = [d.id for d in devices]
+    now = datetime.now(UTC)
+    insert_events(db_session, [build_values(d, "auth_fail", {}, now, now) for d in ids])
+
+    cfg = risk_config.snapshot()
+    url = db_session.get_bind().url.render_as_string(hide_password=False)
+    pool = ShardedPool(2, url)
+    try:
+        errors, shards = pool.run(ids, cfg, chunk_size=4)
+        # 第二轮：同一设备仍落在同一进程
+        _, again = pool.run(ids, cfg, chunk_size=4)
+    finally:
+        pool.shutdown()
+
+    assert errors == 0
+    assert sorted(s["shard"] for s in shards) == [0, 1]
+    assert sum(s["devices"] for s in shards) == len(ids)
+    assert {s["config_digest"] for s in shards} == {cfg.digest}
+    assert len({s["pid"] for s in shards}) == 2
+    assert {s["shard"]: s["pid"] for s in shards} == {s["shard"]: s["pid"] for s in again}
+    counts = dict(
+        db_session.query(RiskScore.device_id, func.count(RiskScore.id))
+        .group_by(RiskScore.device_id)
+        .all()
+    )
+    assert counts == {d: 2 for d in ids}
+
+
+def test_broken_shard_process_is_respawned(db_session: Session):
+    devices = [Device(name=f"crash-{i}", type="sensor", owner_id=1) for i in range(12)]
+    db_session.add_all(devices)
+    db_session.commit()
+    ids = [d.id for d in devices]
+
+    cfg = risk_config.snapshot()
+    url = db_session.get_bind().url.render_as_string(hide_password=False)
+    pool = ShardedPool(2, url)
+    try:
+        _, shards = pool.run(ids, cfg, chunk_size=4)
+        pids = {s["shard"]: s["pid"] for s in shards}
+        os.kill(pids[0], signal.SIGKILL)
+        time.sleep(0.5)
+        # 损坏的执行器在提交时或本轮结束时重建，之后各分片恢复正常
+        pool.run(ids, cfg, chunk_size=4)
+        errors, again = pool.run(ids, cfg, chunk_size=4)
+    finally:
+        pool.shutdown()
+
+    assert pool.respawns == 1
+    assert errors == 0 and all("error" not in s for s in again)
+    assert {s["shard"]: s["pid"] for s in again}[0] != pids[0]